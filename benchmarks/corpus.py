@@ -0,0 +1,155 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import random
+
+# page size in plotter units
+page_size = (10660, 7995)
+
+# RTL color mode to number of planes
+rtl_planes = {1: 1, -3: 3, -4: 4, 3: 3, 4: 4}
+
+def encode_rle(row):
+    """Run-length encode a row (compression 1)"""
+
+    out = bytearray()
+    i = 0
+    while i < len(row):
+        j = i
+        while j < len(row) and row[j] == row[i] and j-i < 255:
+            j += 1
+        out += bytes((j-i, row[i]))
+        i = j
+    return bytes(out)
+
+def encode_packbits(row):
+    """Packbits encode a row (compression 2)"""
+
+    out = bytearray()
+    i = 0
+    while i < len(row):
+        j = i
+        while j < len(row) and row[j] == row[i] and j-i < 128:
+            j += 1
+        if j-i >= 2:
+            out += bytes((257-(j-i), row[i]))
+            i = j
+            continue
+        j = i+1
+        while j < len(row) and j-i < 128 and not (j+1 < len(row) and row[j] == row[j+1]):
+            j += 1
+        out += bytes((j-i-1,)) + row[i:j]
+        i = j
+    return bytes(out)
+
+def make_rows(byte_width, count, seed=1):
+    """Rows with a mix of long runs and literal data, like scanned plots"""
+
+    rnd = random.Random(seed)
+    rows = []
+    for k in range(count):
+        row = bytearray()
+        while len(row) < byte_width:
+            if rnd.random() < 0.6:
+                row += bytes((rnd.choice((0, 0, 0, 255, 0x0f)),)) * rnd.randint(1, 200)
+            else:
+                row += bytes(rnd.randrange(256) for i in range(rnd.randint(1, 16)))
+        rows.append(bytes(row[:byte_width]))
+    return rows
+
+def _walk(rnd, x, y, count, step, size=page_size):
+    """Random walk of count points on the page"""
+
+    coords = []
+    for k in range(count):
+        x = min(max(x + rnd.randint(-step, step), 0), size[0])
+        y = min(max(y + rnd.randint(-step, step), 0), size[1])
+        coords.append('%d,%d' % (x, y))
+    return coords
+
+def hpgl_polylines(paths, points, seed=1):
+    """HPGL with long absolute polylines, as from CAD output"""
+
+    rnd = random.Random(seed)
+    out = ['IN;SP1;']
+    for k in range(paths):
+        if rnd.random() < 0.05:
+            out.append('SP%d;' % rnd.randint(1, 6))
+        x = rnd.randrange(page_size[0])
+        y = rnd.randrange(page_size[1])
+        out.append('PU;PA%d,%d;PD;PA%s;' % (x, y, ','.join(_walk(rnd, x, y, points, 100))))
+    out.append('PU;SP0;')
+    return ''.join(out).encode('ascii')
+
+def hpgl_labels(labels, length=20, seed=1):
+    """HPGL page dominated by text labels in several sizes and directions"""
+
+    rnd = random.Random(seed)
+    chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789 .,-+/()'
+    out = ['IN;SP1;']
+    for k in range(labels):
+        if rnd.random() < 0.1:
+            out.append('SI%0.2f,%0.2f;' % (rnd.uniform(0.1, 0.4), rnd.uniform(0.15, 0.6)))
+        if rnd.random() < 0.1:
+            out.append('DI%d,%d;' % rnd.choice(((1, 0), (0, 1), (-1, 0), (1, 1))))
+        text = ''.join(rnd.choice(chars) for i in range(rnd.randint(1, length)))
+        out.append('PU;PA%d,%d;LB%s\x03' % (rnd.randrange(page_size[0]), rnd.randrange(page_size[1]), text))
+    out.append('PU;SP0;')
+    return ''.join(out).encode('ascii')
+
+def hpgl_scaled(paths, points, seed=1):
+    """HPGL drawn in user units through IP/SC scaling"""
+
+    rnd = random.Random(seed)
+    out = ['IN;SP1;IP500,500,10000,7500;SC0,1000,0,750;']
+    for k in range(paths):
+        if rnd.random() < 0.02:
+            out.append('SC%d,%d,%d,%d;' % (rnd.randint(-100, 0), rnd.randint(500, 1500), rnd.randint(-100, 0), rnd.randint(400, 1000)))
+        x = rnd.randrange(1000)
+        y = rnd.randrange(750)
+        out.append('PU;PA%d,%d;PD;PA%s;' % (x, y, ','.join(_walk(rnd, x, y, points, 10, (1000, 750)))))
+    out.append('PU;SP0;')
+    return ''.join(out).encode('ascii')
+
+def rtl_image(width, height, color=1, compression=0, seed=1):
+    """RTL raster image in color mode color with row compression compression"""
+
+    planes = rtl_planes[color]
+    byte_width = (width+7)//8
+    encode = {0: bytes, 1: encode_rle, 2: encode_packbits}[compression]
+
+    # a pool of rows is reused, encoding every row is slow for large images
+    rows = [encode(r) for r in make_rows(byte_width, min(height*planes, 64), seed)]
+
+    out = [b'\x1bE\x1b%0B\x1b%1A']
+    out.append(b'\x1b*r%dU\x1b*t300R\x1b*r%dS\x1b*r1A\x1b*b%dM' % (color, width, compression))
+    k = 0
+    for y in range(height):
+        for p in range(planes):
+            data = rows[k % len(rows)]
+            k += 1
+            out.append(b'\x1b*b%d%s' % (len(data), b'W' if p == planes-1 else b'V'))
+            out.append(data)
+    out.append(b'\x1b*rC\x1b%0B\x1bE')
+    return b''.join(out)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import hpgl
+from hpgl import hprtl
+from hpgl import png
+from benchmarks import corpus
+
+# modules that use NumPy when it is available
+numpy_modules = [m for name, m in sorted(sys.modules.items()) if name.startswith('hpgl.') and hasattr(m, 'numpy')]
+
+# corpus sizes, as multiples of the small corpus
+sizes = {'small': 1, 'medium': 4, 'large': 16}
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# timing differences below this many seconds are not counted as regressions,
+# as stages taking a few milliseconds vary by more than any relative tolerance
+min_delta = 0.02
+
+# stages are repeated for at least this many seconds, and the median time
+# is reported, as the best of a handful of runs is still noisy
+min_time = 0.5
+
+def _decode_rows(job):
+    compression, rows, byte_width = job
+    for d in rows:
+        hprtl._decode_row(compression, d, byte_width)
+
+hpgl_stages = [
+    ('parse_hpgl', hpgl.parse_hpgl),
+    ('generate_svg', hpgl.generate_svg)
+]
+
+rtl_stages = [
+    ('parse_hprtl', lambda data: hprtl.parse_hprtl(data, indexed=True)),
+    ('generate_bmp', lambda img: hprtl.generate_bmp(*img)),
+    ('generate_png', lambda img: png.generate_png(*img))
+]
+
+row_stages = [
+    ('decode_row', _decode_rows)
+]
+
+def cases(scale):
+    """List of (name, input, input bytes, stages) benchmark cases"""
+
+    out = []
+
+    for name, data in (
+            ('hpgl_polylines', corpus.hpgl_polylines(100*scale, 200)),
+            ('hpgl_labels', corpus.hpgl_labels(400*scale)),
+            ('hpgl_scaled', corpus.hpgl_scaled(200*scale, 100))):
+        out.append((name, data, len(data), hpgl_stages))
+
+    for color in (1, -3, -4):
+        for compression in (0, 1, 2):
+            data = corpus.rtl_image(7200, 400*scale, color, compression)
+            out.append(('rtl_c%d_m%d' % (color, compression), data, len(data), rtl_stages))
+
+    # row decoders on their own
+    byte_width = 1800
+    rows = corpus.make_rows(byte_width, 1000*scale)
+    for compression, encode in ((1, corpus.encode_rle), (2, corpus.encode_packbits)):
+        data = [encode(r) for r in rows]
+        out.append(('rows_m%d' % compression, (compression, data, byte_width), sum(map(len, data)), row_stages))
+
+    return out
+
+def measure(func, arg, repeat):
+    """Run func(arg), returning (result, median time, peak traced memory)
+
+    func is run at least repeat times, and for at least min_time seconds.
+    """
+
+    times = []
+    end = time.perf_counter() + min_time
+    while len(times) < repeat or time.perf_counter() < end:
+        start = time.perf_counter()
+        result = func(arg)
+        times.append(time.perf_counter() - start)
+
+    # memory is traced in a separate run, as tracing slows things down
+    tracemalloc.start()
+    try:
+        func(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return result, statistics.median(times), peak
+
+def calibrate(repeat):
+    """Time a fixed pure Python workload, to factor out machine speed"""
+
+    def work(n):
+        d = {}
+        for k in range(n):
+            d[k % 1000] = d.get(k % 1000, 0) + len(str(k))
+        return b''.join([bytes((k & 0xff,)) for k in range(n)])
+
+    return measure(work, 50000, repeat)[1]
+
+def run(size='small', repeat=5, select=None):
+    """Run the benchmarks, returning a dict of results"""
+
+    results = {}
+
+    cal = calibrate(repeat)
+
+    for name, data, in_bytes, stages in cases(sizes[size]):
+        if select and not any(s in name for s in select):
+            continue
+
+        # the first stage parses the input, later stages take its output
+        parsed = None
+        for stage, func in stages:
+            result, t, peak = measure(func, data if parsed is None else parsed, repeat)
+            if parsed is None:
+                parsed = result
+            key = '%s/%s' % (name, stage)
+            results[key] = {
+                'seconds': t,
+                'mb_per_s': in_bytes/max(t, 1e-9)/1e6,
+                'peak_mb': peak/1e6,
+                'input_bytes': in_bytes
+            }
+
+    return {
+        'size': size,
+        'calibration': (cal + calibrate(repeat)) / 2,
+        'python': platform.python_version(),
+        'numpy': any(m.numpy is not None for m in numpy_modules),
+        'results': results
+    }
+
+def compare(report, baseline, tolerance):
+    """List of (key, field, baseline, current) regressions beyond tolerance
+
+    Times are compared relative to the calibration time of each run, so a
+    slower or busier machine does not show up as a regression.
+    """
+
+    regressions = []
+
+    speed = report['calibration'] / baseline['calibration']
+
+    base = baseline['results']
+    for key, r in sorted(report['results'].items()):
+        if key not in base:
+            continue
+        b = base[key]
+        t = r['seconds'] / speed
+        if t > b['seconds']*(1+tolerance) and t - b['seconds'] > min_delta:
+            regressions.append((key, 'seconds', b['seconds'], t))
+        if r['peak_mb'] > b['peak_mb']*(1+tolerance) and r['peak_mb'] - b['peak_mb'] > 0.1:
+            regressions.append((key, 'peak_mb', b['peak_mb'], r['peak_mb']))
+
+    return regressions
+
+def print_report(report, baseline=None):
+    base = baseline['results'] if baseline else {}
+    speed = report['calibration'] / baseline['calibration'] if baseline else 1
+
+    print("%-28s %10s %10s %9s %8s" % ("benchmark", "time ms", "MB/s", "peak MB", "change"))
+
+    for key, r in sorted(report['results'].items()):
+        change = ''
+        if key in base:
+            change = "%+0.0f%%" % ((r['seconds'] / speed / max(base[key]['seconds'], 1e-9) - 1)*100)
+        print("%-28s %10.1f %10.2f %9.1f %8s" % (key, r['seconds']*1000, r['mb_per_s'], r['peak_mb'], change))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HPGL and RTL conversion")
+    parser.add_argument('--size', choices=sorted(sizes), default='small', help="corpus size (default: small)")
+    parser.add_argument('--repeat', type=int, default=5, help="minimum repetitions, median is reported (default: 5)")
+    parser.add_argument('--select', action='append', metavar='NAME', help="only run cases with NAME in their name")
+    parser.add_argument('--baseline', default=default_baseline, metavar='FILE', help="baseline results to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the baseline")
+    parser.add_argument('--output', metavar='FILE', help="write the results as JSON to FILE")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="allowed slowdown or memory growth (default: 0.3)")
+    parser.add_argument('--no-numpy', action='store_true', help="run without NumPy")
+    args = parser.parse_args()
+
+    if args.no_numpy:
+        for m in numpy_modules:
+            m.numpy = None
+
+    report = run(args.size, args.repeat, args.select)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print_report(report)
+        print("Saved baseline to '%s'" % args.baseline)
+        return
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['size'] != report['size'] or baseline['numpy'] != report['numpy']:
+            print("Baseline '%s' is for a different size or NumPy setting, not comparing" % args.baseline)
+            baseline = None
+
+    print_report(report, baseline)
+
+    if baseline is None:
+        return
+
+    regressions = compare(report, baseline, args.tolerance)
+
+    for key, field, b, r in regressions:
+        print("Regression: %s %s %0.4g -> %0.4g" % (key, field, b, r))
+
+    if regressions:
+        sys.exit(1)
+
+    print("No regressions")
+
+if __name__ == '__main__':
+    main()
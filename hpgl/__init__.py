@@ -24,5 +24,12 @@ THE SOFTWARE.
 
 __all__ = []
 
-from .hpgl import parse_hpgl, generate_svg, hpgl2svg
-from .hprtl import parse_hprtl, generate_bmp, hprtl2bmp
+from .hpgl import parse_hpgl, iter_hpgl, HPGLInterpreter, HPGLState, generate_svg, write_svg, write_svg_stream, generate_hpgl, write_hpgl, hpgl2svg
+from .hprtl import parse_hprtl, iter_hprtl, preview_hprtl, RTLIndex, generate_bmp, write_bmp, BMPWriter, hprtl2bmp
+from .paths import PathList, merge_paths, simplify_paths, simplify_levels
+from .optimize import optimize_paths, travel_stats
+from .index import PathIndex
+from .png import write_png, generate_png, PNGWriter, hprtl2png
+from .raster import render_paths, hpgl2bmp, hpgl2png
+from .cache import ConversionCache
+from .stats import ParseStats
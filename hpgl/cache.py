@@ -0,0 +1,275 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .version import __version__
+
+def _hash_source(h, source, copy=None, block_size=1 << 20):
+    """Feed a file name, file object or bytes-like object to a hash in blocks
+
+    Text read from a file object is hashed as UTF-8.  If copy is a binary
+    file object, the hashed bytes are also written to it.
+    """
+
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return _hash_source(h, f, copy, block_size)
+
+    if not hasattr(source, 'read'):
+        source = io.BytesIO(source)
+
+    while True:
+        data = source.read(block_size)
+        if not data:
+            break
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        h.update(data)
+        if copy is not None:
+            copy.write(data)
+
+class ConversionCache(object):
+    """On-disk cache of conversion output, keyed by content
+
+    Entries are keyed by a SHA-256 hash of the input bytes, the package
+    version, the output kind and the conversion options, and are stored as
+    files under path.  Reading an entry updates its modification time, and
+    when the total size exceeds max_size the least recently used entries
+    are removed until it is below low_water times max_size.  Entries are
+    written to a temporary file and renamed into place, so several
+    processes can share a cache directory.
+
+    The total size is kept in a file in the cache directory, so that the
+    directory is only scanned when the cache is full.
+    """
+
+    # fraction of max_size left after eviction
+    low_water = 0.9
+
+    def __init__(self, path, max_size=1 << 30):
+        self.path = path
+        self.max_size = max_size
+        self._size = None
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _hash(self, kind, options):
+        h = hashlib.sha256()
+        h.update(("%s\0%s\0%r\0" % (__version__, kind, sorted(options.items()))).encode('utf-8'))
+        return h
+
+    def key(self, data, kind, **options):
+        """Cache key for input data converted to kind with options
+
+        data is a file name, file object or bytes-like object, read in
+        blocks.
+        """
+
+        h = self._hash(kind, options)
+        _hash_source(h, data)
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def _entries(self):
+        """List (mtime, size, path) for all entries"""
+
+        entries = []
+        for sub in os.listdir(self.path):
+            d = os.path.join(self.path, sub)
+            if len(sub) != 2 or not os.path.isdir(d):
+                continue
+            for fn in os.listdir(d):
+                if fn.startswith('.'):
+                    # partially written entry
+                    continue
+                p = os.path.join(d, fn)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+        return entries
+
+    def _update_size(self, delta, total=None):
+        """Add delta to the total size recorded in the cache directory, or set it to total
+
+        Returns the new total, or None if it has not been recorded yet.
+        """
+
+        fd = os.open(os.path.join(self.path, '.size'), os.O_RDWR | os.O_CREAT)
+        with os.fdopen(fd, 'r+') as f:
+            if fcntl is not None:
+                # released when the file is closed
+                fcntl.flock(f, fcntl.LOCK_EX)
+            if total is None:
+                try:
+                    total = int(f.read()) + delta
+                except ValueError:
+                    return None
+            f.seek(0)
+            f.truncate()
+            f.write('%d\n' % total)
+        return total
+
+    def size(self):
+        """Total size of all entries in bytes"""
+
+        self._size = self._update_size(0, sum([e[1] for e in self._entries()]))
+        return self._size
+
+    def open(self, key):
+        """Open an entry for reading, or return None if it is not cached"""
+
+        p = self._entry(key)
+        try:
+            f = open(p, 'rb')
+        except (IOError, OSError):
+            return None
+        try:
+            os.utime(p, None)
+        except OSError:
+            pass
+        return f
+
+    def get(self, key):
+        """Contents of an entry, or None if it is not cached"""
+
+        f = self.open(key)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def _temp(self, key):
+        d = os.path.dirname(self._entry(key))
+        if not os.path.isdir(d):
+            os.makedirs(d, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=d, prefix='.', delete=False)
+
+    def _commit(self, tmp_name, key):
+        size = os.path.getsize(tmp_name)
+        os.replace(tmp_name, self._entry(key))
+        self._size = self._update_size(size)
+        self.evict()
+
+    def put(self, key, data):
+        """Store data as an entry"""
+
+        f = self._temp(key)
+        try:
+            with f:
+                f.write(data)
+            self._commit(f.name, key)
+        except:
+            os.remove(f.name)
+            raise
+
+    def evict(self):
+        """Remove least recently used entries if the cache does not fit max_size"""
+
+        if self._size is not None and self._size <= self.max_size:
+            return
+
+        entries = self._entries()
+        total = sum([e[1] for e in entries])
+
+        if total > self.max_size:
+            # leave some room, so that the next entries do not cause a scan
+            limit = self.max_size*self.low_water
+            entries.sort()
+            for mtime, size, p in entries:
+                if total <= limit:
+                    break
+                try:
+                    os.remove(p)
+                except OSError:
+                    continue
+                total -= size
+
+        self._size = self._update_size(0, total)
+
+    def convert(self, source, fp, kind, func, **options):
+        """Write converted output for source to a binary file object
+
+        source is a file name, file object or bytes-like object.  It is
+        hashed in blocks rather than read into memory.  On a miss,
+        func(source, fp, **options) is called to write the output, with
+        seekable file objects rewound to where they started.  Input from a
+        file object that cannot seek is spooled to a temporary file while
+        hashing, and func is given that binary file instead.  The result is
+        stored, and on a hit the stored output is copied to fp.  Returns True
+        on a hit.
+        """
+
+        spool = None
+
+        if hasattr(source, 'read') and not source.seekable():
+            spool = tempfile.TemporaryFile()
+            h = self._hash(kind, options)
+            _hash_source(h, source, spool)
+            key = h.hexdigest()
+            spool.seek(0)
+            source = spool
+        elif hasattr(source, 'read'):
+            start = source.tell()
+            key = self.key(source, kind, **options)
+            source.seek(start)
+        else:
+            key = self.key(source, kind, **options)
+
+        try:
+            f = self.open(key)
+            if f is not None:
+                with f:
+                    shutil.copyfileobj(f, fp)
+                return True
+
+            tmp = self._temp(key)
+            try:
+                with tmp:
+                    func(source, tmp, **options)
+                    tmp.seek(0)
+                    shutil.copyfileobj(tmp, fp)
+                self._commit(tmp.name, key)
+            except:
+                os.remove(tmp.name)
+                raise
+        finally:
+            if spool is not None:
+                spool.close()
+
+        return False
@@ -24,68 +24,354 @@ THE SOFTWARE.
 
 from __future__ import print_function
 
-def hpgl2svg(argv=None):
-    import sys
+import functools
+import glob
+import json
+import os
+import sys
+import time
+
+hpgl_extensions = ('.plt', '.hpgl', '.hpg', '.hgl', '.gl')
+rtl_extensions = ('.rtl', '.prn')
+
+def _expand_inputs(names, extensions):
+    """Expand globs and directories in a list of input names"""
+
+    files = []
+    for name in names:
+        if os.path.isdir(name):
+            for fn in sorted(os.listdir(name)):
+                path = os.path.join(name, fn)
+                if os.path.splitext(fn)[1].lower() in extensions and os.path.isfile(path):
+                    files.append(path)
+        elif glob.has_magic(name):
+            files.extend(sorted(glob.glob(name)))
+        else:
+            files.append(name)
+    return files
+
+def _output_name(name, extension, output_dir):
+    """Output file name for an input file, input name + extension by default"""
+
+    if output_dir:
+        return os.path.join(output_dir, os.path.basename(name) + extension)
+    return name + extension
+
+def _quiet(*args):
+    pass
+
+def _hpgl_svg(source, fp, simplify=None, stats=None):
     from .hpgl import parse_hpgl
-    from .hpgl import generate_svg
+    from .hpgl import write_svg
+    from .stats import timed
 
-    if argv is None:
-        argv = sys.argv
+    if isinstance(source, str):
+        with open(source, 'r', newline='') as f:
+            return _hpgl_svg(f, fp, simplify, stats)
+
+    paths = parse_hpgl(source, simplify=simplify, stats=stats)
+
+    with timed(stats, 'write_svg'):
+        write_svg(paths, fp)
+
+def _hprtl_image(source, fp, format='bmp', max_size=None, stats=None):
+    if max_size:
+        from .hprtl import preview_hprtl, write_bmp
+        from .png import write_png
+
+        rows, palette = preview_hprtl(source, max_size, indexed=True, stats=stats)
+        if format == 'png':
+            write_png(rows, fp, palette)
+        else:
+            write_bmp(rows, fp, palette)
+    elif format == 'png':
+        from .png import hprtl2png
+        hprtl2png(source, fp, stats=stats)
+    else:
+        from .hprtl import hprtl2bmp
+        hprtl2bmp(source, fp, stats=stats)
+
+def _job_stats(job):
+    """Split the stats option from a job, returning (job, ParseStats or None)"""
+
+    in_name, out_name, options, cache = job
+
+    if not options.get('stats'):
+        return job, None
+
+    from .stats import ParseStats
+
+    options = dict(options)
+    del options['stats']
+    return (in_name, out_name, options, cache), ParseStats()
+
+# ConversionCache objects by (path, max_size), reused across jobs in a process
+_caches = {}
 
-    if len(argv) < 2:
-        print("Missing input file")
-        exit(1)
+def _get_cache(cache):
+    from .cache import ConversionCache
 
-    hpgl_name = argv[1]
-    svg_name = hpgl_name + '.svg'
+    if cache not in _caches:
+        _caches[cache] = ConversionCache(*cache)
+    return _caches[cache]
 
-    if len(argv) > 2:
-        svg_name = argv[2]
+def _convert_cached(job, kind, func, log, stats=None):
+    """Convert a job through its cache, returning True on a cache hit"""
 
-    print("Opening input HPGL file '%s'" % hpgl_name)
+    in_name, out_name, options, cache = job
+
+    if stats is not None:
+        # stats are not part of the cache key
+        func = functools.partial(func, stats=stats)
+
+    log("Converting '%s' to '%s' with cache '%s'" % (in_name, out_name, cache[0]))
+
+    with open(out_name, 'wb') as imgf:
+        hit = _get_cache(cache).convert(in_name, imgf, kind, func, **options)
+
+    log("Cache hit" if hit else "Cache miss")
+    log("Done")
+
+    return hit
+
+def _job_result(stats, hit=False):
+    """Statistics returned by a conversion job"""
+
+    if stats is None:
+        return None
+    if hit:
+        # nothing was parsed
+        return {'cached': True}
+    return stats.as_dict()
+
+def _convert_hpgl(job, verbose=False):
+    """Convert one HPGL file, returning statistics if requested"""
+
+    job, stats = _job_stats(job)
+    hpgl_name, svg_name, options, cache = job
+
+    log = print if verbose else _quiet
+
+    if cache is not None:
+        hit = _convert_cached(job, 'svg', _hpgl_svg, log, stats)
+        return _job_result(stats, hit)
+
+    log("Opening input HPGL file '%s'" % hpgl_name)
     hpglf = open(hpgl_name, 'r', newline='')
-    print("Opening output SVG file '%s'" % svg_name)
+    log("Opening output SVG file '%s'" % svg_name)
     imgf = open(svg_name, 'w')
 
-    print("Parsing HPGL")
+    with hpglf, imgf:
+        log("Converting HPGL to SVG")
 
-    paths = parse_hpgl(hpglf)
+        _hpgl_svg(hpglf, imgf, stats=stats, **options)
 
-    print("Writing SVG")
+    log("Done")
 
-    imgf.write(generate_svg(paths))
+    return _job_result(stats)
 
-    print("Done")
+def _convert_hprtl(job, verbose=False):
+    """Convert one RTL file, returning statistics if requested"""
 
-def hprtl2bmp(argv=None):
-    import sys
-    from .hprtl import parse_hprtl
-    from .hprtl import generate_bmp
+    job, stats = _job_stats(job)
+    rtl_name, img_name, options, cache = job
 
-    if argv is None:
-        argv = sys.argv
+    fmt = options.get('format', 'bmp')
 
-    if len(argv) < 2:
-        print("Missing input file")
-        exit(1)
+    log = print if verbose else _quiet
 
-    rtl_name = argv[1]
-    bmp_name = rtl_name + '.bmp'
+    if cache is not None:
+        hit = _convert_cached(job, fmt, _hprtl_image, log, stats)
+        return _job_result(stats, hit)
 
-    if len(argv) > 2:
-        bmp_name = argv[2]
-    
-    print("Opening input HPRTL file '%s'" % rtl_name)
+    log("Opening input HPRTL file '%s'" % rtl_name)
     rtlf = open(rtl_name, 'rb')
-    print("Opening output BMP file '%s'" % bmp_name)
-    imgf = open(bmp_name, 'wb')
+    log("Opening output %s file '%s'" % (fmt.upper(), img_name))
+    imgf = open(img_name, 'wb')
+
+    with rtlf, imgf:
+        log("Converting RTL to %s" % fmt.upper())
+
+        _hprtl_image(rtlf, imgf, stats=stats, **options)
+
+    log("Done")
+
+    return _job_result(stats)
+
+def _run_job(args):
+    """Run a conversion job, returning (error, seconds, result) instead of raising
 
-    print("Parsing RTL")
+    The first two elements of each job are the input and output file names.
+    """
 
-    plane_data = parse_hprtl(rtlf)
+    func, job = args
+
+    start = time.time()
+    try:
+        result = func(job)
+    except Exception as ex:
+        # don't leave partial output behind
+        try:
+            os.remove(job[1])
+        except OSError:
+            pass
+        return ("%s: %s" % (type(ex).__name__, ex), time.time() - start, None)
+    return (None, time.time() - start, result)
+
+def _run_batch(func, jobs, n_jobs, stats=None):
+    """Run conversion jobs on a process pool and print a summary
+
+    Returns the number of failed jobs.  If a stats dict is given, the
+    results of successful jobs are stored in it by input file name.
+    """
+
+    import concurrent.futures
+
+    if n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+
+    start = time.time()
+    failed = 0
+    in_bytes = 0
+
+    if n_jobs > 1 and len(jobs) > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(n_jobs)
+        chunk = max(1, min(64, len(jobs) // (n_jobs*4)))
+        results = executor.map(_run_job, [(func, job) for job in jobs], chunksize=chunk)
+    else:
+        executor = None
+        results = map(_run_job, [(func, job) for job in jobs])
+
+    try:
+        for job, (err, t, result) in zip(jobs, results):
+            if err is None:
+                print("%s -> %s (%0.2f s)" % (job[0], job[1], t))
+                if stats is not None and result is not None:
+                    stats[job[0]] = result
+                try:
+                    in_bytes += os.path.getsize(job[0])
+                except OSError:
+                    pass
+            else:
+                failed += 1
+                print("%s: failed: %s" % (job[0], err))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    elapsed = max(time.time() - start, 1e-9)
+    done = len(jobs) - failed
+
+    print("Converted %d of %d files in %0.1f s (%0.1f files/s, %0.2f MB/s), %d failed" %
+        (done, len(jobs), elapsed, done/elapsed, in_bytes/elapsed/1e6, failed))
+
+    return failed
+
+def _batch_args(parser, output_ext):
+    parser.add_argument('input', nargs='+',
+        help="input files, globs or directories; a single input may be followed by an output %s file" % output_ext.upper()[1:])
+    parser.add_argument('-o', '--output-dir', metavar='DIR',
+        help="write output files to DIR")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+        help="convert N files in parallel (0: one per CPU)")
+    parser.add_argument('--cache', metavar='DIR',
+        help="reuse output for identical inputs from a cache in DIR")
+    parser.add_argument('--cache-size', type=float, default=1024, metavar='MB',
+        help="maximum cache size in megabytes (default: 1024)")
+    parser.add_argument('--stats', metavar='FILE',
+        help="write parser statistics for each input as JSON to FILE ('-': standard output)")
+
+def _run_jobs(func, jobs, args):
+    """Run jobs from _batch_jobs, write statistics and exit with status 1 on failures"""
+
+    stats = {}
+
+    if len(jobs) != 1:
+        failed = _run_batch(func, jobs, args.jobs, stats)
+    else:
+        failed = 0
+        result = func(jobs[0], verbose=True)
+        if result is not None:
+            stats[jobs[0][0]] = result
+
+    if args.stats:
+        if args.stats == '-':
+            json.dump(stats, sys.stdout, indent=2, sort_keys=True)
+            print()
+        else:
+            with open(args.stats, 'w') as f:
+                json.dump(stats, f, indent=2, sort_keys=True)
+
+    if failed:
+        sys.exit(1)
+
+def _is_output_name(name, extensions, output_ext):
+    """Check whether the second of two names is an output file rather than an input"""
+
+    if name.lower().endswith(output_ext):
+        return True
+    if os.path.isdir(name) or glob.has_magic(name):
+        return False
+    # any name that is not an existing input file
+    return not (os.path.isfile(name) and os.path.splitext(name)[1].lower() in extensions)
+
+def _batch_jobs(args, extensions, output_ext, options):
+    """Build (input, output, options, cache) jobs from parsed arguments"""
+
+    names = args.input
+
+    cache = None
+    if args.cache:
+        cache = (args.cache, int(args.cache_size*1024*1024))
+
+    if args.stats:
+        options = dict(options, stats=True)
+
+    if len(names) == 2 and _is_output_name(names[1], extensions, output_ext) and not os.path.isdir(names[0]) and not glob.has_magic(names[0]):
+        # single input with explicit output name
+        return [(names[0], names[1], options, cache)]
+
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    return [(fn, _output_name(fn, output_ext, args.output_dir), options, cache) for fn in _expand_inputs(names, extensions)]
+
+def hpgl2svg(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert HPGL to SVG")
+    _batch_args(parser, '.svg')
+    parser.add_argument('--simplify', type=float, metavar='TOL',
+        help="simplify paths with tolerance TOL in plotter units")
+
+    if argv is None:
+        args = parser.parse_args()
+    else:
+        args = parser.parse_args(argv[1:])
+
+    jobs = _batch_jobs(args, hpgl_extensions, '.svg', {'simplify': args.simplify})
+
+    _run_jobs(_convert_hpgl, jobs, args)
+
+def hprtl2bmp(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert HP RTL to BMP or PNG")
+    _batch_args(parser, '.bmp')
+    parser.add_argument('-f', '--format', choices=('bmp', 'png'),
+        help="output format (default: from the output file name, or bmp)")
+    parser.add_argument('--max-size', type=int, metavar='PX',
+        help="write a reduced size preview at most PX pixels wide and high")
+
+    if argv is None:
+        args = parser.parse_args()
+    else:
+        args = parser.parse_args(argv[1:])
 
-    print("Writing BMP")
+    fmt = args.format
+    if fmt is None:
+        fmt = 'png' if len(args.input) == 2 and args.input[1].lower().endswith('.png') else 'bmp'
 
-    imgf.write(generate_bmp(plane_data))
+    jobs = _batch_jobs(args, rtl_extensions, '.' + fmt, {'format': fmt, 'max_size': args.max_size})
 
-    print("Done")
+    _run_jobs(_convert_hprtl, jobs, args)
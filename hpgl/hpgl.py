@@ -22,361 +22,804 @@ THE SOFTWARE.
 
 """
 
+import functools
+import io
+import re
+import shutil
+import tempfile
+
 from .fonts import stick_font
+from .index import PathIndex
+from .paths import PathList, merge_paths, simplify_paths, scale_coords
+from .stats import timed, timed_tokens, _CountingReader
+
+# one instruction: separators, a two character mnemonic and its parameters,
+# which run up to the terminator or the next mnemonic.  Label text runs up to
+# the label terminator instead.
+_token_re_fmt = r'[ ;\r\n]*(?:([Ll][Bb])([^%s]*)%s|([^ ;\r\n].)([^A-Za-z;]*))'
+
+def _tokenize_hpgl(glf, label_term='\x03', block_size=65536):
+    """Split HPGL into (mnemonic, parameter string) tokens, reading in blocks"""
+
+    lt = re.escape(label_term)
+    match = re.compile(_token_re_fmt % (lt, lt), re.S).match
+
+    buf = ''
+    pos = 0
+    eof = False
+
+    while not eof:
+        chunk = glf.read(block_size)
+        if isinstance(chunk, (bytes, bytearray)):
+            chunk = chunk.decode('latin-1')
+        if chunk:
+            # keep any incomplete token from the previous block
+            buf = buf[pos:] + chunk
+            pos = 0
+        else:
+            eof = True
+
+        n = len(buf)
+
+        while True:
+            m = match(buf, pos)
+            if m is None:
+                # fewer than two characters left
+                break
+            cmd = m.group(1)
+            if cmd is not None:
+                yield 'LB', m.group(2)
+                pos = m.end()
+                continue
+            cmd = m.group(3).upper()
+            end = m.end()
+            if (end == n or cmd == 'LB') and not eof:
+                # token may continue in the next block
+                break
+            if cmd == 'LB':
+                # unterminated label at end of input
+                yield cmd, buf[m.start(4):]
+                break
+            yield cmd, m.group(4)
+            pos = end
+
+# coordinates are separated by commas and/or whitespace
+_coord_split = re.compile(r'[\s,]+').split
+
+def _parse_coords(cmd, params):
+    """Integer coordinates from PA, PU or PD parameters"""
+
+    params = params.strip(' ,\t\r\n')
+    if not params:
+        return []
+    s = _coord_split(params)
+    if len(s) & 1:
+        raise Exception("Odd number of coordinates (%s%s)" % (cmd, params))
+    return [int(v) for v in s]
+
+def _open_hpgl(gl_file):
+    """Open HPGL input given a file name, a bytes-like buffer or a file object"""
 
-def parse_hpgl(gl_file):
-    """Convert HP Graphics Language (HPGL) to list of paths"""
+    if type(gl_file) == str:
+        return open(gl_file, 'r')
+    elif isinstance(gl_file, (bytes, bytearray, memoryview)):
+        return io.BytesIO(gl_file)
+    return gl_file
 
-    border = 10
+# default page size in plotter units
+# page_size = (8900, 7350)  # letter (landscape)
+# page_size = (7350, 8900)  # letter (portrait)
+page_size = (10660, 7995)  # 7470
 
-    pen_down = False
-    drawn = False
-    cur_pen = 1
-    cur_x = 0
-    cur_y = 0
-    cur_cr_x = cur_x
-    cur_cr_y = cur_y
+class HPGLState(object):
+    """Plotter state of the HPGL interpreter"""
 
-    # page_size = (8900, 7350)  # letter (landscape)
-    # page_size = (7350, 8900)  # letter (portrait)
-    page_size = (10660, 7995)  # 7470
+    __slots__ = ('pen_down', 'drawn', 'cur_pen', 'cur_x', 'cur_y', 'cur_cr_x', 'cur_cr_y',
+        'page_size', 'p1', 'p2', 'scale', 'offset', 'std_font', 'alt_font', 'cur_font',
+        'char_rel_width', 'char_rel_height', 'char_abs_width', 'char_abs_height',
+        'char_size_rel', 'pen_width', 'stroke_weight', 'label_term', 'label_term_print')
 
-    p1 = (0, 0)
-    p2 = page_size
+    def __init__(self):
+        self.drawn = False
 
-    scale = (1, 1)
-    offset = (0, 0)
+        self.page_size = page_size
 
-    std_font = 48
-    alt_font = 48
-    cur_font = 48
+        self.p1 = (0, 0)
+        self.p2 = page_size
 
-    char_rel_width = 0.0075
-    char_rel_height = 0.015
+        self.scale = (1, 1)
+        self.offset = (0, 0)
 
-    char_abs_width = 0
-    char_abs_height = 0
+        self.char_abs_width = 0
+        self.char_abs_height = 0
 
-    char_size_rel = False
+        self.char_size_rel = False
 
-    pen_width = 40*0.35
-    stroke_weight = 0
+        self.pen_width = 40*0.35
+        self.stroke_weight = 0
 
-    label_term = '\x03'
-    label_term_print = False
+        self.reset()
 
-    paths = []
-    labels = []
+    def reset(self):
+        """Reset to defaults, as done by IN and DF"""
 
-    if type(gl_file) == str:
-        glf = open(gl_file, 'r')
+        self.pen_down = False
+        self.cur_pen = 1
+        self.cur_x = 0
+        self.cur_y = 0
+        self.cur_cr_x = 0
+        self.cur_cr_y = 0
+
+        self.std_font = 48
+        self.alt_font = 48
+        self.cur_font = 48
+
+        self.char_rel_width = 0.0075
+        self.char_rel_height = 0.015
+
+        self.label_term = '\x03'
+        self.label_term_print = False
+
+def _hpgl_move(st, cmd, params):
+    """Move through the coordinates in PA, PU or PD parameters
+
+    Returns the points passed through as a flat list, starting with the
+    current position.
+    """
+
+    pts = [st.cur_x, st.cur_y]
+
+    s = _parse_coords(cmd, params)
+    if s:
+        if st.scale == (1, 1) and st.offset == (0, 0):
+            pts.extend(s)
+        else:
+            pts.extend(scale_coords(s, st.scale, st.offset))
+        st.cur_x = st.cur_cr_x = pts[-2]
+        st.cur_y = st.cur_cr_y = pts[-1]
+
+    return pts
+
+def _hpgl_pa(interp, params):
+    # plot absolute
+    st = interp.state
+    pts = _hpgl_move(st, 'PA', params)
+
+    if st.pen_down:
+        st.drawn = True
+        return ((st.cur_pen, st.pen_width, pts),)
+
+def _hpgl_pu(interp, params):
+    # pen up
+    st = interp.state
+    st.pen_down = False
+    paths = None
+    if not st.drawn:
+        # draw point
+        paths = ((st.cur_pen, st.pen_width, [st.cur_x, st.cur_y]),)
+    # move to the given points
+    _hpgl_move(st, 'PU', params)
+    return paths
+
+def _hpgl_pd(interp, params):
+    # pen down
+    st = interp.state
+    st.pen_down = True
+    st.drawn = False
+    pts = _hpgl_move(st, 'PD', params)
+    if len(pts) > 2:
+        # draw through the given points
+        st.drawn = True
+        return ((st.cur_pen, st.pen_width, pts),)
+
+def _hpgl_sp(interp, params):
+    # select pen
+    if params:
+        interp.state.cur_pen = int(params)
+
+def _hpgl_sa(interp, params):
+    # select alternate
+    st = interp.state
+    st.cur_font = st.alt_font
+
+def _hpgl_ss(interp, params):
+    # select standard
+    st = interp.state
+    st.cur_font = st.std_font
+
+def _hpgl_sr(interp, params):
+    # specify relative character sizes
+    st = interp.state
+    st.char_size_rel = True
+
+    if params:
+        s = params.split(',')
+        st.char_rel_width = float(s[0])/100.0
+        st.char_rel_height = float(s[1])/100.0
     else:
-        glf = gl_file
-
-    while True:
-        c = glf.read(1)
-        while c == ';' or c == ' ' or c == '\r' or c == '\n':
-            c = glf.read(1)
-        cmd = c + glf.read(1)
-        cmd = cmd.upper()
-
-        if len(cmd) < 2:
-            break
-
-        if cmd == 'PU':
-            # pen up
-            pen_down = False
-            if not drawn:
-                # draw point
-                paths.append((cur_pen, pen_width, [(cur_x, cur_y, 0, 0)]))
-        elif cmd == 'PD':
-            # pen down
-            pen_down = True
-            drawn = False
-        elif cmd == 'SP':
-            # select pen
-            c = glf.read(1)
-            if c == ';':
-                continue
-            cur_pen = int(c)
-        elif cmd == 'LT':
-            pass
-        elif cmd == 'SA':
-            # select alternate
-            cur_font = alt_font
-        elif cmd == 'SS':
-            # select standard
-            cur_font = std_font
-        elif cmd == 'SR':
-            # specify relative character sizes
-            char_size_rel = True
-
-            s = ''
-            c = glf.read(1)
-            while c != ',':
-                s += c
-                c = glf.read(1)
-            char_rel_width = float(s)/100.0
-            s = ''
-            c = glf.read(1)
-            while c != ';':
-                s += c
-                c = glf.read(1)
-            char_rel_height = float(s)/100.0
-        elif cmd == 'SI':
-            # specify absolute character sizes
-            char_size_rel = False
-
-            char_rel_width = 0.0075
-            char_rel_height = 0.015
-
-            s = ''
-            c = glf.read(1)
-            while c != ',':
-                s += c
-                c = glf.read(1)
-            char_abs_width = float(s)
-            s = ''
-            c = glf.read(1)
-            while c != ';':
-                s += c
-                c = glf.read(1)
-            char_abs_height = float(s)
-        elif cmd == 'SC':
-            # scale
-            s = ''
-            c = glf.read(1)
-            while c != ';':
-                s += c
-                c = glf.read(1)
-            t = 0
-            s = s.split(',')
-            if len(s) == 0:
-                scale = (1, 1)
-                offset = (0, 0)
+        st.char_rel_width = 0.0075
+        st.char_rel_height = 0.015
+
+def _hpgl_si(interp, params):
+    # specify absolute character sizes
+    st = interp.state
+    st.char_size_rel = False
+
+    st.char_rel_width = 0.0075
+    st.char_rel_height = 0.015
+
+    if params:
+        s = params.split(',')
+        st.char_abs_width = float(s[0])
+        st.char_abs_height = float(s[1])
+    else:
+        # default size
+        st.char_size_rel = True
+
+def _hpgl_sc(interp, params):
+    # scale
+    st = interp.state
+    p1 = st.p1
+    p2 = st.p2
+    t = 0
+    s = params.split(',') if params else []
+    if len(s) == 0:
+        st.scale = (1, 1)
+        st.offset = (0, 0)
+    else:
+        if len(s) > 4:
+            t = int(s[4])
+        if t == 1:
+            # isotropic scaling
+            xmin, xmax, ymin, ymax = (float(x) for x in s[0:4])
+            if len(s) > 5:
+                left = min(max(float(s[5])/100, 0), 1)
+                bottom = min(max(float(s[6])/100, 0), 1)
             else:
-                if len(s) > 4:
-                    t = int(s[4])
-                if t == 1:
-                    # isotropic scaling
-                    xmin, xmax, ymin, ymax = (float(x) for x in s[0:4])
-                    if len(s) > 5:
-                        left = min(max(float(s[5])/100, 0), 1)
-                        bottom = min(max(float(s[6])/100, 0), 1)
-                    else:
-                        left = 0.5
-                        bottom = 0.5
-                    xfactor = (p2[0] - p1[0]) / (xmax - xmin)
-                    yfactor = (p2[1] - p1[1]) / (ymax - ymin)
-                    if xfactor < yfactor:
-                        # fill in x, align in y
-                        scale = (xfactor, xfactor)
-                        diff = p2[1] - p1[1] - (ymax - ymin) * scale
-                        offset = (p1[0] - xmin, p1[1] - ymin + diff*bottom)
-                    else:
-                        # fill in y, align in x
-                        scale = (yfactor, yfactor)
-                        diff = p2[0] - p1[0] - (xmax - xmin) * scale
-                        offset = (p1[0] - xmin + diff*left, p1[1] - ymin)
-                elif t == 2:
-                    # point factor
-                    # (xmin, ymin) -> p1
-                    xmin, xfactor, ymin, yfactor = (float(x) for x in s[0:4])
-                    scale = (xfactor, yfactor)
-                    offset = (p1[0] - xmin, p1[1] - ymin)
-                else:
-                    # anisotropic scaling
-                    # (xmin, ymin) -> p1, (xmax, ymax) -> p2
-                    xmin, xmax, ymin, ymax = (float(x) for x in s[0:4])
-                    xfactor = (p2[0] - p1[0]) / (xmax - xmin)
-                    yfactor = (p2[1] - p1[1]) / (ymax - ymin)
-                    scale = (xfactor, yfactor)
-                    offset = (p1[0] - xmin, p1[1] - ymin)
-        elif cmd == 'PA':
-            # plot absolute
-
-            c = ''
-            pts = [(cur_x, cur_y)]
-
-            while c != ';':
-                s = ''
-                c = glf.read(1)
-                if c == ';':
-                    # switch to absolute plotting
-                    break
-                while c == '-' or '0' <= c <= '9':
-                    s += c
-                    c = glf.read(1)
-
-                # cur_x = int(s)
-                cur_x = (int(s)+offset[0])*scale[0]
-
-                s = ''
-                c = glf.read(1)
-                while c == '-' or '0' <= c <= '9':
-                    s += c
-                    c = glf.read(1)
-
-                # cur_y = int(s)
-                cur_y = (int(s)+offset[1])*scale[1]
-
-                cur_cr_x = cur_x
-                cur_cr_y = cur_y
-
-                pts.append((cur_x, cur_y))
-
-            if pen_down:
-                paths.append((cur_pen, pen_width, pts))
-                drawn = True
-        elif cmd == 'LB':
-            # label
-
-            c = glf.read(1)
-
-            if char_size_rel:
-                char_width = char_rel_width * (p2[0]-p1[0])
-                char_height = char_rel_height * (p2[1]-p1[1])
+                left = 0.5
+                bottom = 0.5
+            xfactor = (p2[0] - p1[0]) / (xmax - xmin)
+            yfactor = (p2[1] - p1[1]) / (ymax - ymin)
+            if xfactor < yfactor:
+                # fill in x, align in y
+                st.scale = (xfactor, xfactor)
+                diff = p2[1] - p1[1] - (ymax - ymin) * st.scale
+                st.offset = (p1[0] - xmin, p1[1] - ymin + diff*bottom)
             else:
-                char_width = char_abs_width
-                char_height = char_abs_height
-
-            while label_term_print or c != label_term:
-                if c == '\x08':
-                    cur_x -= char_width * 3/2
-                elif c == '\r':
-                    cur_x = cur_cr_x
-                    cur_y = cur_cr_y
-                elif c == '\n':
-                    cur_cr_y -= char_height * 2
-                    cur_x = cur_cr_x
-                    cur_y = cur_cr_y
-                elif c < ' ':
-                    pass
-                else:
-                    labels.append((cur_x, cur_y, char_width, char_height, cur_pen, cur_font, c))
-                    drawn = True
-                    cur_x += char_width * 3/2
-                    if c == label_term:
-                        break
-                c = glf.read(1)
-        elif cmd == 'DI':
-            # absolute direction
-            s = ''
-            c = glf.read(1)
-            if c == ';':
-                #run = 1
-                #rise = 0
-                continue
-            while c != ',':
-                s += c
-                c = glf.read(1)
-            #run = float(s)
-            s = ''
-            c = glf.read(1)
-            while c != ';':
-                s += c
-                c = glf.read(1)
-            #rise = float(s)
-        elif cmd == 'DF':
-            # defaults
-            pen_down = False
-            cur_pen = 1
-            cur_x = 0
-            cur_y = 0
-            cur_cr_x = cur_x
-            cur_cr_y = cur_y
-
-            std_font = 48
-            alt_font = 48
-            cur_font = 48
-
-            char_rel_width = 0.0075
-            char_rel_height = 0.015
-
-            label_term = '\x03'
-            label_term_print = False
-        elif cmd == 'IN':
-            # init
-            pen_down = False
-            cur_pen = 1
-            cur_x = 0
-            cur_y = 0
-            cur_cr_x = cur_x
-            cur_cr_y = cur_y
-
-            std_font = 48
-            alt_font = 48
-            cur_font = 48
-
-            char_rel_width = 0.0075
-            char_rel_height = 0.015
-
-            label_term = '\x03'
-            label_term_print = False
-        elif cmd == 'IP':
-            # input P1 and P2 (absolute)
-            s = ''
-            c = glf.read(1)
-            while c != ';':
-                s += c
-                c = glf.read(1)
-            s = [float(x) for x in s.split(',')]
-            if len(s) == 2:
-                # set p1, move p2 to keep same x,y offset
-                d = tuple(map(lambda i, j: i - j, p2, p1))
-                p1 = (s[0], s[1])
-                p2 = tuple(map(lambda i, j: i + j, p1, d))
-            elif len(s) == 4:
-                # set p1 and p2
-                p1 = (s[0], s[1])
-                p2 = (s[2], s[3])
-        elif cmd == 'IR':
-            # input P1 and P2 (relative)
-            s = ''
-            c = glf.read(1)
-            while c != ';':
-                s += c
-                c = glf.read(1)
-            s = [float(x)/100 for x in s.split(',')]
-            if len(s) == 2:
-                # set p1, move p2 to keep same x,y offset
-                d = tuple(map(lambda i, j: i - j, p2, p1))
-                p1 = (s[0]*page_size[0], s[1]*page_size[1])
-                p2 = tuple(map(lambda i, j: i + j, p1, d))
-            elif len(s) == 4:
-                # set p1 and p2
-                p1 = (s[0]*page_size[0], s[1]*page_size[1])
-                p2 = (s[2]*page_size[0], s[3]*page_size[1])
-        elif cmd == 'OP':
-            # output P1 and P2 - ignored
-            pass
+                # fill in y, align in x
+                st.scale = (yfactor, yfactor)
+                diff = p2[0] - p1[0] - (xmax - xmin) * st.scale
+                st.offset = (p1[0] - xmin + diff*left, p1[1] - ymin)
+        elif t == 2:
+            # point factor
+            # (xmin, ymin) -> p1
+            xmin, xfactor, ymin, yfactor = (float(x) for x in s[0:4])
+            st.scale = (xfactor, yfactor)
+            st.offset = (p1[0] - xmin, p1[1] - ymin)
         else:
-            raise Exception("Unknown HPGL command (%s)" % cmd)
+            # anisotropic scaling
+            # (xmin, ymin) -> p1, (xmax, ymax) -> p2
+            xmin, xmax, ymin, ymax = (float(x) for x in s[0:4])
+            xfactor = (p2[0] - p1[0]) / (xmax - xmin)
+            yfactor = (p2[1] - p1[1]) / (ymax - ymin)
+            st.scale = (xfactor, yfactor)
+            st.offset = (p1[0] - xmin, p1[1] - ymin)
+
+def _hpgl_lb(interp, params):
+    # label
+    st = interp.state
+    labels = interp.labels
+
+    if st.char_size_rel:
+        char_width = st.char_rel_width * (st.p2[0]-st.p1[0])
+        char_height = st.char_rel_height * (st.p2[1]-st.p1[1])
+    else:
+        char_width = st.char_abs_width
+        char_height = st.char_abs_height
 
-    # render text
-    for lb in labels:
-        x, y, cw, ch, pen, font, c = lb
-        if stroke_weight < 9999:
-            pw = 0.1 * min(ch, 1.5*cw) * 1.13**stroke_weight
+    if st.stroke_weight < 9999:
+        label_width = 0.1 * min(char_height, 1.5*char_width) * 1.13**st.stroke_weight
+    else:
+        label_width = st.pen_width
+
+    paths = []
+    cur_x = st.cur_x
+    cur_y = st.cur_y
+
+    for c in params:
+        if c == '\x08':
+            cur_x -= char_width * 3/2
+        elif c == '\r':
+            cur_x = st.cur_cr_x
+            cur_y = st.cur_cr_y
+        elif c == '\n':
+            st.cur_cr_y -= char_height * 2
+            cur_x = st.cur_cr_x
+            cur_y = st.cur_cr_y
+        elif c < ' ':
+            pass
         else:
-            pw = pen_width
-        if c in stick_font:
-            chr_paths = stick_font[c]
-            for pts in chr_paths:
-                path = []
-                for p in pts:
-                    path.append((p[0]/4*cw+x, p[1]/8*cw+y))
-                paths.append((pen, pw, path))
+            lb = (cur_x, cur_y, char_width, char_height, st.cur_pen, label_width, st.cur_font, c)
+            if labels is None:
+                paths.extend(_render_label(lb))
+            else:
+                labels.append(lb)
+            st.drawn = True
+            cur_x += char_width * 3/2
+
+    st.cur_x = cur_x
+    st.cur_y = cur_y
+
+    return paths
+
+def _hpgl_in(interp, params):
+    # init, defaults
+    interp.state.reset()
+
+def _hpgl_ip(interp, params):
+    # input P1 and P2 (absolute)
+    st = interp.state
+    s = [float(x) for x in params.split(',')] if params else []
+    if len(s) == 0:
+        # default P1 and P2
+        st.p1 = (0, 0)
+        st.p2 = st.page_size
+    elif len(s) == 2:
+        # set p1, move p2 to keep same x,y offset
+        d = tuple(map(lambda i, j: i - j, st.p2, st.p1))
+        st.p1 = (s[0], s[1])
+        st.p2 = tuple(map(lambda i, j: i + j, st.p1, d))
+    elif len(s) == 4:
+        # set p1 and p2
+        st.p1 = (s[0], s[1])
+        st.p2 = (s[2], s[3])
+
+def _hpgl_ir(interp, params):
+    # input P1 and P2 (relative)
+    st = interp.state
+    page_size = st.page_size
+    s = [float(x)/100 for x in params.split(',')] if params else []
+    if len(s) == 0:
+        # default P1 and P2
+        st.p1 = (0, 0)
+        st.p2 = page_size
+    elif len(s) == 2:
+        # set p1, move p2 to keep same x,y offset
+        d = tuple(map(lambda i, j: i - j, st.p2, st.p1))
+        st.p1 = (s[0]*page_size[0], s[1]*page_size[1])
+        st.p2 = tuple(map(lambda i, j: i + j, st.p1, d))
+    elif len(s) == 4:
+        # set p1 and p2
+        st.p1 = (s[0]*page_size[0], s[1]*page_size[1])
+        st.p2 = (s[2]*page_size[0], s[3]*page_size[1])
+
+def _hpgl_ignore(interp, params):
+    pass
+
+class HPGLInterpreter(object):
+    """HPGL interpreter
+
+    Commands are dispatched through the handlers dict, which maps two
+    character mnemonics to functions called as handler(interp, params) with
+    the interpreter and the parameter string.  Handlers update interp.state
+    and return an iterable of (pen, width, coords) paths to output, or None.
+    Commands without a handler raise an exception.
+
+    Label characters are rendered in place, or collected in labels instead
+    if a list is passed.
+    """
+
+    # default command handlers
+    commands = {
+        'PA': _hpgl_pa,
+        'PU': _hpgl_pu,
+        'PD': _hpgl_pd,
+        'SP': _hpgl_sp,
+        'LT': _hpgl_ignore,
+        'SA': _hpgl_sa,
+        'SS': _hpgl_ss,
+        'SR': _hpgl_sr,
+        'SI': _hpgl_si,
+        'SC': _hpgl_sc,
+        'LB': _hpgl_lb,
+        'DI': _hpgl_ignore, # absolute direction
+        'DF': _hpgl_in,
+        'IN': _hpgl_in,
+        'IP': _hpgl_ip,
+        'IR': _hpgl_ir,
+        'OP': _hpgl_ignore # output P1 and P2
+    }
+
+    def __init__(self, labels=None, handlers=None):
+        self.state = HPGLState()
+        self.labels = labels
+        self.handlers = dict(self.commands)
+        if handlers:
+            for cmd, handler in handlers.items():
+                self.register(cmd, handler)
+
+    def register(self, cmd, handler):
+        """Set the handler for a mnemonic, None to ignore the command"""
+
+        self.handlers[cmd.upper()] = handler if handler is not None else _hpgl_ignore
+
+    def run(self, glf, stats=None):
+        """Interpret HPGL from a file object, yielding paths in plotter coordinates
+
+        Paths are (pen, width, coords) tuples with flat coordinate lists.
+        Command statistics are recorded in stats if set.
+        """
+
+        get = self.handlers.get
+
+        if stats is not None:
+            glf = _CountingReader(glf, stats)
+
+        tokens = _tokenize_hpgl(glf, self.state.label_term)
+
+        if stats is not None:
+            tokens = timed_tokens(tokens, stats)
+
+        for cmd, params in tokens:
+            handler = get(cmd)
+            if handler is None:
+                raise Exception("Unknown HPGL command (%s)" % cmd)
+            paths = handler(self, params)
+            if paths:
+                for path in paths:
+                    yield path
+
+def _iter_hpgl(glf, labels=None, stats=None, handlers=None):
+    """Interpret HPGL, yielding paths in plotter coordinates
+
+    Paths are (pen, width, coords) tuples with flat coordinate lists.
+    Label characters are rendered in place, or collected in labels instead
+    if a list is passed.  Command statistics are recorded in stats if set.
+    handlers is a dict of extra command handlers (see HPGLInterpreter).
+    """
+
+    return HPGLInterpreter(labels, handlers).run(glf, stats)
+
+@functools.lru_cache(maxsize=1024)
+def _glyph(c, cw):
+    """Stroke coordinates of a character scaled to a character width
+
+    Returns a tuple of (xs, ys) pairs, one per stroke.  The stick font is
+    scaled by the character width in both directions, so the character
+    height does not affect the geometry.
+    """
+
+    strokes = []
+    for pts in stick_font.get(c, ()):
+        strokes.append((tuple([p[0]/4*cw for p in pts]), tuple([p[1]/8*cw for p in pts])))
+    return tuple(strokes)
+
+@functools.lru_cache(maxsize=1024)
+def _glyph_bounds(c, cw):
+    """Bounding box of a scaled character, or None if it has no strokes"""
+
+    strokes = _glyph(c, cw)
+    if not strokes:
+        return None
+    return (min(min(xs) for xs, ys in strokes), min(min(ys) for xs, ys in strokes),
+        max(max(xs) for xs, ys in strokes), max(max(ys) for xs, ys in strokes))
+
+def _render_label(lb):
+    """Render a label character to a list of paths"""
+
+    x, y, cw, ch, pen, pw, font, c = lb
+    paths = []
+    for xs, ys in _glyph(c, cw):
+        path = [0]*(len(xs)*2)
+        path[0::2] = [v+x for v in xs]
+        path[1::2] = [v+y for v in ys]
+        paths.append((pen, pw, path))
+    return paths
+
+def iter_hpgl(gl_file, bounds=None):
+    """Parse HP Graphics Language (HPGL), yielding paths as they are parsed
+
+    Paths are (pen, width, pts) tuples in plotter coordinates, without the
+    border and y axis flip applied by parse_hpgl.  Label text is rendered in
+    place.  If bounds is a list, it is updated in place with the running
+    bounding box [min_x, min_y, max_x, max_y] of the paths yielded so far.
+    """
+
+    if bounds is not None:
+        bounds[:] = [float('inf'), float('inf'), float('-inf'), float('-inf')]
+
+    for pen, width, coords in _iter_hpgl(_open_hpgl(gl_file)):
+        xs = coords[0::2]
+        ys = coords[1::2]
+        if bounds is not None:
+            bounds[0] = min(bounds[0], min(xs))
+            bounds[1] = min(bounds[1], min(ys))
+            bounds[2] = max(bounds[2], max(xs))
+            bounds[3] = max(bounds[3], max(ys))
+        yield (pen, width, list(zip(xs, ys)))
+
+def parse_hpgl(gl_file, render_labels=True, merge=False, simplify=None, flip=True, stats=None, handlers=None):
+    """Convert HP Graphics Language (HPGL) to list of paths
+
+    With render_labels=False, label characters are not converted to paths but
+    kept in the labels attribute of the returned PathList, so that write_svg
+    can place them as references to shared glyph definitions.
+
+    With merge=True, consecutive paths that continue each other with the same
+    pen are joined into single polylines (see merge_paths).
+
+    If simplify is set, paths are simplified with that tolerance in plotter
+    units (see simplify_paths).
+
+    With flip=False, paths are returned in plotter coordinates instead of
+    being shifted by the border and flipped for SVG output.
+
+    If stats is a ParseStats object, per command counts and times, the
+    number of input characters and the time taken by each phase are
+    recorded in it.
+
+    handlers is a dict of extra command handlers by mnemonic, used to
+    support commands the interpreter does not know (see HPGLInterpreter).
+    """
+
+    border = 10
+
+    labels = []
+    paths = PathList()
+    with timed(stats, 'interpret'):
+        for pen, width, coords in _iter_hpgl(_open_hpgl(gl_file), labels, stats, handlers):
+            paths.add(pen, width, coords)
+
+    if render_labels:
+        # render text
+        with timed(stats, 'labels'):
+            for lb in labels:
+                for pen, width, coords in _render_label(lb):
+                    paths.add(pen, width, coords)
+    else:
+        paths.labels = labels
+
+    if merge:
+        with timed(stats, 'merge'):
+            paths = merge_paths(paths)
+
+    if simplify is not None:
+        with timed(stats, 'simplify'):
+            paths = simplify_paths(paths, simplify)
 
     # determine size
+    with timed(stats, 'bounds'):
+        min_x, min_y, max_x, max_y = paths.bounds()
+
+        for lb in paths.labels:
+            b = _glyph_bounds(lb[7], lb[2])
+            if b is not None:
+                max_x = max(lb[0]+b[2], max_x)
+                max_y = max(lb[1]+b[3], max_y)
+
+    max_x = round(max(max_x, 0)+0.5)
+    max_y = round(max(max_y, 0)+0.5)
+
+    max_x += border*2
+    max_y += border*2
+
+    if flip:
+        # flip y axis and shift
+        with timed(stats, 'flip'):
+            paths = paths.flip_y(max_y, border)
+
+    return paths, max_x, max_y
+
+pen_colors = ['none', 'black', 'blue', 'green', 'yellow', 'red', 'magenta', 'cyan']
+
+def _svg_header(width, height, view_box=None, pad=0, xlink=False):
+    """Generate SVG document header"""
+
+    svg = '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+    svg += '<!-- Created with python-hpgl (http://github.com/alexforencich/python-hpgl/) -->\n'
+    svg += '<svg width="%d" height="%d" ' % (width, height)
+    if view_box is not None:
+        svg += 'viewBox="%s %s %s %s" ' % tuple(['%d' % v if v == int(v) else '%0.1f' % v for v in view_box])
+    svg += 'xmlns="http://www.w3.org/2000/svg" '
+    if xlink:
+        svg += 'xmlns:xlink="http://www.w3.org/1999/xlink" '
+    svg += 'version="1.1"' + ' '*pad + '>\n'
+    svg += '<style>path {fill: none; stroke-linecap: round; stroke-linejoin: round;}</style>\n'
+    return svg
+
+def _svg_element(pen, width, coords):
+    """Generate SVG element for a single path from flat coordinates"""
+
+    pen_color = pen_colors[pen]
+    if len(coords) == 2:
+        return '<rect x="%0.1f" y="%0.1f" width="%.3f" height="%.3f" fill="%s" />\n' % (coords[0], coords[1], width, width, pen_color)
+    else:
+        d = ('%0.1f,%0.1f L'*(len(coords) >> 1))[:-2] % tuple(coords)
+        return '<path fill="none" stroke="%s" stroke-width="%.3f" d="M%s" />\n' % (pen_color, width, d)
+
+def _svg_glyph_def(c):
+    """Generate SVG path definition for a character in unit character width"""
+
+    d = ' '.join(['M' + ' L'.join(['%g,%g' % (p[0]/4, p[1]/8) for p in pts]) for pts in stick_font[c]])
+    return '<path id="glyph-%d" d="%s" />\n' % (ord(c), d)
+
+def _svg_label(lb):
+    """Generate SVG reference to a glyph definition for a label character"""
+
+    x, y, cw, ch, pen, pw, font, c = lb
+    return '<use xlink:href="#glyph-%d" transform="translate(%0.1f,%0.1f) scale(%g,%g)" stroke="%s" stroke-width="%.4g" />\n' % (ord(c), x, y, cw, -cw, pen_colors[pen], pw/abs(cw))
+
+def _is_binary(fp):
+    """Determine whether a file object expects bytes"""
+
+    if isinstance(fp, io.TextIOBase):
+        return False
+    if isinstance(fp, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+    return 'b' in str(getattr(fp, 'mode', ''))
+
+class _ChunkWriter(object):
+    """Collect small text writes into large chunks for a text or binary file"""
+
+    def __init__(self, fp, chunk_size=1 << 16):
+        self.fp = fp
+        self.binary = _is_binary(fp)
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+
+    def write(self, s):
+        self.chunks.append(s)
+        self.size += len(s)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            data = ''.join(self.chunks)
+            if self.binary:
+                data = data.encode('utf-8')
+            self.fp.write(data)
+            self.chunks = []
+            self.size = 0
+
+def _label_in_window(lb, window):
+    """Determine whether a label character overlaps a window"""
+
+    b = _glyph_bounds(lb[7], lb[2])
+    if b is None:
+        return False
+    # glyphs extend up from the label position, with y flipped
+    return (lb[0]+b[0] <= window[2] and lb[0]+b[2] >= window[0] and
+        lb[1]-b[3] <= window[3] and lb[1]-b[1] >= window[1])
+
+def _path_in_window(paths, i, window):
+    """Determine whether the bounding box of a path overlaps a window"""
+
+    c = paths.path_coords(i)
+    xs = c[0::2]
+    ys = c[1::2]
+    return (min(xs) <= window[2] and max(xs) >= window[0] and
+        min(ys) <= window[3] and max(ys) >= window[1])
+
+def write_svg(paths, svg_file, simplify=None, window=None, index=None):
+    """Write SVG from list of paths to a text or binary file object
+
+    If simplify is set, paths are simplified with that tolerance in plotter
+    units before writing.
+
+    If window is set to (x0, y0, x1, y1), only paths that intersect that
+    rectangle are written, with the document view set to the window.  Paths
+    are looked up in index, a PathIndex of the paths, which is built if not
+    given; reuse one index for many windows.  The index must hold the same
+    paths in the same order, but may be built before simplification.
+    """
+
+    paths, max_x, max_y = paths
+
+    if simplify is not None:
+        paths = simplify_paths(paths, simplify)
+
+    labels = getattr(paths, 'labels', ())
+
+    if window is not None:
+        if not isinstance(paths, PathList):
+            paths = PathList(paths)
+        if index is None:
+            index = PathIndex(paths)
+        elif len(index.paths) != len(paths):
+            raise Exception("Index does not match the paths")
+        x0, y0, x1, y1 = window
+        window = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        selected = index.query(*window)
+        if index.paths is not paths:
+            # the indexed boxes may be larger than those of the paths being
+            # written, for instance before simplification
+            selected = [i for i in selected if _path_in_window(paths, i, window)]
+        labels = [lb for lb in labels if _label_in_window(lb, window)]
+
+    out = _ChunkWriter(svg_file)
+
+    # unrendered label characters, placed as references to glyph definitions
+    labels = [lb for lb in labels if lb[7] in stick_font and lb[2] != 0]
+
+    if window is not None:
+        w = window[2] - window[0]
+        h = window[3] - window[1]
+        out.write(_svg_header(w, h, (window[0], window[1], w, h), xlink=bool(labels)))
+    else:
+        out.write(_svg_header(max_x, max_y, xlink=bool(labels)))
+
+    if labels:
+        out.write('<defs>\n')
+        for c in sorted(set([lb[7] for lb in labels])):
+            out.write(_svg_glyph_def(c))
+        out.write('</defs>\n')
+
+    if window is not None:
+        coords = paths.coords
+        offsets = paths.offsets
+        for i in selected:
+            out.write(_svg_element(paths.pens[i], paths.widths[i], coords[offsets[i]*2:offsets[i+1]*2]))
+    elif isinstance(paths, PathList):
+        coords = paths.coords
+        offsets = paths.offsets
+        for i in range(len(paths)):
+            out.write(_svg_element(paths.pens[i], paths.widths[i], coords[offsets[i]*2:offsets[i+1]*2]))
+    else:
+        for path in paths:
+            pen, width, pts = path
+            out.write(_svg_element(pen, width, [v for p in pts for v in (p[0], p[1])]))
+
+    for lb in labels:
+        out.write(_svg_label(lb))
+
+    out.write('</svg>\n')
+    out.flush()
+
+def generate_svg(paths, simplify=None, window=None, index=None):
+    """Generate SVG from list of paths"""
+
+    svg = io.StringIO()
+    write_svg(paths, svg, simplify, window, index)
+    return svg.getvalue()
+
+def write_svg_stream(paths, svg_file, border=10):
+    """Write SVG from an iterable of paths in plotter coordinates
+
+    Elements are written as the paths arrive, so memory use does not grow
+    with the size of the drawing.  The y axis is flipped by negating y and
+    shifting the viewBox, and the document size is patched into the header
+    at the end.  Output that cannot seek is spooled through a temporary file.
+    """
+
+    binary = _is_binary(svg_file)
+    seekable = svg_file.seekable()
+
+    # reserve space for the header, to be filled in once the size is known
+    big = 10**15
+    header_len = len(_svg_header(big, big, (0, -big, big, big)))
+
+    if seekable:
+        spool = None
+        start = svg_file.tell()
+        out = _ChunkWriter(svg_file)
+        out.write(' '*header_len)
+    else:
+        spool = tempfile.SpooledTemporaryFile(max_size=1 << 24, mode='w+b' if binary else 'w+')
+        out = _ChunkWriter(spool)
+
     max_x = 0
     max_y = 0
 
-    for path in paths:
-        pen, width, pts = path
+    for pen, width, pts in paths:
         for p in pts:
             max_x = max(p[0], max_x)
             max_y = max(p[1], max_y)
+        out.write(_svg_element(pen, width, [v for p in pts for v in (p[0]+border, -p[1]-border)]))
+
+    out.write('</svg>\n')
+    out.flush()
 
     max_x = round(max_x+0.5)
     max_y = round(max_y+0.5)
@@ -384,47 +827,61 @@ def parse_hpgl(gl_file):
     max_x += border*2
     max_y += border*2
 
-    # flip y axis and shift
-    paths2 = []
-    for path in paths:
-        pen, width, pts = path
-        pts2 = []
-        for p in pts:
-            pts2.append((p[0]+border, max_y-p[1]-border))
-        paths2.append((pen, width, pts2))
+    header = _svg_header(max_x, max_y, (0, -max_y, max_x, max_y))
 
-    return paths2, max_x, max_y
+    if spool is None:
+        header = _svg_header(max_x, max_y, (0, -max_y, max_x, max_y), header_len-len(header))
+        end = svg_file.tell()
+        svg_file.seek(start)
+        svg_file.write(header.encode('utf-8') if binary else header)
+        svg_file.seek(end)
+    else:
+        svg_file.write(header.encode('utf-8') if binary else header)
+        spool.seek(0)
+        shutil.copyfileobj(spool, svg_file)
+        spool.close()
 
-def generate_svg(paths):
-    """Generate SVG from list of paths"""
+def write_hpgl(paths, gl_file):
+    """Write list of paths in plotter coordinates as HPGL
 
-    paths, max_x, max_y = paths
+    Paths are drawn in order with PA/PD/PU, selecting pens as needed.
+    Coordinates are rounded to whole plotter units.  Unrendered labels are
+    not written.
+    """
 
-    pen_colors = ['none', 'black', 'blue', 'green', 'yellow', 'red', 'magenta', 'cyan']
+    out = _ChunkWriter(gl_file)
 
-    svg = '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
-    svg += '<!-- Created with python-hpgl (http://github.com/alexforencich/python-hpgl/) -->\n'
-    svg += '<svg width="%d" height="%d" xmlns="http://www.w3.org/2000/svg" version="1.1">\n' % (max_x, max_y)
-    svg += '<style>path {fill: none; stroke-linecap: round; stroke-linejoin: round;}</style>\n'
+    out.write('IN;\n')
+
+    cur_pen = None
 
-    for path in paths:
-        pen, width, pts = path
-        pen_color = pen_colors[pen]
-        if len(pts) == 1:
-            svg += '<rect x="%0.1f" y="%0.1f" width="%.3f" height="%.3f" fill="%s" />\n' % (pts[0][0], pts[0][1], width, width, pen_color)
+    if isinstance(paths, PathList):
+        coords = paths.coords
+        offsets = paths.offsets
+        flat = ((paths.pens[i], paths.widths[i], coords[offsets[i]*2:offsets[i+1]*2]) for i in range(len(paths)))
+    else:
+        flat = ((pen, width, [v for p in pts for v in (p[0], p[1])]) for pen, width, pts in paths)
+
+    for pen, width, c in flat:
+        if pen != cur_pen:
+            out.write('SP%d;\n' % pen)
+            cur_pen = pen
+        c = [str(int(round(v))) for v in c]
+        if len(c) == 2:
+            # single point
+            out.write('PA%s,%s;PD;PU;\n' % (c[0], c[1]))
         else:
-            svg += '<path fill="none" stroke="%s" stroke-width="%.3f" d="M' % (pen_color, width)
-            first = True
-            for p in pts:
-                if not first:
-                    svg += ' L'
-                svg += '%0.1f,%0.1f' % p
-                first = False
-            svg += '" />\n'
+            out.write('PA%s,%s;PD;PA%s;PU;\n' % (c[0], c[1], ','.join(c[2:])))
 
-    svg += '</svg>\n'
+    out.write('SP0;\n')
+    out.flush()
 
-    return svg
+def generate_hpgl(paths):
+    """Generate HPGL from list of paths in plotter coordinates"""
+
+    gl = io.StringIO()
+    write_hpgl(paths, gl)
+    return gl.getvalue()
 
 def hpgl2svg(gl_file):
     """Convert HP Graphics Language (HPGL) to SVG"""
@@ -22,11 +22,243 @@ THE SOFTWARE.
 
 """
 
+import collections
+import concurrent.futures
 import io
+import itertools
+import math
+import mmap
+import re
+import shutil
 import struct
+import tempfile
+import time
 
-def parse_hprtl(rtl_file):
-    """Convert HP Raster Transfer Language (RTL) to pixel data"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .stats import timed
+
+# below this many bytes of row data, NumPy call overhead outweighs the savings
+numpy_threshold = 256
+
+# single byte strings, for repeat fills
+_byte = [bytes((b,)) for b in range(256)]
+
+# parameter digits of an escape sequence, null bytes are ignored
+_param_re = re.compile(br'[0-9\-\x00]*')
+
+# rows combined at a time with NumPy, to bound temporary memory use
+block_rows = 256
+
+# byte to eight pixel lookup tables for each plane bit weight; RTL color
+# modes have at most four planes
+_bit_luts = [[bytes(((b >> k) & 1) << i for k in range(7, -1, -1)) for b in range(256)] for i in range(4)]
+
+# translation tables picking pixel k of each byte for each plane bit weight
+_bit_select = [[bytes(((b >> (7-k)) & 1) << i for b in range(256)) for i in range(4)] for k in range(8)]
+
+def _open_rtl(rtl_file):
+    """Get the contents of an RTL file as a buffer
+
+    Accepts a file name, a file object or a bytes-like object.  Files are
+    memory mapped where possible and read otherwise.  Returns (buf, start)
+    with start the offset of the current position of a file object.
+    """
+
+    if type(rtl_file) == str:
+        with open(rtl_file, 'rb') as f:
+            return _open_rtl(f)
+
+    if not hasattr(rtl_file, 'read') or isinstance(rtl_file, mmap.mmap):
+        if not hasattr(rtl_file, 'find'):
+            rtl_file = bytes(rtl_file)
+        return rtl_file, 0
+
+    try:
+        start = rtl_file.tell()
+        buf = mmap.mmap(rtl_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        # not a regular file, or empty
+        return rtl_file.read(), 0
+
+    # consume the input, as reading it would
+    rtl_file.seek(0, io.SEEK_END)
+
+    return buf, start
+
+def _fit_row(r, n):
+    """Truncate or zero pad a decoded row to n bytes"""
+
+    if len(r) < n:
+        return r + bytes(n-len(r))
+    if len(r) > n:
+        return r[:n]
+    return r
+
+def _decode_rle(data):
+    """Decode a run-length encoded (compression 1) row
+
+    data is a sequence of (count, value) byte pairs.
+    """
+
+    if numpy is not None and len(data) >= numpy_threshold:
+        a = numpy.frombuffer(data, dtype=numpy.uint8)
+        m = len(a) & ~1
+        return numpy.repeat(a[1:m:2], a[0:m:2]).tobytes()
+
+    return b''.join([_byte[v]*h for h, v in zip(data[0::2], data[1::2])])
+
+def _decode_packbits(data):
+    """Decode a TIFF 4.0 packbits (compression 2) row"""
+
+    end = len(data)
+    parts = []
+
+    k = 0
+    while k < end:
+        h = data[k]
+        if h < 128:
+            # literal run
+            parts.append(data[k+1:k+h+2])
+            k += h+2
+        elif h > 128:
+            # replicate run
+            if k+1 < end:
+                parts.append(_byte[data[k+1]]*(257-h))
+            k += 2
+        else:
+            k += 1
+
+    return b''.join(parts)
+
+def _decode_row(compression, data, n):
+    """Decode row data to n bytes, padded with zeros"""
+
+    if compression == 0:
+        # unencoded (row)
+        r = bytes(data[:n])
+    elif compression == 1:
+        # run-length encoded (row)
+        r = _decode_rle(data)
+    elif compression == 2:
+        # TIFF 4.0 packbits (row)
+        r = _decode_packbits(data)
+    else:
+        # something else; not implemented
+        raise Exception("Invalid compression")
+
+    # pad row to correct length
+    return _fit_row(r, n)
+
+def _combine_row(planes, width):
+    """Combine the plane rows of one image row into a row of palette indices"""
+
+    if numpy is not None and len(planes[0]) >= numpy_threshold and len(set(map(len, planes))) == 1:
+        idx = numpy.unpackbits(numpy.frombuffer(planes[0], dtype=numpy.uint8))
+        for i in range(1, len(planes)):
+            bits = numpy.unpackbits(numpy.frombuffer(planes[i], dtype=numpy.uint8))
+            bits <<= i
+            idx |= bits
+        row = idx.tobytes()
+    elif len(planes) == 1:
+        row = b''.join(map(_bit_luts[0].__getitem__, planes[0]))
+    else:
+        # planes set disjoint bits, so OR them together as big integers
+        acc = 0
+        n = 0
+        for i, p in enumerate(planes):
+            acc |= int.from_bytes(b''.join(map(_bit_luts[i].__getitem__, p)), 'little')
+            n = max(n, len(p)*8)
+        row = acc.to_bytes(n, 'little')
+
+    if len(row) < width:
+        return row + bytes(width - len(row))
+    return row[:width]
+
+def _sample_row(planes, width, step):
+    """Combine every step-th pixel of the plane rows of one image row"""
+
+    n = (width + step - 1) // step
+
+    if numpy is not None and len(planes[0]) >= numpy_threshold:
+        idx = numpy.zeros(n, dtype=numpy.uint8)
+        for i, p in enumerate(planes):
+            bits = numpy.unpackbits(numpy.frombuffer(p, dtype=numpy.uint8))[:width:step]
+            if i:
+                bits <<= i
+            idx[:len(bits)] |= bits
+        return idx.tobytes()
+
+    # pixels k*step repeat their bit position every period pixels, so each
+    # bit position is a strided slice of the plane bytes
+    period = step*8 // math.gcd(step, 8)
+    out_stride = period // step
+    acc = 0
+    for i, p in enumerate(planes):
+        out = bytearray(n)
+        for k in range(min(out_stride, n)):
+            x = k*step
+            cnt = len(range(k, n, out_stride))
+            src = p[x >> 3::period >> 3][:cnt].translate(_bit_select[x & 7][i])
+            out[k::out_stride] = src + bytes(cnt - len(src))
+        if len(planes) == 1:
+            return bytes(out)
+        acc |= int.from_bytes(out, 'little')
+    return acc.to_bytes(n, 'little')
+
+def _combine_planes(plane_data, width):
+    """Combine bit planes into rows of palette indices
+
+    Bit k of the index of each pixel comes from plane k.  Returns a list of
+    bytes objects of width indices each, one per row of the first plane.
+    """
+
+    height = len(plane_data[0])
+
+    lengths = set([len(r) for p in plane_data for r in p])
+
+    if numpy is None or len(lengths) != 1:
+        return [_combine_row([p[y] for p in plane_data if y < len(p)], width) for y in range(height)]
+
+    byte_width = lengths.pop()
+    cols = max(byte_width*8, width)
+
+    out = []
+    for y0 in range(0, height, block_rows):
+        y1 = min(y0+block_rows, height)
+        idx = numpy.zeros((y1-y0, cols), dtype=numpy.uint8)
+        for i, p in enumerate(plane_data):
+            rows = p[y0:y1]
+            if not rows:
+                break
+            a = numpy.frombuffer(b''.join(rows), dtype=numpy.uint8).reshape(len(rows), byte_width)
+            bits = numpy.unpackbits(a, axis=1)
+            if i:
+                bits <<= i
+            idx[:len(rows), :byte_width*8] |= bits
+        out.extend([r.tobytes() for r in idx[:, :width]])
+
+    return out
+
+def _scan_hprtl(buf, pos, state, section=None, sections=None, step=1, stats=None):
+    """Scan RTL in buf from pos and decode raster rows
+
+    Yields (plane, row, last) for each decoded plane row, with row a bytes
+    object and last set if the row completes an image row.  An end of row
+    without data yields (plane, None, True).  The current width, palette,
+    plane count, color mode and resolution are stored in the state dict
+    before each yield and at the end.
+
+    If section is given, only the rows of that section of an RTLIndex are
+    decoded, starting from the settings recorded for it.  If a sections
+    list is given, nothing is decoded or yielded; a dict is appended to the
+    list for each raster section instead.  If step is more than 1, only
+    every step-th image row is decoded.  Command statistics, decoded rows
+    and scanned bytes are recorded in stats if set.
+    """
 
     color = 1
     width = 0
@@ -40,8 +272,6 @@ def parse_hprtl(rtl_file):
 
     resolution = 1
 
-    plane_data = None
-
     in_raster = True
 
     red = 0
@@ -53,43 +283,96 @@ def parse_hprtl(rtl_file):
         (  0,   0,   0) # black
     ]
 
-    if type(rtl_file) == str:
-        rtlf = open(rtl_file, 'rb')
-    else:
-        rtlf = rtl_file
+    view = memoryview(buf)
+    n = len(buf)
+    end = n
+    find = buf.find
+    param_match = _param_re.match
 
-    while True:
-        s = rtlf.read(1)
+    if section is not None:
+        st = section['state']
+        color = st['color']
+        width = st['width']
+        byte_width = st['byte_width']
+        compression = st['compression']
+        plane_cnt = st['planes']
+        current_plane = st['plane']
+        resolution = st['resolution']
+        red, green, blue = st['rgb']
+        color_list = list(st['palette'])
+        pos = section['offset']
+        end = section['end']
 
-        if len(s) == 0:
-            break
+    decode = sections is None
 
-        if s[0] != 0x1b:
-            continue
+    # section being indexed, and whether any section has been started
+    cur = None
+    started = False
+
+    def begin_section(offset):
+        return {'offset': offset, 'height': 0, 'state': {
+            'color': color, 'width': width, 'byte_width': byte_width,
+            'compression': compression, 'planes': plane_cnt, 'plane': current_plane,
+            'resolution': resolution, 'rgb': (red, green, blue), 'palette': list(color_list)}}
+
+    def end_section(cur, offset):
+        if cur['height']:
+            cur.update(end=offset, width=width, planes=plane_cnt, color=color,
+                compression=compression, resolution=resolution, palette=list(color_list))
+            sections.append(cur)
+
+    if stats is not None:
+        clock = time.perf_counter
+        first = pos
+        mnemonic = None
+        t_cmd = clock()
+
+    while True:
+        if stats is not None:
+            # time since the last command started, less time spent by the
+            # consumer, goes to the last command
+            t = clock()
+            if mnemonic is not None:
+                stats.add_command(mnemonic, t - t_cmd)
+                mnemonic = None
+            t_cmd = t
 
-        s = rtlf.read(1)
+        esc = find(b'\x1b', pos, end)
 
-        if len(s) == 0:
+        if esc < 0 or esc+1 >= n:
             break
 
-        if s[0] == ord('*'):
+        s = buf[esc+1]
+        pos = esc+2
+
+        if stats is not None:
+            mnemonic = chr(s)
+
+        if s == ord('*'):
             # valid ESC* command
             # read [letter][numbers][letter]
-            cmd = rtlf.read(2)
+            cmd = bytes(view[pos:pos+2])
+            pos += len(cmd)
+
+            if len(cmd) < 2:
+                raise Exception("Truncated command (%s)" % (repr(cmd)))
 
-            while True:
-                if (cmd[-1] < ord('0') or cmd[-1] > ord('9')) and cmd[-1] != ord('-'):
-                    break
+            if (cmd[1] >= ord('0') and cmd[1] <= ord('9')) or cmd[1] == ord('-'):
+                e = param_match(buf, pos).end()
 
-                s = rtlf.read(1)
+                if e >= n:
+                    raise Exception("Truncated command (%s)" % (repr(cmd)))
 
                 # ignore null bytes
-                if s[0] != 0:
-                    cmd += s
+                cmd += bytes(view[pos:e]).replace(b'\0', b'') + bytes(view[e:e+1])
+                pos = e+1
 
             ca = cmd[0]
             cb = cmd[-1]
 
+            if stats is not None:
+                mnemonic = '*%c%s%c' % (ca, '#' if len(cmd) > 2 else '', chr(cb).upper())
+
             if ca == ord('r') and (cb == ord('u') or cb == ord('U')):
                 # color command *r#u or *r#U
                 color = int(cmd[1:-1])
@@ -179,9 +462,22 @@ def parse_hprtl(rtl_file):
                 elif in_raster:
                     # if we missed the stop of one section, stop on the start of the next
                     in_raster = False
+
+                if not decode:
+                    # a start also ends any open section
+                    if cur is not None:
+                        end_section(cur, esc)
+                    cur = begin_section(pos)
+                    started = True
             elif ca == ord('r') and (cb == ord('c') or cb == ord('C')):
                 # end raster graphics
                 in_raster = False
+
+                if not decode:
+                    if cur is not None:
+                        end_section(cur, esc)
+                    cur = None
+                    started = True
             elif ca == ord('r') and (cb == ord('b') or cb == ord('B')):
                 # unknown
                 pass
@@ -232,11 +528,20 @@ def parse_hprtl(rtl_file):
                 l = int(cmd[1:-1])
 
                 if l > 0:
-                    # read row
-                    d = rtlf.read(l)
+                    # row data, sliced without copying
+                    d = view[pos:pos+l]
+                    pos += len(d)
 
-                    # skip if we are not in a raster section
-                    if not in_raster:
+                    if not decode:
+                        # rows before the first start or end of raster
+                        # graphics form a section of their own, later rows
+                        # outside of a section are skipped
+                        if cur is None:
+                            if started:
+                                continue
+                            cur = begin_section(esc)
+                    elif not in_raster:
+                        # skip if we are not in a raster section
                         continue
 
                     # set width if not yet set
@@ -248,113 +553,333 @@ def parse_hprtl(rtl_file):
                     if byte_width == 0:
                         byte_width = l
 
-                    if plane_data is None:
-                        plane_data = []
-                        for k in range(plane_cnt):
-                            plane_data.append([])
-
                     # add row if on first plane
                     if current_plane == 0:
                         height += 1
+                        if cur is not None:
+                            cur['height'] += 1
 
-                    row = b''
-
-                    if compression == 0:
-                        # unencoded (row)
-                        row += d
-                    elif compression == 1:
-                        # run-length encoded (row)
-                        k = 0
-                        while True:
-                            if len(d) <= k:
-                                break
-                            h = d[k]
-                            k += 1
-                            row += d[k:k+1]*h
-                            k += 1
-                    elif compression == 2:
-                        # TIFF 4.0 packbits (row)
-                        k = 0
-                        while True:
-                            if len(d) <= k:
-                                break
-                            h = d[k]
-                            k += 1
-                            if h == 128:
-                                continue
-                            if h < 128:
-                                row += d[k:k+h+1]
-                                k += h+1
-                            if h > 128:
-                                row += d[k:k+1]*(257-h)
-                                k += 1
-                    else:
-                        # something else; not implemented
-                        raise Exception("Invalid compression")
-
-                    # pad row to correct length
-                    row += b'\0' * (byte_width - len(row))
-
-                    # append row
-                    plane_data[current_plane].append(row)
+                    plane = current_plane
 
                     # go to next plane, if more than one plane
                     if plane_cnt > 0:
                         current_plane += 1
                         if current_plane == plane_cnt or cb == ord('w') or cb == ord('W'):
                             current_plane = 0
+
+                    if not decode or (step > 1 and (height-1) % step):
+                        continue
+
+                    row = _decode_row(compression, d, byte_width)
+
+                    state.update(width=width, palette=color_list, planes=plane_cnt, color=color, resolution=resolution)
+
+                    if stats is None:
+                        yield plane, row, current_plane == 0
+                    else:
+                        stats.add_rows(compression)
+                        t = clock()
+                        yield plane, row, current_plane == 0
+                        t_cmd += clock() - t
                 else:
                     if cb == ord('w') or cb == ord('W'):
+                        if decode:
+                            state.update(width=width, palette=color_list, planes=plane_cnt, color=color, resolution=resolution)
+                            t = clock() if stats is not None else 0
+                            yield current_plane, None, True
+                            if stats is not None:
+                                t_cmd += clock() - t
                         current_plane = 0
             else:
                 raise Exception("Invalid command (%s)" % (repr(cmd)))
 
-    # combine planes based on bit weights
-    plane_data2 = []
+    if cur is not None:
+        end_section(cur, end)
 
-    for p in plane_data[0]:
-        plane_data2.append([(b >> i) & 1 for b in p for i in range(7,-1,-1)])
+    if stats is not None:
+        if mnemonic is not None:
+            stats.add_command(mnemonic, clock() - t_cmd)
+        stats.add_bytes(end - first)
 
-    for i in range(1,plane_cnt):
-        p = plane_data[i]
+    state.update(width=width, palette=color_list, planes=plane_cnt, color=color, resolution=resolution)
 
-        for j in range(len(p)):
-            k = 0
-            for l in ((b >> i) & 1 for b in p[j] for i in range(7,-1,-1)):
-                plane_data2[j][k] += l << i
-                k += 1
+def parse_hprtl(rtl_file, indexed=False, section=None, stats=None):
+    """Convert HP Raster Transfer Language (RTL) to pixel data
 
-    # crop to size
-    plane_data3 = []
+    Returns a list of rows of (r, g, b) tuples.  If indexed is set, returns
+    (rows, palette) instead, with rows a list of bytes objects holding one
+    palette index per pixel and palette a list of (r, g, b) tuples.
 
-    for i in range(height):
-        plane_data3.append(plane_data2[i][0:width])
+    Only the first raster section is read, unless section is one of the
+    sections of an RTLIndex of the same file.
 
-    # convert to RGB
-    rgb_data = []
+    If stats is a ParseStats object, per command counts and times, rows
+    decoded per compression mode, the number of bytes scanned and the time
+    taken by each phase are recorded in it.
+    """
+
+    state = {}
+    plane_data = None
+
+    buf, start = _open_rtl(rtl_file)
+
+    with timed(stats, 'scan'):
+        for plane, row, last in _scan_hprtl(buf, start, state, section, stats=stats):
+            if row is None:
+                continue
+
+            if plane_data is None:
+                plane_data = []
+                for k in range(state['planes']):
+                    plane_data.append([])
 
-    for y in range(height):
-        row = []
-        for x in range(width):
-            row.append(color_list[plane_data3[y][x]])
-        rgb_data.append(row)
+            plane_data[plane].append(row)
+
+    if plane_data is None:
+        raise Exception("No raster data")
+
+    color_list = state['palette']
+
+    # combine planes based on bit weights, crop to size
+    with timed(stats, 'combine'):
+        index_rows = _combine_planes(plane_data[:state['planes']], state['width'])
+
+    if indexed:
+        return index_rows, list(color_list)
+
+    # convert to RGB
+    with timed(stats, 'convert'):
+        rgb_data = [list(map(color_list.__getitem__, row)) for row in index_rows]
 
     return rgb_data
 
-def generate_bmp(img_data):
-    """Generate a BMP format image from pixel data"""
+def iter_hprtl(rtl_file, info=None, section=None, step=1, stats=None):
+    """Decode RTL one row at a time
 
-    bmp = io.BytesIO()
+    Yields rows of palette indices (bytes objects, one byte per pixel) as
+    soon as all planes of a row have been read, so memory use does not grow
+    with the height of the image.  If an info dict is given, it is updated
+    with the width, palette, number of planes ('planes'), color mode and
+    resolution before each row is yielded.  section is as for parse_hprtl.
 
-    height = len(img_data)
-    width = len(img_data[0])
+    If step is more than 1, only every step-th pixel of every step-th row
+    is kept, for a reduced size image.  Rows in between are skipped without
+    being decoded.  stats is as for parse_hprtl.
+    """
+
+    if info is None:
+        info = {}
+
+    planes = []
 
-    # rgb
-    bpp = 24
-    color_table_entries = 0
+    buf, start = _open_rtl(rtl_file)
+
+    if step > 1:
+        combine = lambda planes, width: _sample_row(planes, width, step)
+    else:
+        combine = _combine_row
+
+    if stats is not None:
+        combine_row = combine
+        def combine(planes, width):
+            with stats.phase('combine'):
+                return combine_row(planes, width)
+
+    rows = _scan_hprtl(buf, start, info, section, step=step, stats=stats)
+
+    if step > 1:
+        # rows are sampled as they are scanned
+        for plane, row, last in rows:
+            if row is not None:
+                planes.append(row)
+            if last and planes:
+                yield combine(planes, info['width'])
+                planes = []
+
+        if planes:
+            yield combine(planes, info['width'])
+        return
+
+    # rows of each plane are queued and combined by their position in the
+    # plane, as in parse_hprtl, so that a *b#W ending a row before its last
+    # plane gives the same image
+    for plane, row, last in rows:
+        if row is None:
+            continue
+
+        if not planes:
+            planes = [collections.deque() for k in range(info['planes'])]
+
+        planes[plane].append(row)
+
+        while all(planes):
+            yield combine([q.popleft() for q in planes], info['width'])
+
+    # rows missing later planes
+    while planes and planes[0]:
+        yield combine([q.popleft() for q in itertools.takewhile(len, planes)], info['width'])
+
+def preview_hprtl(rtl_file, max_size=256, scale=None, indexed=False, section=0, stats=None):
+    """Decode a reduced size preview of an RTL image
+
+    The image is subsampled by an integer factor so that it fits within
+    max_size pixels in both directions, or by about 1/scale if scale is
+    given.  Only the rows and columns that are kept are decoded and
+    combined, so the time taken depends mostly on the size of the preview.
+    section is the index of the raster section to decode.  stats is as for
+    parse_hprtl, with the time taken to find the section recorded as the
+    'index' phase.  Returns the same as parse_hprtl.
+    """
+
+    with timed(stats, 'index'):
+        index = RTLIndex(rtl_file)
+
+    if not index.sections:
+        raise Exception("No raster data")
+
+    sec = index.sections[section]
+
+    if scale is not None:
+        step = max(int(round(1.0/scale)), 1)
+    else:
+        step = max((max(sec['width'], sec['height']) + max_size - 1) // max_size, 1)
+
+    info = {}
+    rows = list(index.iter_rows(section, info, step, stats))
+
+    color_list = info['palette']
+
+    if indexed:
+        return rows, list(color_list)
+
+    return [list(map(color_list.__getitem__, row)) for row in rows]
+
+def _decode_section(job):
+    rtl_file, section, indexed = job
+    return parse_hprtl(rtl_file, indexed, section)
+
+class RTLIndex(object):
+    """Index of the raster sections of an RTL file
+
+    The file is scanned once without decoding any rows, recording for each
+    raster section with data its byte offsets ('offset' and 'end'), size
+    ('width' and 'height'), color mode, number of planes, compression,
+    resolution and palette, along with the settings in effect at its start.
+    Sections can then be decoded individually with decode or iter_rows, or
+    all at once with decode_all.  Sections are listed in self.sections and
+    can also be accessed by indexing.
+
+    rtl_file is a file name, file object or bytes-like object, as for
+    parse_hprtl.  File objects are memory mapped where possible.
+    """
+
+    def __init__(self, rtl_file):
+        self.name = rtl_file if isinstance(rtl_file, str) else None
+        self.sections = []
+
+        self._buf, start = _open_rtl(rtl_file)
+
+        for r in _scan_hprtl(self._buf, start, {}, sections=self.sections):
+            pass
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __getitem__(self, k):
+        return self.sections[k]
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def decode(self, k, indexed=False, stats=None):
+        """Decode section k, returning the same as parse_hprtl"""
+
+        return parse_hprtl(self._buf, indexed, self.sections[k], stats)
+
+    def iter_rows(self, k, info=None, step=1, stats=None):
+        """Decode section k one row at a time, as iter_hprtl"""
+
+        return iter_hprtl(self._buf, info, self.sections[k], step, stats)
+
+    def decode_all(self, indexed=False, jobs=1, threads=False):
+        """Decode all sections, returning a list of decode results
+
+        Sections are decoded on a pool of jobs worker processes when jobs is
+        more than 1.  Worker processes open the file by name, so threads
+        are used instead if the index was not created from a file name, or
+        if threads is set.
+        """
+
+        if jobs > 1 and len(self.sections) > 1:
+            if threads or self.name is None:
+                executor = concurrent.futures.ThreadPoolExecutor(jobs)
+                src = self._buf
+            else:
+                executor = concurrent.futures.ProcessPoolExecutor(jobs)
+                src = self.name
+            with executor:
+                return list(executor.map(_decode_section, [(src, sec, indexed) for sec in self.sections]))
+
+        return [self.decode(k, indexed) for k in range(len(self.sections))]
+
+def _pack_row(row, bpp):
+    """Pack a row of palette indices at bpp bits per pixel, first pixel in the high bits"""
+
+    if not isinstance(row, (bytes, bytearray)):
+        row = bytes(row)
+
+    if bpp == 8:
+        return row
+
+    ppb = 8 // bpp
+    n = (len(row) + ppb - 1) // ppb
+
+    # pixel k of each byte is shifted into place with a translation table
+    # and the shifted pixels are ORed together as big integers
+    acc = 0
+    for k in range(ppb):
+        acc |= int.from_bytes(row[k::ppb].translate(_pack_tables[bpp][k]), 'little')
+    return acc.to_bytes(n, 'little')
+
+# translation tables for _pack_row
+_pack_tables = dict((bpp, [bytes(((v & ((1 << bpp)-1)) << (8-bpp*(k+1))) for v in range(256))
+    for k in range(8 // bpp)]) for bpp in (1, 2, 4))
+
+class _BGRTable(dict):
+    """Map (r, g, b) tuples to packed BGR bytes, filled in on first use"""
+
+    def __missing__(self, c):
+        v = self[c] = bytes((c[2], c[1], c[0]))
+        return v
+
+def _bmp_bpp(palette, bpp):
+    """Bits per pixel for a BMP with an optional palette"""
+
+    if palette is None or bpp == 24:
+        # rgb
+        return 24
+
+    # palettized
+    if len(palette) <= 2:
+        return 1
+    elif len(palette) <= 16:
+        return 4
+    elif len(palette) <= 256:
+        return 8
+    raise Exception("Palette too large")
+
+def _bmp_header(width, height, bpp, palette):
+    """BMP file header, info header and color table
+
+    A negative height marks a top-down image.
+    """
+
+    bmp = io.BytesIO()
+
+    color_table_entries = len(palette) if bpp < 24 else 0
 
     row_size = int((bpp*width + 31)/32)*4
-    image_size = row_size * height
+    image_size = row_size * abs(height)
     header_size = 14+40
     color_table_size = color_table_entries*4
     image_offset = header_size+color_table_size
@@ -379,22 +904,152 @@ def generate_bmp(img_data):
     bmp.write(struct.pack('<L', color_table_entries)) # number of colors in palette (0 = 2^n)
     bmp.write(struct.pack('<L', 0)) # number of important colors in palette (0 = all)
 
-    # rgb
-
     # color table
-    # no color table for RGB
+    if color_table_entries:
+        for r, g, b in palette:
+            bmp.write(struct.pack('<BBBB', b, g, r, 0))
+
+    return bmp.getvalue()
+
+def _bmp_row_encoder(width, bpp, palette):
+    """Function converting a row of pixel data to padded BMP row bytes"""
+
+    pad = bytes(int((bpp*width + 31)/32)*4 - (bpp*width + 7)//8)
+
+    if bpp < 24:
+        # packed palette indices
+        def encode(row):
+            return _pack_row(row, bpp) + pad
+    elif palette is not None and numpy is not None:
+        # palette indices through a BGR table
+        table = numpy.array([(b, g, r) for r, g, b in palette], dtype=numpy.uint8)
+        def encode(row):
+            if isinstance(row, (bytes, bytearray)):
+                row = numpy.frombuffer(row, dtype=numpy.uint8)
+            return table[row].tobytes() + pad
+    elif palette is not None:
+        # palette indices through a BGR byte table
+        table = [bytes((b, g, r)) for r, g, b in palette]
+        def encode(row):
+            return b''.join(map(table.__getitem__, row)) + pad
+    else:
+        table = _BGRTable()
+        def encode(row):
+            if numpy is not None and isinstance(row, numpy.ndarray):
+                # swap channels to BGR
+                return numpy.ascontiguousarray(row[:, ::-1], dtype=numpy.uint8).tobytes() + pad
+            return b''.join(map(table.__getitem__, row)) + pad
+
+    return encode
+
+def write_bmp(img_data, fp, palette=None, bpp=None):
+    """Write pixel data to a binary file object as a BMP image
+
+    img_data is a list of rows of (r, g, b) tuples (or a NumPy array of
+    shape (height, width, 3)), or of palette indices if a palette of
+    (r, g, b) tuples is given.  Palettized images are written with 1, 4 or
+    8 bits per pixel depending on the palette size, unless bpp is set to 24
+    to expand them to RGB.  Rows are built in bulk and written bottom-up
+    directly to fp.
+    """
+
+    height = len(img_data)
+    width = len(img_data[0])
+
+    bpp = _bmp_bpp(palette, bpp)
+
+    fp.write(_bmp_header(width, height, bpp, palette))
+
+    encode = _bmp_row_encoder(width, bpp, palette)
 
-    # image data
     for y in range(height-1, -1, -1):
-        for x in range(width):
-            bmp.write(struct.pack('<BBB', img_data[y][x][2], img_data[y][x][1], img_data[y][x][0]))
-        if (width*3) % 4 > 0:
-            for x in range(4 - ((width*3) % 4)):
-                bmp.write(b'\0')
+        fp.write(encode(img_data[y]))
 
+def generate_bmp(img_data, palette=None, bpp=None):
+    """Generate a BMP format image from pixel data
+
+    See write_bmp for the arguments.
+    """
+
+    bmp = io.BytesIO()
+    write_bmp(img_data, bmp, palette, bpp)
     return bmp.getvalue()
 
-def hprtl2bmp(rtl_file):
-    """Convert HP Raster Transfer Language (RTL) to a BMP image"""
+class BMPWriter(object):
+    """Streaming BMP encoder
+
+    Rows are passed one at a time to write_row, top to bottom, and written
+    out immediately as a top-down (negative height) BMP.  The header is
+    patched with the final height by close().  Output that cannot seek is
+    spooled through a temporary file.  Arguments are as for write_bmp.
+    """
+
+    def __init__(self, fp, width, palette=None, bpp=None):
+        self.fp = fp
+        self.width = width
+        self.palette = palette
+        self.bpp = _bmp_bpp(palette, bpp)
+        self.height = 0
+
+        self._encode = _bmp_row_encoder(width, self.bpp, palette)
+
+        header = _bmp_header(width, 0, self.bpp, palette)
+
+        if fp.seekable():
+            self._spool = None
+            self._start = fp.tell()
+            self._out = fp
+            fp.write(header)
+        else:
+            self._spool = tempfile.SpooledTemporaryFile(max_size=1 << 24)
+            self._out = self._spool
+
+    def write_row(self, row):
+        """Write the next row of pixel data"""
+
+        self._out.write(self._encode(row))
+        self.height += 1
+
+    def close(self):
+        """Complete the header"""
+
+        header = _bmp_header(self.width, -self.height, self.bpp, self.palette)
+
+        if self._spool is None:
+            end = self.fp.tell()
+            self.fp.seek(self._start)
+            self.fp.write(header)
+            self.fp.seek(end)
+        else:
+            self.fp.write(header)
+            self._spool.seek(0)
+            shutil.copyfileobj(self._spool, self.fp)
+            self._spool.close()
+
+def _write_rows(rows, info, writer, fp, **kwargs):
+    """Pass rows from iter_hprtl to a streaming writer"""
+
+    w = None
+    for row in rows:
+        if w is None:
+            w = writer(fp, len(row), info['palette'], **kwargs)
+        w.write_row(row)
+
+    if w is None:
+        raise Exception("No raster data")
+
+    w.close()
+
+def hprtl2bmp(rtl_file, bmp_file=None, stats=None):
+    """Convert HP Raster Transfer Language (RTL) to a BMP image
+
+    Returns the BMP image.  If bmp_file is given, the image is instead
+    streamed to it row by row as a top-down BMP, with constant memory use.
+    stats is as for parse_hprtl.
+    """
+
+    if bmp_file is None:
+        return generate_bmp(*parse_hprtl(rtl_file, indexed=True, stats=stats))
 
-    return generate_bmp(parse_hprtl(rtl_file))
+    info = {}
+    _write_rows(iter_hprtl(rtl_file, info, stats=stats), info, BMPWriter, bmp_file)
@@ -0,0 +1,237 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+from array import array
+import math
+
+from .paths import PathList, numpy
+
+# paths covering more grid cells than this are kept in a separate list that
+# every query checks, instead of being entered in each cell
+max_cells_per_path = 1024
+
+def path_bounds(paths):
+    """Per-path bounding boxes as four arrays (min_x, min_y, max_x, max_y)"""
+
+    coords = paths.coords
+    offsets = paths.offsets
+    n = len(paths)
+
+    if numpy is not None and n > 0:
+        c = numpy.frombuffer(coords, dtype=numpy.float64)
+        starts = numpy.frombuffer(offsets, dtype=numpy.dtype('=u%d' % offsets.itemsize))[:-1].astype(numpy.intp)
+        xs = c[0::2]
+        ys = c[1::2]
+        return tuple(array('d', r.tobytes()) for r in (
+            numpy.minimum.reduceat(xs, starts), numpy.minimum.reduceat(ys, starts),
+            numpy.maximum.reduceat(xs, starts), numpy.maximum.reduceat(ys, starts)))
+
+    min_x = array('d')
+    min_y = array('d')
+    max_x = array('d')
+    max_y = array('d')
+    for i in range(n):
+        c = coords[offsets[i]*2:offsets[i+1]*2]
+        xs = c[0::2]
+        ys = c[1::2]
+        min_x.append(min(xs))
+        min_y.append(min(ys))
+        max_x.append(max(xs))
+        max_y.append(max(ys))
+    return min_x, min_y, max_x, max_y
+
+def _segment_distance(px, py, c):
+    """Distance from a point to a polyline given as flat coordinates"""
+
+    if len(c) == 2:
+        return math.hypot(c[0]-px, c[1]-py)
+
+    best = float('inf')
+    for k in range(0, len(c)-2, 2):
+        ax = c[k]
+        ay = c[k+1]
+        dx = c[k+2] - ax
+        dy = c[k+3] - ay
+        qx = px - ax
+        qy = py - ay
+        l2 = dx*dx + dy*dy
+        if l2 > 0:
+            t = min(max((qx*dx + qy*dy) / l2, 0.0), 1.0)
+            qx -= t*dx
+            qy -= t*dy
+        best = min(best, qx*qx + qy*qy)
+    return math.sqrt(best)
+
+class PathIndex(object):
+    """Uniform grid index over the bounding boxes of a list of paths
+
+    Each path is entered in every grid cell that its bounding box overlaps.
+    Rectangle queries and nearest path lookups only visit the cells around
+    the query, so their cost depends on the local density of paths rather
+    than on the size of the drawing.
+    """
+
+    def __init__(self, paths, cell_size=None):
+        if not isinstance(paths, PathList):
+            paths = PathList(paths)
+
+        self.paths = paths
+        self.min_x, self.min_y, self.max_x, self.max_y = path_bounds(paths)
+
+        n = len(paths)
+
+        if n:
+            self.x0 = min(self.min_x)
+            self.y0 = min(self.min_y)
+            w = max(self.max_x) - self.x0
+            h = max(self.max_y) - self.y0
+        else:
+            self.x0 = self.y0 = 0.0
+            w = h = 0.0
+
+        if cell_size is None:
+            # about one path per cell on average, but no smaller than the
+            # typical path so that paths do not span too many cells
+            cell_size = math.sqrt(w*h / n) if n and w*h > 0 else max(w, h, 1.0)
+            if n:
+                size = sum([max(self.max_x[i]-self.min_x[i], self.max_y[i]-self.min_y[i]) for i in range(n)]) / n
+                cell_size = max(cell_size, size)
+
+        self.cell_size = max(cell_size, 1e-9)
+        self.cols = int(w / self.cell_size) + 1
+        self.rows = int(h / self.cell_size) + 1
+
+        self.grid = {}
+        self.large = []
+
+        for i in range(n):
+            cx0, cy0 = self._cell(self.min_x[i], self.min_y[i])
+            cx1, cy1 = self._cell(self.max_x[i], self.max_y[i])
+            if (cx1-cx0+1)*(cy1-cy0+1) > max_cells_per_path:
+                self.large.append(i)
+                continue
+            for cy in range(cy0, cy1+1):
+                for cx in range(cx0, cx1+1):
+                    self.grid.setdefault((cx, cy), []).append(i)
+
+    def _cell(self, x, y):
+        cx = min(max(int(math.floor((x-self.x0) / self.cell_size)), 0), self.cols-1)
+        cy = min(max(int(math.floor((y-self.y0) / self.cell_size)), 0), self.rows-1)
+        return cx, cy
+
+    def query(self, x0, y0, x1, y1):
+        """Indices of paths whose bounding box intersects a rectangle, in order"""
+
+        if x0 > x1:
+            x0, x1 = x1, x0
+        if y0 > y1:
+            y0, y1 = y1, y0
+
+        cx0, cy0 = self._cell(x0, y0)
+        cx1, cy1 = self._cell(x1, y1)
+
+        cand = set(self.large)
+        grid = self.grid
+        for cy in range(cy0, cy1+1):
+            for cx in range(cx0, cx1+1):
+                lst = grid.get((cx, cy))
+                if lst:
+                    cand.update(lst)
+
+        min_x = self.min_x
+        min_y = self.min_y
+        max_x = self.max_x
+        max_y = self.max_y
+
+        return sorted([i for i in cand if min_x[i] <= x1 and max_x[i] >= x0 and
+            min_y[i] <= y1 and max_y[i] >= y0])
+
+    def nearest(self, x, y, max_dist=float('inf')):
+        """Nearest path to a point as (index, distance), or None
+
+        Only paths within max_dist are considered.
+        """
+
+        paths = self.paths
+        coords = paths.coords
+        offsets = paths.offsets
+        cell = self.cell_size
+
+        best = None
+        best_d = max_dist
+        seen = set()
+
+        def check(lst):
+            for i in lst:
+                if i in seen:
+                    continue
+                seen.add(i)
+                # bounding box distance is a lower bound
+                dx = max(self.min_x[i]-x, 0, x-self.max_x[i])
+                dy = max(self.min_y[i]-y, 0, y-self.max_y[i])
+                if math.hypot(dx, dy) > best_d:
+                    continue
+                d = _segment_distance(x, y, coords[offsets[i]*2:offsets[i+1]*2])
+                if d < best_d or (d == best_d and best is None):
+                    yield i, d
+
+        for i, d in check(self.large):
+            best, best_d = i, d
+
+        if not len(paths):
+            return None
+
+        cx, cy = self._cell(x, y)
+
+        r = 0
+        while True:
+            for ky in range(cy-r, cy+r+1):
+                if ky < 0 or ky >= self.rows:
+                    continue
+                if ky == cy-r or ky == cy+r:
+                    kxs = range(cx-r, cx+r+1)
+                else:
+                    kxs = (cx-r, cx+r)
+                for kx in kxs:
+                    lst = self.grid.get((kx, ky))
+                    if lst:
+                        for i, d in check(lst):
+                            best, best_d = i, d
+
+            # anything not yet seen lies outside the scanned square
+            left = self.x0 + (cx-r)*cell
+            bottom = self.y0 + (cy-r)*cell
+            right = self.x0 + (cx+r+1)*cell
+            top = self.y0 + (cy+r+1)*cell
+            bound = max(min(x-left, right-x, y-bottom, top-y), 0)
+
+            if best is not None and best_d <= bound:
+                break
+            if cx-r <= 0 and cy-r <= 0 and cx+r >= self.cols-1 and cy+r >= self.rows-1:
+                break
+            r += 1
+
+        if best is None:
+            return None
+        return best, best_d
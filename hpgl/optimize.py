@@ -0,0 +1,254 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import math
+
+from .paths import PathList
+
+def travel_stats(paths, start=(0, 0)):
+    """Measure pen up travel distance and pen changes for a list of paths
+
+    Travel starts at start and follows the paths in order.  Returns a dict
+    with the total pen up travel distance and the number of pen changes.
+    """
+
+    if not isinstance(paths, PathList):
+        paths = PathList(paths)
+
+    coords = paths.coords
+    offsets = paths.offsets
+    pens = paths.pens
+
+    travel = 0.0
+    changes = 0
+    x, y = start
+    pen = None
+
+    for i in range(len(paths)):
+        s = offsets[i]*2
+        e = offsets[i+1]*2
+        travel += math.hypot(coords[s]-x, coords[s+1]-y)
+        x = coords[e-2]
+        y = coords[e-1]
+        if pens[i] != pen:
+            if pen is not None:
+                changes += 1
+            pen = pens[i]
+
+    return {'travel': travel, 'pen_changes': changes}
+
+def _order_nearest(sx, sy, ex, ey, x, y, reverse):
+    """Greedy nearest neighbour ordering using a uniform grid
+
+    Returns a list of (index, reversed) pairs.
+    """
+
+    m = len(sx)
+
+    xs = sx + ex
+    ys = sy + ey
+    x0 = min(xs)
+    y0 = min(ys)
+    span = max(max(xs) - x0, max(ys) - y0, 1.0)
+    cell = span / max(math.sqrt(m), 1.0)
+    ncells = int(span / cell) + 1
+
+    grid = {}
+    for i in range(m):
+        key = (int((sx[i]-x0)/cell), int((sy[i]-y0)/cell))
+        grid.setdefault(key, []).append(i)
+        if reverse:
+            key = (int((ex[i]-x0)/cell), int((ey[i]-y0)/cell))
+            grid.setdefault(key, []).append(i)
+
+    used = [False]*m
+    alive = list(range(m))
+    order = []
+
+    for n in range(m):
+        cx = int(math.floor((x-x0)/cell))
+        cy = int(math.floor((y-y0)/cell))
+
+        best = None
+        best_d = float('inf')
+        best_rev = False
+
+        r = 0
+        while True:
+            if not (0 <= cx < ncells and 0 <= cy < ncells) or 8*r > m-n:
+                # outside of the grid, or searching more cells than there are
+                # paths left; check the remaining paths directly
+                alive = [i for i in alive if not used[i]]
+                cand = alive
+            else:
+                if r == 0:
+                    ring = [(cx, cy)]
+                else:
+                    ring = [(cx+dx, cy-r) for dx in range(-r, r+1)]
+                    ring += [(cx+dx, cy+r) for dx in range(-r, r+1)]
+                    ring += [(cx-r, cy+dy) for dy in range(-r+1, r)]
+                    ring += [(cx+r, cy+dy) for dy in range(-r+1, r)]
+                cand = []
+                for key in ring:
+                    lst = grid.get(key)
+                    if lst:
+                        live = [i for i in lst if not used[i]]
+                        if len(live) != len(lst):
+                            grid[key] = live
+                        cand.extend(live)
+
+            for i in cand:
+                d = (sx[i]-x)**2 + (sy[i]-y)**2
+                if d < best_d:
+                    best, best_d, best_rev = i, d, False
+                if reverse:
+                    d = (ex[i]-x)**2 + (ey[i]-y)**2
+                    if d < best_d:
+                        best, best_d, best_rev = i, d, True
+
+            if cand is alive:
+                break
+            # everything in later rings is at least r cells away
+            if best is not None and best_d <= (r*cell)**2:
+                break
+            r += 1
+
+        used[best] = True
+        order.append((best, best_rev))
+        if best_rev:
+            x, y = sx[best], sy[best]
+        else:
+            x, y = ex[best], ey[best]
+
+    return order
+
+def _two_opt(order, sx, sy, ex, ey, x, y, window, passes):
+    """Improve an ordering with 2-opt moves over a sliding window
+
+    Reversing a run of paths also reverses the direction of each of them.
+    """
+
+    n = len(order)
+    hypot = math.hypot
+
+    # oriented end points by position in the ordering
+    px0 = [ex[i] if rev else sx[i] for i, rev in order]
+    py0 = [ey[i] if rev else sy[i] for i, rev in order]
+    px1 = [sx[i] if rev else ex[i] for i, rev in order]
+    py1 = [sy[i] if rev else ey[i] for i, rev in order]
+
+    for p in range(passes):
+        improved = False
+        for a in range(-1, n-2):
+            if a >= 0:
+                eax, eay = px1[a], py1[a]
+            else:
+                eax, eay = x, y
+            d_a = hypot(eax-px0[a+1], eay-py0[a+1])
+            for b in range(a+2, min(a+1+window, n)):
+                if b+1 < n:
+                    delta = (hypot(eax-px1[b], eay-py1[b]) + hypot(px0[a+1]-px0[b+1], py0[a+1]-py0[b+1])
+                        - d_a - hypot(px1[b]-px0[b+1], py1[b]-py0[b+1]))
+                else:
+                    delta = hypot(eax-px1[b], eay-py1[b]) - d_a
+                if delta < -1e-9:
+                    # reverse run a+1..b, swapping the ends of each path
+                    order[a+1:b+1] = [(i, not rev) for i, rev in reversed(order[a+1:b+1])]
+                    px0[a+1:b+1], px1[a+1:b+1] = px1[a+1:b+1][::-1], px0[a+1:b+1][::-1]
+                    py0[a+1:b+1], py1[a+1:b+1] = py1[a+1:b+1][::-1], py0[a+1:b+1][::-1]
+                    d_a = hypot(eax-px0[a+1], eay-py0[a+1])
+                    improved = True
+        if not improved:
+            break
+
+    return order
+
+def optimize_paths(paths, start=(0, 0), reverse=True, window=32, passes=2):
+    """Reorder paths to minimize pen up travel
+
+    Paths are grouped by pen in order of first use, so each pen is selected
+    once.  Within each pen, paths are ordered by a nearest neighbour search
+    over a uniform grid and then improved with 2-opt moves over a sliding
+    window.  If reverse is set, paths may be drawn in either direction.
+
+    Returns (paths, report) with paths a new PathList and report a dict with
+    pen up travel and pen change counts before and after.
+    """
+
+    if not isinstance(paths, PathList):
+        paths = PathList(paths)
+
+    before = travel_stats(paths, start)
+
+    coords = paths.coords
+    offsets = paths.offsets
+
+    groups = {}
+    pen_order = []
+    for i in range(len(paths)):
+        pen = paths.pens[i]
+        if pen not in groups:
+            groups[pen] = []
+            pen_order.append(pen)
+        groups[pen].append(i)
+
+    out = PathList()
+    out.labels = list(paths.labels)
+
+    x, y = start
+
+    for pen in pen_order:
+        idx = groups[pen]
+        sx = [coords[offsets[i]*2] for i in idx]
+        sy = [coords[offsets[i]*2+1] for i in idx]
+        ex = [coords[offsets[i+1]*2-2] for i in idx]
+        ey = [coords[offsets[i+1]*2-1] for i in idx]
+
+        order = _order_nearest(sx, sy, ex, ey, x, y, reverse)
+        if reverse and window > 1 and passes > 0:
+            order = _two_opt(order, sx, sy, ex, ey, x, y, window, passes)
+
+        for k, rev in order:
+            i = idx[k]
+            c = coords[offsets[i]*2:offsets[i+1]*2]
+            if rev:
+                r = c[:]
+                r[0::2] = c[-2::-2]
+                r[1::2] = c[-1::-2]
+                c = r
+            out.add(pen, paths.widths[i], c)
+
+        x = out.coords[-2]
+        y = out.coords[-1]
+
+    after = travel_stats(out, start)
+
+    report = {
+        'travel_before': before['travel'],
+        'travel_after': after['travel'],
+        'pen_changes_before': before['pen_changes'],
+        'pen_changes_after': after['pen_changes'],
+    }
+
+    return out, report
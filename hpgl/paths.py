@@ -0,0 +1,304 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+from array import array
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# below this many coordinates, NumPy call overhead outweighs the savings
+numpy_threshold = 64
+
+def scale_coords(coords, scale, offset):
+    """Map flat coordinates through a scale and offset, (v+offset)*scale"""
+
+    if numpy is not None and len(coords) >= numpy_threshold:
+        a = numpy.array(coords, dtype=numpy.float64).reshape(-1, 2)
+        a += offset
+        a *= scale
+        return a.ravel().tolist()
+
+    out = [0]*len(coords)
+    out[0::2] = [(v+offset[0])*scale[0] for v in coords[0::2]]
+    out[1::2] = [(v+offset[1])*scale[1] for v in coords[1::2]]
+    return out
+
+class PathList(object):
+    """Compact list of paths
+
+    Coordinates of all paths are stored in a single flat array of doubles
+    (x0, y0, x1, y1, ...), with the index of the first point of each path in
+    offsets and the pen number and stroke width of each path in pens and
+    widths.  Iterating or indexing yields (pen, width, pts) tuples with pts
+    a list of (x, y) tuples, as for a plain list of paths.
+
+    Label characters that have not been rendered to paths are kept in labels
+    as (x, y, char_width, char_height, pen, width, font, char) tuples.
+    """
+
+    def __init__(self, paths=None):
+        self.coords = array('d')
+        self.offsets = array('L', [0])
+        self.pens = array('i')
+        self.widths = array('d')
+        self.labels = []
+
+        if paths is not None:
+            for pen, width, pts in paths:
+                self.append((pen, width, pts))
+
+    def add(self, pen, width, coords):
+        """Add a path from a flat coordinate sequence"""
+
+        self.coords.extend(coords)
+        self.offsets.append(len(self.coords) >> 1)
+        self.pens.append(pen)
+        self.widths.append(width)
+
+    def append(self, path):
+        """Add a (pen, width, pts) path"""
+
+        pen, width, pts = path
+        self.add(pen, width, [v for p in pts for v in (p[0], p[1])])
+
+    def extend(self, paths):
+        for path in paths:
+            self.append(path)
+
+    def path_coords(self, i):
+        """Flat coordinates of path i"""
+
+        return self.coords[self.offsets[i]*2:self.offsets[i+1]*2]
+
+    def __len__(self):
+        return len(self.pens)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self.pens)))]
+        if i < 0:
+            i += len(self.pens)
+        if i < 0 or i >= len(self.pens):
+            raise IndexError("path index out of range")
+        c = self.path_coords(i)
+        return (self.pens[i], self.widths[i], list(zip(c[0::2], c[1::2])))
+
+    def __iter__(self):
+        coords = self.coords
+        offsets = self.offsets
+        for i in range(len(self.pens)):
+            c = coords[offsets[i]*2:offsets[i+1]*2]
+            yield (self.pens[i], self.widths[i], list(zip(c[0::2], c[1::2])))
+
+    def as_numpy(self):
+        """Zero-copy NumPy views of (coords, offsets, pens, widths)"""
+
+        if numpy is None:
+            raise ImportError("NumPy is not available")
+
+        return (numpy.frombuffer(self.coords, dtype=numpy.float64),
+            numpy.frombuffer(self.offsets, dtype=numpy.dtype('=u%d' % self.offsets.itemsize)),
+            numpy.frombuffer(self.pens, dtype=numpy.dtype('=i%d' % self.pens.itemsize)),
+            numpy.frombuffer(self.widths, dtype=numpy.float64))
+
+    def bounds(self):
+        """Bounding box (min_x, min_y, max_x, max_y) of all points"""
+
+        if not self.coords:
+            return (0, 0, 0, 0)
+
+        if numpy is not None and len(self.coords) >= numpy_threshold:
+            c = numpy.frombuffer(self.coords, dtype=numpy.float64)
+            xs = c[0::2]
+            ys = c[1::2]
+            return (float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max()))
+
+        xs = self.coords[0::2]
+        ys = self.coords[1::2]
+        return (min(xs), min(ys), max(xs), max(ys))
+
+    def flip_y(self, height, border=0):
+        """Copy with x shifted by border and y flipped to height-y-border"""
+
+        out = PathList()
+        out.offsets = self.offsets[:]
+        out.pens = self.pens[:]
+        out.widths = self.widths[:]
+        out.coords = self.coords[:]
+        out.labels = [(lb[0]+border, height-lb[1]-border)+lb[2:] for lb in self.labels]
+
+        if numpy is not None and len(self.coords) >= numpy_threshold:
+            c = numpy.frombuffer(out.coords, dtype=numpy.float64)
+            c[0::2] += border
+            numpy.subtract(height, c[1::2], out=c[1::2])
+            c[1::2] -= border
+            return out
+
+        out.coords[0::2] = array('d', [x+border for x in self.coords[0::2]])
+        out.coords[1::2] = array('d', [height-y-border for y in self.coords[1::2]])
+        return out
+
+def merge_paths(paths):
+    """Join consecutive paths that continue each other into single polylines
+
+    Paths are joined when they have the same pen and width and the first
+    point of a path coincides with the last point of the previous one.
+    Single points are left alone.  Returns a new PathList.
+    """
+
+    if not isinstance(paths, PathList):
+        paths = PathList(paths)
+
+    coords = paths.coords
+    offsets = paths.offsets
+    pens = paths.pens
+    widths = paths.widths
+
+    out = PathList()
+    out.labels = list(paths.labels)
+
+    n = len(paths)
+    i = 0
+    while i < n:
+        start = offsets[i]
+        end = offsets[i+1]
+        pen = pens[i]
+        width = widths[i]
+
+        out.coords.extend(coords[start*2:end*2])
+
+        i += 1
+        if end - start > 1:
+            while (i < n and pens[i] == pen and widths[i] == width and
+                    offsets[i+1] - offsets[i] > 1 and
+                    coords[offsets[i]*2] == coords[end*2-2] and
+                    coords[offsets[i]*2+1] == coords[end*2-1]):
+                # skip the shared point
+                out.coords.extend(coords[offsets[i]*2+2:offsets[i+1]*2])
+                end = offsets[i+1]
+                i += 1
+
+        out.offsets.append(len(out.coords) >> 1)
+        out.pens.append(pen)
+        out.widths.append(width)
+
+    return out
+
+def _significance(coords, start, end):
+    """Douglas-Peucker significance of each point of a path
+
+    A point is kept by Douglas-Peucker simplification with tolerance t if
+    and only if its significance is greater than t.  End points are always
+    kept.
+    """
+
+    n = end - start
+    sig = [0.0]*n
+    sig[0] = sig[-1] = float('inf')
+
+    stack = [(0, n-1, float('inf'))]
+    while stack:
+        a, b, limit = stack.pop()
+        if b - a < 2:
+            continue
+        ax = coords[(start+a)*2]
+        ay = coords[(start+a)*2+1]
+        dx = coords[(start+b)*2] - ax
+        dy = coords[(start+b)*2+1] - ay
+        l2 = dx*dx + dy*dy
+        best = -1.0
+        k = a+1
+        for i in range(a+1, b):
+            px = coords[(start+i)*2] - ax
+            py = coords[(start+i)*2+1] - ay
+            if l2 > 0:
+                # distance to segment
+                t = min(max((px*dx + py*dy) / l2, 0.0), 1.0)
+                px -= t*dx
+                py -= t*dy
+            d = px*px + py*py
+            if d > best:
+                best = d
+                k = i
+        # a point is only reached if its parent split was, so clamp to the parent
+        d = min(math.sqrt(best), limit)
+        sig[k] = d
+        stack.append((a, k, d))
+        stack.append((k, b, d))
+
+    return sig
+
+def simplify_levels(paths, tolerances):
+    """Simplify paths at several tolerances in one pass
+
+    Uses Douglas-Peucker simplification with tolerances in plotter units.
+    The significance of each point is computed once and shared between all
+    levels.  Returns a list of PathLists, one per tolerance.
+    """
+
+    if not isinstance(paths, PathList):
+        paths = PathList(paths)
+
+    coords = paths.coords
+    offsets = paths.offsets
+
+    levels = []
+    for tol in tolerances:
+        out = PathList()
+        out.labels = list(paths.labels)
+        levels.append((tol, out))
+
+    for i in range(len(paths)):
+        start = offsets[i]
+        end = offsets[i+1]
+        pen = paths.pens[i]
+        width = paths.widths[i]
+
+        if end - start <= 2:
+            c = coords[start*2:end*2]
+            for tol, out in levels:
+                out.add(pen, width, c)
+            continue
+
+        sig = _significance(coords, start, end)
+
+        for tol, out in levels:
+            c = out.coords
+            for k in range(end - start):
+                if sig[k] > tol:
+                    c.append(coords[(start+k)*2])
+                    c.append(coords[(start+k)*2+1])
+            out.offsets.append(len(c) >> 1)
+            out.pens.append(pen)
+            out.widths.append(width)
+
+    return [out for tol, out in levels]
+
+def simplify_paths(paths, tolerance):
+    """Simplify paths with Douglas-Peucker, tolerance in plotter units"""
+
+    return simplify_levels(paths, [tolerance])[0]
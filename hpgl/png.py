@@ -0,0 +1,305 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import collections
+import concurrent.futures
+import io
+import itertools
+import shutil
+import struct
+import tempfile
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .hprtl import _pack_row, _write_rows, iter_hprtl, parse_hprtl
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+# uncompressed bytes per strip compressed as one unit
+strip_size = 1 << 18
+
+# deflate window, carried over between strips as a preset dictionary
+_window = 32768
+
+def _chunk(kind, data):
+    """PNG chunk with length and CRC"""
+
+    return struct.pack('>L', len(data)) + kind + data + struct.pack('>L', zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff)
+
+def _png_format(palette, bpp):
+    """(bit depth, color type) for a PNG with an optional palette"""
+
+    if palette is None or bpp == 24:
+        # rgb
+        return 8, 2
+
+    # palettized
+    if len(palette) <= 2:
+        return 1, 3
+    elif len(palette) <= 4:
+        return 2, 3
+    elif len(palette) <= 16:
+        return 4, 3
+    elif len(palette) <= 256:
+        return 8, 3
+    raise Exception("Palette too large")
+
+def _png_header(width, height, depth, color_type, palette):
+    """PNG signature, header chunk and palette chunk"""
+
+    png = io.BytesIO()
+
+    png.write(png_signature)
+    png.write(_chunk(b'IHDR', struct.pack('>LLBBBBB',
+        width, # image width
+        height, # image height
+        depth, # bit depth
+        color_type, # color type
+        0, # compression method (deflate)
+        0, # filter method
+        0 # interlace method (none)
+    )))
+
+    if color_type == 3:
+        png.write(_chunk(b'PLTE', b''.join([bytes(c) for c in palette])))
+
+    return png.getvalue()
+
+def _png_row_encoder(width, depth, color_type, palette):
+    """Function converting a row of pixel data to PNG scanline bytes, without the filter type"""
+
+    if color_type == 3:
+        # packed palette indices
+        def encode(row):
+            return _pack_row(row, depth)
+    elif palette is not None and numpy is not None:
+        # palette indices through an RGB table
+        table = numpy.array(palette, dtype=numpy.uint8)
+        def encode(row):
+            if isinstance(row, (bytes, bytearray)):
+                row = numpy.frombuffer(row, dtype=numpy.uint8)
+            return table[row].tobytes()
+    elif palette is not None:
+        # palette indices through one translation table per channel
+        tables = [bytes([c[k] for c in palette] + [0]*(256-len(palette))) for k in range(3)]
+        def encode(row):
+            if not isinstance(row, (bytes, bytearray)):
+                row = bytes(row)
+            out = bytearray(len(row)*3)
+            for k in range(3):
+                out[k::3] = row.translate(tables[k])
+            return bytes(out)
+    else:
+        def encode(row):
+            if numpy is not None and isinstance(row, numpy.ndarray):
+                return numpy.ascontiguousarray(row, dtype=numpy.uint8).tobytes()
+            return bytes(itertools.chain.from_iterable(row))
+
+    return encode
+
+def _deflate_strip(data, zdict, level, last):
+    """Compress a strip as part of a raw deflate stream
+
+    All but the last strip end with a sync flush, so the compressed strips
+    can be concatenated.  zdict is the data preceding the strip.
+    """
+
+    if zdict:
+        c = zlib.compressobj(level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        c = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    return c.compress(data) + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+class PNGWriter(object):
+    """Streaming PNG encoder
+
+    Rows are passed one at a time to write_row, top to bottom.  Rows are
+    collected into strips, which are compressed independently (on a pool
+    of jobs threads when jobs is more than 1, zlib releases the GIL) and
+    written out in order as IDAT chunks.  Each strip uses the end of the
+    previous one as a preset dictionary, so compression is close to that of
+    a single stream.
+
+    Arguments are as for write_bmp, with palettized images written at 1, 2,
+    4 or 8 bits per pixel.  The header is patched with the final height by
+    close(), unless the height is given in advance.  Output that cannot
+    seek is spooled through a temporary file.
+    """
+
+    def __init__(self, fp, width, palette=None, bpp=None, level=6, jobs=1, height=None):
+        self.fp = fp
+        self.width = width
+        self.palette = palette
+        self.level = level
+        self.depth, self.color_type = _png_format(palette, bpp)
+        self.height = 0
+
+        self._encode = _png_row_encoder(width, self.depth, self.color_type, palette)
+
+        self._strip = []
+        self._strip_len = 0
+        self._prev = b''
+        self._adler = 1
+        self._pending = collections.deque()
+
+        if jobs > 1:
+            self._executor = concurrent.futures.ThreadPoolExecutor(jobs)
+            self._max_pending = jobs*2
+        else:
+            self._executor = None
+            self._max_pending = 0
+
+        # zlib header, check bits make the 16 bit value a multiple of 31
+        if level == 0 or level == 1:
+            flevel = 0
+        elif 2 <= level <= 5:
+            flevel = 1
+        elif level == 6 or level < 0:
+            flevel = 2
+        else:
+            flevel = 3
+        flg = flevel << 6
+        flg |= 31 - (0x7800 | flg) % 31
+        self._zlib_header = bytes((0x78, flg))
+
+        self._fixed = height is not None
+
+        if self._fixed or fp.seekable():
+            self._spool = None
+            self._start = fp.tell() if not self._fixed else None
+            self._out = fp
+            fp.write(_png_header(width, height or 0, self.depth, self.color_type, palette))
+        else:
+            self._spool = tempfile.SpooledTemporaryFile(max_size=1 << 24)
+            self._out = self._spool
+
+    def write_row(self, row):
+        """Write the next row of pixel data"""
+
+        # filter type 0 (none)
+        data = b'\0' + self._encode(row)
+        self._strip.append(data)
+        self._strip_len += len(data)
+        self.height += 1
+
+        if self._strip_len >= strip_size:
+            self._flush_strip(False)
+
+    def _flush_strip(self, last):
+        data = b''.join(self._strip)
+        self._strip = []
+        self._strip_len = 0
+
+        self._adler = zlib.adler32(data, self._adler)
+
+        args = (data, self._prev, self.level, last)
+        self._prev = (self._prev + data)[-_window:]
+
+        if self._executor is not None:
+            self._pending.append(self._executor.submit(_deflate_strip, *args))
+        else:
+            self._pending.append(args)
+
+        while len(self._pending) > self._max_pending or (last and self._pending):
+            p = self._pending.popleft()
+            if self._executor is not None:
+                data = p.result()
+            else:
+                data = _deflate_strip(*p)
+            if self._zlib_header:
+                data = self._zlib_header + data
+                self._zlib_header = None
+            if last and not self._pending:
+                data += struct.pack('>L', self._adler & 0xffffffff)
+            if data:
+                self._out.write(_chunk(b'IDAT', data))
+
+    def close(self):
+        """Compress the remaining rows and complete the image"""
+
+        try:
+            self._flush_strip(True)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+
+        self._out.write(_chunk(b'IEND', b''))
+
+        if self._fixed:
+            return
+
+        header = _png_header(self.width, self.height, self.depth, self.color_type, self.palette)
+
+        if self._spool is None:
+            end = self.fp.tell()
+            self.fp.seek(self._start)
+            self.fp.write(header)
+            self.fp.seek(end)
+        else:
+            self.fp.write(header)
+            self._spool.seek(0)
+            shutil.copyfileobj(self._spool, self.fp)
+            self._spool.close()
+
+def write_png(img_data, fp, palette=None, bpp=None, level=6, jobs=1):
+    """Write pixel data to a binary file object as a PNG image
+
+    img_data is as for write_bmp.  Palettized images are written with 1, 2,
+    4 or 8 bits per pixel depending on the palette size, unless bpp is set
+    to 24 to expand them to RGB.  level is the zlib compression level and
+    jobs the number of compression threads.
+    """
+
+    w = PNGWriter(fp, len(img_data[0]), palette, bpp, level, jobs, len(img_data))
+    for row in img_data:
+        w.write_row(row)
+    w.close()
+
+def generate_png(img_data, palette=None, bpp=None, level=6, jobs=1):
+    """Generate a PNG format image from pixel data
+
+    See write_png for the arguments.
+    """
+
+    png = io.BytesIO()
+    write_png(img_data, png, palette, bpp, level, jobs)
+    return png.getvalue()
+
+def hprtl2png(rtl_file, png_file=None, level=6, jobs=1, stats=None):
+    """Convert HP Raster Transfer Language (RTL) to a PNG image
+
+    Returns the PNG image.  If png_file is given, the image is instead
+    streamed to it row by row.  stats is as for parse_hprtl.
+    """
+
+    if png_file is None:
+        return generate_png(*parse_hprtl(rtl_file, indexed=True, stats=stats), level=level, jobs=jobs)
+
+    info = {}
+    _write_rows(iter_hprtl(rtl_file, info, stats=stats), info, PNGWriter, png_file, level=level, jobs=jobs)
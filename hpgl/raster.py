@@ -0,0 +1,249 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import concurrent.futures
+import math
+
+from .hpgl import parse_hpgl, _glyph
+from .hprtl import generate_bmp
+from .index import PathIndex
+from .paths import PathList
+from .png import generate_png
+
+# plotter units per inch
+units_per_inch = 1016
+
+# palette index 0 is the background, the rest follow the SVG pen colors
+pen_palette = [
+    (255, 255, 255), # background
+    (  0,   0,   0), # black
+    (  0,   0, 255), # blue
+    (  0, 128,   0), # green
+    (255, 255,   0), # yellow
+    (255,   0,   0), # red
+    (255,   0, 255), # magenta
+    (  0, 255, 255)  # cyan
+]
+
+def _fill_capsule(buf, w, h, ax, ay, bx, by, r, val):
+    """Fill the pixels within r of segment (a, b), one scanline at a time"""
+
+    ymin = max(int(math.ceil(min(ay, by) - r - 0.5)), 0)
+    ymax = min(int(math.floor(max(ay, by) + r - 0.5)), h-1)
+
+    if ymin > ymax:
+        return
+
+    dx = bx - ax
+    dy = by - ay
+    l2 = dx*dx + dy*dy
+    rl = r*math.sqrt(l2)
+    r2 = r*r
+    fill = bytes((val,))
+    inf = float('inf')
+
+    for j in range(ymin, ymax+1):
+        yc = j + 0.5
+        lo = inf
+        hi = -inf
+
+        # round caps
+        t = r2 - (yc-ay)*(yc-ay)
+        if t >= 0:
+            s = math.sqrt(t)
+            lo = ax - s
+            hi = ax + s
+        t = r2 - (yc-by)*(yc-by)
+        if t >= 0:
+            s = math.sqrt(t)
+            lo = min(lo, bx - s)
+            hi = max(hi, bx + s)
+
+        if l2 > 0:
+            # body: distance from the line within r, projection within the segment
+            c0 = dx*(yc-ay) + dy*ax
+            if dy != 0:
+                b0 = (c0 - rl) / dy
+                b1 = (c0 + rl) / dy
+                if b0 > b1:
+                    b0, b1 = b1, b0
+            elif abs(c0) <= rl:
+                b0, b1 = -inf, inf
+            else:
+                b0, b1 = inf, -inf
+            d0 = dy*(yc-ay) - dx*ax
+            if dx != 0:
+                e0 = -d0 / dx
+                e1 = (l2 - d0) / dx
+                if e0 > e1:
+                    e0, e1 = e1, e0
+            elif 0 <= d0 <= l2:
+                e0, e1 = -inf, inf
+            else:
+                e0, e1 = inf, -inf
+            b0 = max(b0, e0)
+            b1 = min(b1, e1)
+            if b0 <= b1:
+                lo = min(lo, b0)
+                hi = max(hi, b1)
+
+        if lo > hi:
+            continue
+
+        i0 = max(int(math.ceil(lo - 0.5)), 0)
+        i1 = min(int(math.floor(hi - 0.5)), w-1)
+        if i0 <= i1:
+            off = j*w
+            buf[off+i0:off+i1+1] = fill*(i1-i0+1)
+
+def _render_tile(job):
+    """Render one tile to a bytearray of palette indices"""
+
+    x0, y0, w, h, scale, items = job
+
+    buf = bytearray(w*h)
+
+    for pen, width, c in items:
+        if len(c) == 2:
+            # single point, drawn as a square
+            size = max(width*scale, 1.0)
+            px = c[0]*scale - x0
+            py = c[1]*scale - y0
+            i0 = max(int(math.ceil(px - 0.5)), 0)
+            i1 = min(int(math.floor(px + size - 0.5)), w-1)
+            fill = bytes((pen,))*(i1-i0+1)
+            if i0 <= i1:
+                for j in range(max(int(math.ceil(py - 0.5)), 0), min(int(math.floor(py + size - 0.5)), h-1)+1):
+                    buf[j*w+i0:j*w+i1+1] = fill
+            continue
+
+        r = max(width*scale/2, 0.5)
+        ax = c[0]*scale - x0
+        ay = c[1]*scale - y0
+        for k in range(2, len(c), 2):
+            bx = c[k]*scale - x0
+            by = c[k+1]*scale - y0
+            _fill_capsule(buf, w, h, ax, ay, bx, by, r, pen)
+            ax = bx
+            ay = by
+
+    return buf
+
+def _label_paths(paths):
+    """Copy of a PathList with unrendered labels converted to paths"""
+
+    if not paths.labels:
+        return paths
+
+    out = PathList()
+    out.coords = paths.coords[:]
+    out.offsets = paths.offsets[:]
+    out.pens = paths.pens[:]
+    out.widths = paths.widths[:]
+
+    for x, y, cw, ch, pen, pw, font, c in paths.labels:
+        # labels are in flipped coordinates
+        for xs, ys in _glyph(c, cw):
+            path = [0]*(len(xs)*2)
+            path[0::2] = [x+v for v in xs]
+            path[1::2] = [y-v for v in ys]
+            out.add(pen, pw, path)
+
+    return out
+
+def render_paths(paths, dpi=100, tile_size=512, jobs=1, threads=False):
+    """Rasterize parsed HPGL to palette indexed pixel rows
+
+    Takes the result of parse_hpgl and draws the paths with their stroke
+    widths and round caps at the given resolution.  The page is split into
+    tiles of tile_size pixels, rendered on a pool of jobs worker processes
+    (or threads, if threads is set) when jobs is more than 1.  Paths with
+    pens outside of the palette are not drawn.
+
+    Returns (rows, palette) with rows a list of bytearrays of palette
+    indices and palette a list of (r, g, b) tuples.
+    """
+
+    paths, max_x, max_y = paths
+
+    if not isinstance(paths, PathList):
+        paths = PathList(paths)
+
+    paths = _label_paths(paths)
+
+    scale = float(dpi) / units_per_inch
+    width = max(int(math.ceil(max_x*scale)), 1)
+    height = max(int(math.ceil(max_y*scale)), 1)
+
+    index = PathIndex(paths)
+
+    # margin for stroke width and square points, in plotter units
+    pad = (max(paths.widths) if len(paths) else 0) + 1/scale
+
+    coords = paths.coords
+    offsets = paths.offsets
+
+    tiles = []
+    for ty in range(0, height, tile_size):
+        for tx in range(0, width, tile_size):
+            tw = min(tile_size, width-tx)
+            th = min(tile_size, height-ty)
+            items = []
+            for i in index.query(tx/scale - pad, ty/scale - pad, (tx+tw)/scale + pad, (ty+th)/scale + pad):
+                pen = paths.pens[i]
+                if 0 < pen < len(pen_palette):
+                    items.append((pen, paths.widths[i], coords[offsets[i]*2:offsets[i+1]*2]))
+            tiles.append((tx, ty, tw, th, scale, items))
+
+    if jobs > 1:
+        if threads:
+            executor = concurrent.futures.ThreadPoolExecutor(jobs)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(jobs)
+        with executor:
+            bufs = list(executor.map(_render_tile, tiles))
+    else:
+        bufs = [_render_tile(t) for t in tiles]
+
+    rows = [bytearray(width) for y in range(height)]
+
+    for (tx, ty, tw, th, scale, items), buf in zip(tiles, bufs):
+        for j in range(th):
+            rows[ty+j][tx:tx+tw] = buf[j*tw:(j+1)*tw]
+
+    return rows, list(pen_palette)
+
+def hpgl2bmp(gl_file, dpi=100, jobs=1):
+    """Convert HP Graphics Language (HPGL) to a BMP image"""
+
+    rows, palette = render_paths(parse_hpgl(gl_file), dpi, jobs=jobs)
+
+    return generate_bmp(rows, palette)
+
+def hpgl2png(gl_file, dpi=100, jobs=1):
+    """Convert HP Graphics Language (HPGL) to a PNG image"""
+
+    rows, palette = render_paths(parse_hpgl(gl_file), dpi, jobs=jobs)
+
+    return generate_png(rows, palette, jobs=jobs)
@@ -0,0 +1,134 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+import contextlib
+import time
+
+class ParseStats(object):
+    """Counters and timings collected by the parsers
+
+    Pass an instance as the stats argument of parse_hpgl, parse_hprtl and
+    related functions.  commands maps mnemonics to [count, seconds],
+    phases maps phase names to seconds, rows maps RTL compression modes to
+    the number of rows decoded and bytes counts the input bytes consumed.
+    Times are wall clock times and accumulate over calls.  To receive
+    events as they happen, override the add_* methods.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self.phases = {}
+        self.rows = {}
+        self.bytes = 0
+
+    def add_command(self, cmd, seconds):
+        """Record one command and the time taken to interpret it"""
+
+        c = self.commands.get(cmd)
+        if c is None:
+            c = self.commands[cmd] = [0, 0.0]
+        c[0] += 1
+        c[1] += seconds
+
+    def add_phase(self, name, seconds):
+        """Record time spent in a phase"""
+
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_rows(self, compression, count=1):
+        """Record decoded RTL rows"""
+
+        self.rows[compression] = self.rows.get(compression, 0) + count
+
+    def add_bytes(self, count):
+        """Record consumed input bytes"""
+
+        self.bytes += count
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager timing a phase"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def as_dict(self):
+        """Statistics as a dict that can be serialized as JSON"""
+
+        return {
+            'bytes': self.bytes,
+            'phases': dict(self.phases),
+            'commands': dict((k, {'count': c, 'seconds': t}) for k, (c, t) in self.commands.items()),
+            'rows': dict(('%d' % k, v) for k, v in self.rows.items())
+        }
+
+def timed(stats, name):
+    """stats.phase(name), or a context manager doing nothing if stats is None"""
+
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.phase(name)
+
+class _CountingReader(object):
+    """File object wrapper counting the bytes or characters read"""
+
+    def __init__(self, fp, stats):
+        self.fp = fp
+        self.stats = stats
+
+    def read(self, size=-1):
+        data = self.fp.read(size)
+        self.stats.add_bytes(len(data))
+        return data
+
+def timed_tokens(tokens, stats):
+    """Pass (mnemonic, ...) tokens through, recording command statistics
+
+    The time from yielding a token until the next one is requested is
+    counted as the time taken by its command.  Time spent producing the
+    tokens is recorded as the 'tokenize' phase.
+    """
+
+    clock = time.perf_counter
+    add = stats.add_command
+    tokenize = 0.0
+
+    it = iter(tokens)
+    try:
+        while True:
+            t0 = clock()
+            try:
+                tok = next(it)
+            except StopIteration:
+                break
+            t1 = clock()
+            tokenize += t1 - t0
+            yield tok
+            add(tok[0], clock() - t1)
+    finally:
+        stats.add_phase('tokenize', tokenize)
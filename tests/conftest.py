@@ -0,0 +1,46 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import pytest
+
+import hpgl.hprtl
+import hpgl.index
+import hpgl.paths
+import hpgl.png
+
+@pytest.fixture(params=['numpy', 'python'])
+def numpy_mode(request, monkeypatch):
+    """Run a test with and without NumPy"""
+
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+        # use NumPy even for short inputs
+        monkeypatch.setattr(hpgl.paths, 'numpy_threshold', 0)
+        monkeypatch.setattr(hpgl.hprtl, 'numpy_threshold', 0)
+    else:
+        monkeypatch.setattr(hpgl.paths, 'numpy', None)
+        monkeypatch.setattr(hpgl.index, 'numpy', None)
+        monkeypatch.setattr(hpgl.hprtl, 'numpy', None)
+        monkeypatch.setattr(hpgl.png, 'numpy', None)
+    return request.param
@@ -0,0 +1,183 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import io
+import os
+import time
+
+import pytest
+
+from hpgl.cache import ConversionCache
+from hpgl.cli import hpgl2svg
+
+def _key(n):
+    return '%064x' % n
+
+def _read_size(path):
+    with open(os.path.join(str(path), '.size')) as f:
+        return int(f.read())
+
+def test_key(tmp_path):
+    cache = ConversionCache(str(tmp_path / 'cache'))
+    data = b'IN;SP1;PA10,10;'
+    fn = str(tmp_path / 'in.plt')
+    with open(fn, 'wb') as f:
+        f.write(data)
+    key = cache.key(data, 'svg')
+    assert cache.key(fn, 'svg') == key
+    assert cache.key(io.BytesIO(data), 'svg') == key
+    assert cache.key(io.StringIO('IN;'), 'svg') == cache.key(b'IN;', 'svg')
+    assert cache.key(data, 'bmp') != key
+    assert cache.key(data, 'svg', simplify=1) != key
+    assert cache.key(data, 'svg', simplify=1) == cache.key(data, 'svg', simplify=1)
+
+def test_put_get(tmp_path):
+    cache = ConversionCache(str(tmp_path))
+    assert cache.get(_key(1)) is None
+    cache.put(_key(1), b'abc')
+    assert cache.get(_key(1)) == b'abc'
+    assert cache.size() == 3
+    assert _read_size(tmp_path) == 3
+
+def test_eviction(tmp_path):
+    cache = ConversionCache(str(tmp_path), max_size=1000)
+    for k in range(10):
+        cache.put(_key(k), bytes(100))
+    assert _read_size(tmp_path) == 1000
+
+    # oldest first, then reading entry 0 makes it the most recently used
+    now = time.time()
+    for k in range(10):
+        os.utime(cache._entry(_key(k)), (now-100+k, now-100+k))
+    assert cache.get(_key(0)) == bytes(100)
+
+    # exceeding max_size evicts down to low_water
+    cache.put(_key(10), bytes(100))
+    kept = [k for k in range(11) if cache.get(_key(k)) is not None]
+    assert kept == [0] + list(range(3, 11))
+    assert _read_size(tmp_path) == 900
+    assert cache.size() == 900
+
+def test_shared_size(tmp_path):
+    # caches sharing a directory see each other's entries
+    a = ConversionCache(str(tmp_path), max_size=250)
+    b = ConversionCache(str(tmp_path), max_size=250)
+    a.put(_key(1), bytes(100))
+    b.put(_key(2), bytes(100))
+    assert _read_size(tmp_path) == 200
+    a.put(_key(3), bytes(100))
+    assert a.size() <= 250*a.low_water
+
+def test_no_scan_below_max_size(tmp_path, monkeypatch):
+    cache = ConversionCache(str(tmp_path), max_size=1000)
+    cache.put(_key(1), bytes(100))
+    def fail():
+        raise AssertionError("cache directory scanned")
+    monkeypatch.setattr(cache, '_entries', fail)
+    for k in range(2, 6):
+        cache.put(_key(k), bytes(100))
+    assert _read_size(tmp_path) == 500
+
+def _copy(source, fp, prefix=b''):
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            data = f.read()
+    else:
+        data = source.read()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+    fp.write(prefix + data)
+
+class _Unseekable(io.BytesIO):
+    def seekable(self):
+        return False
+
+def test_convert(tmp_path):
+    cache = ConversionCache(str(tmp_path / 'cache'))
+    calls = []
+    def func(source, fp, **options):
+        calls.append(source)
+        _copy(source, fp, **options)
+
+    fn = str(tmp_path / 'in.plt')
+    with open(fn, 'wb') as f:
+        f.write(b'data')
+
+    # func gets the file name, not the contents
+    out = io.BytesIO()
+    assert not cache.convert(fn, out, 'copy', func, prefix=b'>')
+    assert calls == [fn]
+    assert out.getvalue() == b'>data'
+
+    out = io.BytesIO()
+    assert cache.convert(io.BytesIO(b'data'), out, 'copy', func, prefix=b'>')
+    assert len(calls) == 1
+    assert out.getvalue() == b'>data'
+
+    # seekable file objects are rewound to where they started
+    src = io.BytesIO(b'skip:more')
+    src.read(5)
+    out = io.BytesIO()
+    assert not cache.convert(src, out, 'copy', func)
+    assert calls[-1] is src
+    assert out.getvalue() == b'more'
+
+    # other file objects are spooled while hashing
+    src = _Unseekable(b'stream')
+    out = io.BytesIO()
+    assert not cache.convert(src, out, 'copy', func)
+    assert calls[-1] is not src
+    assert out.getvalue() == b'stream'
+    out = io.BytesIO()
+    assert cache.convert(b'stream', out, 'copy', func)
+    assert out.getvalue() == b'stream'
+
+def test_convert_error(tmp_path):
+    cache = ConversionCache(str(tmp_path))
+    def func(source, fp):
+        fp.write(b'partial')
+        raise ValueError("bad input")
+    with pytest.raises(ValueError):
+        cache.convert(b'data', io.BytesIO(), 'copy', func)
+    # nothing is stored, and no temporary files are left
+    assert cache.get(cache.key(b'data', 'copy')) is None
+    assert [fn for d in os.listdir(str(tmp_path)) if os.path.isdir(str(tmp_path / d)) for fn in os.listdir(str(tmp_path / d))] == []
+
+def test_cli_cache(tmp_path, capsys):
+    gl = 'IN;SP1;PU;PA100,100;PD;PA200,100,200,200;PU;'
+    for fn in ['a.plt', 'b.plt']:
+        with open(str(tmp_path / fn), 'w') as f:
+            f.write(gl)
+    cache_dir = str(tmp_path / 'cache')
+    hpgl2svg(['hpgl2svg', str(tmp_path / 'a.plt'), '--cache', cache_dir])
+    assert 'Cache miss' in capsys.readouterr().out
+    hpgl2svg(['hpgl2svg', str(tmp_path / 'b.plt'), '--cache', cache_dir])
+    assert 'Cache hit' in capsys.readouterr().out
+    with open(str(tmp_path / 'a.plt.svg'), 'rb') as f:
+        a = f.read()
+    with open(str(tmp_path / 'b.plt.svg'), 'rb') as f:
+        assert f.read() == a
+    hpgl2svg(['hpgl2svg', str(tmp_path / 'a.plt'), str(tmp_path / 'ref.svg')])
+    with open(str(tmp_path / 'ref.svg'), 'rb') as f:
+        assert f.read() == a
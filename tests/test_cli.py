@@ -0,0 +1,152 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import io
+import json
+import os
+
+import pytest
+
+import hpgl
+from hpgl.cli import hpgl2svg, hprtl2bmp
+
+gl_files = {
+    'a.plt': 'IN;SP1;PU;PA100,100;PD;PA200,100,200,200;PU;',
+    'b.plt': 'IN;SP2;PU;PA0,0;PD;PA50,50;PU;',
+    'c.hpgl': 'IN;SP3;PU;PA40,40;PD;PU;',
+}
+
+rtl = (b'\x1bE\x1b%0B\x1b%1A\x1b*r1U\x1b*r16S\x1b*r1A\x1b*b0M' +
+    b'\x1b*b2W\xf0\x0f\x1b*b2W\x00\xff\x1b*rC\x1b%0B\x1bE')
+
+def _write(path, data):
+    with open(str(path), 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
+
+def _read(path):
+    with open(str(path), 'rb') as f:
+        return f.read()
+
+def _svg(gl):
+    return hpgl.generate_svg(hpgl.parse_hpgl(io.StringIO(gl))).encode('utf-8')
+
+@pytest.fixture
+def gl_dir(tmp_path):
+    d = tmp_path / 'in'
+    d.mkdir()
+    for fn, gl in gl_files.items():
+        _write(d / fn, gl)
+    # not an HPGL extension, skipped when converting a directory
+    _write(d / 'notes.txt', 'IN;')
+    return d
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_batch_dir(gl_dir, tmp_path, capsys, jobs):
+    out = tmp_path / 'out'
+    hpgl2svg(['hpgl2svg', str(gl_dir), '-o', str(out), '-j', jobs])
+    assert sorted(os.listdir(str(out))) == sorted(fn + '.svg' for fn in gl_files)
+    for fn, gl in gl_files.items():
+        assert _read(out / (fn + '.svg')) == _svg(gl)
+    assert 'Converted 3 of 3 files' in capsys.readouterr().out
+
+def test_batch_glob(gl_dir):
+    hpgl2svg(['hpgl2svg', str(gl_dir / '*.plt')])
+    assert sorted(fn for fn in os.listdir(str(gl_dir)) if fn.endswith('.svg')) == ['a.plt.svg', 'b.plt.svg']
+    assert _read(gl_dir / 'b.plt.svg') == _svg(gl_files['b.plt'])
+
+def test_batch_failure(gl_dir, tmp_path, capsys):
+    _write(gl_dir / 'bad.plt', 'IN;SP1;ZZ1;')
+    out = tmp_path / 'out'
+    with pytest.raises(SystemExit) as exc:
+        hpgl2svg(['hpgl2svg', str(gl_dir), '-o', str(out)])
+    assert exc.value.code == 1
+    # partial output is removed, the other files are converted
+    assert sorted(os.listdir(str(out))) == sorted(fn + '.svg' for fn in gl_files)
+    captured = capsys.readouterr().out
+    assert 'bad.plt: failed' in captured
+    assert 'Converted 3 of 4 files' in captured
+
+def test_output_name(gl_dir, tmp_path):
+    # the second of two names is the output unless it is another input
+    hpgl2svg(['hpgl2svg', str(gl_dir / 'a.plt'), str(tmp_path / 'a.xml')])
+    assert _read(tmp_path / 'a.xml') == _svg(gl_files['a.plt'])
+    hpgl2svg(['hpgl2svg', str(gl_dir / 'a.plt'), str(tmp_path / 'new.svg')])
+    assert _read(tmp_path / 'new.svg') == _svg(gl_files['a.plt'])
+    hpgl2svg(['hpgl2svg', str(gl_dir / 'a.plt'), str(gl_dir / 'b.plt')])
+    assert _read(gl_dir / 'a.plt.svg') == _svg(gl_files['a.plt'])
+    assert _read(gl_dir / 'b.plt.svg') == _svg(gl_files['b.plt'])
+
+def test_hprtl2bmp_batch(tmp_path, capsys):
+    for fn in ['a.rtl', 'b.prn']:
+        _write(tmp_path / fn, rtl)
+    out = tmp_path / 'out'
+    hprtl2bmp(['hprtl2bmp', str(tmp_path), '-o', str(out), '-j', '2'])
+    out_ref = io.BytesIO()
+    hpgl.hprtl2bmp(io.BytesIO(rtl), out_ref)
+    ref = out_ref.getvalue()
+    assert _read(out / 'a.rtl.bmp') == ref
+    assert _read(out / 'b.prn.bmp') == ref
+    assert 'Converted 2 of 2 files' in capsys.readouterr().out
+    hprtl2bmp(['hprtl2bmp', str(tmp_path / 'a.rtl'), str(tmp_path / 'single.out')])
+    assert _read(tmp_path / 'single.out') == ref
+
+def test_hprtl2bmp_max_size(tmp_path):
+    _write(tmp_path / 'a.rtl', rtl)
+    hprtl2bmp(['hprtl2bmp', str(tmp_path / 'a.rtl'), str(tmp_path / 'a.bmp'), '--max-size', '2'])
+    rows, palette = hpgl.hprtl.preview_hprtl(rtl, 2, indexed=True)
+    assert len(rows[0]) == 2
+    ref = io.BytesIO()
+    hpgl.write_bmp(rows, ref, palette)
+    assert _read(tmp_path / 'a.bmp') == ref.getvalue()
+
+def test_stats(gl_dir, tmp_path):
+    stats_name = str(tmp_path / 'stats.json')
+    hpgl2svg(['hpgl2svg', str(gl_dir), '-o', str(tmp_path / 'out'), '--stats', stats_name])
+    with open(stats_name) as f:
+        stats = json.load(f)
+    assert sorted(stats) == sorted(os.path.join(str(gl_dir), fn) for fn in gl_files)
+    for fn, gl in gl_files.items():
+        s = stats[os.path.join(str(gl_dir), fn)]
+        assert s['bytes'] == len(gl)
+        assert s['commands']['IN']['count'] == 1
+        assert 'write_svg' in s['phases']
+
+def test_stats_cache(tmp_path, capsys):
+    # files converted from the cache are marked instead of reporting empty statistics
+    for fn in ['a.rtl', 'b.rtl']:
+        _write(tmp_path / fn, rtl)
+    cache_dir = str(tmp_path / 'cache')
+    hprtl2bmp(['hprtl2bmp', str(tmp_path / 'a.rtl'), str(tmp_path / 'b.rtl'), '--cache', cache_dir, '--stats', '-'])
+    out = capsys.readouterr().out
+    stats = json.loads(out[out.index('{'):])
+    assert stats[str(tmp_path / 'a.rtl')]['rows'] == {'0': 2}
+    assert stats[str(tmp_path / 'b.rtl')] == {'cached': True}
+
+def test_stats_max_size(tmp_path, capsys):
+    _write(tmp_path / 'a.rtl', rtl)
+    hprtl2bmp(['hprtl2bmp', str(tmp_path / 'a.rtl'), str(tmp_path / 'a.bmp'), '--max-size', '8', '--stats', '-'])
+    out = capsys.readouterr().out
+    stats = json.loads(out[out.index('{'):])
+    # every other row of the preview is decoded
+    assert stats[str(tmp_path / 'a.rtl')]['rows'] == {'0': 1}
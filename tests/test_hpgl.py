@@ -0,0 +1,256 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import io
+import os
+import re
+
+import pytest
+
+import hpgl
+from hpgl.hpgl import HPGLInterpreter, _tokenize_hpgl
+
+# expected output in data was generated with the original character at a
+# time parser
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+hpgl_cases = {
+    'comma': 'IN;SP1;PU;PA100,100;PD;PA200,100,200,200;PU;',
+    'space': 'IN;SP1;PU;PA100 100;PD;PA200 100 200 200;PU;',
+    'newline': 'IN;SP1;PU;PA100,100;PD;PA200,100\n200,200;PU;',
+    'trailing_newline': 'IN;SP1;PU;PA10,10;PD;PA20,20;PU;\n',
+    'trailing_crlf': 'IN;SP1;PU;PA10,10;PD;PA20,20;PU;\r\n',
+    'pens': 'IN;SP1;PU;PA0,0;PD;PA50,50;PU;SP2;PA60,0;PD;PA0,60;PU;SP;PD;PU;',
+    'points': 'IN;SP3;PU;PA40,40;PD;PU;PA80,40;PD;PU;',
+    'scaled': 'IN;IP0,0,1000,1000;SC0,100,0,100;SP2;PU;PA10,10;PD;PA50,50,90,10;PU;',
+    'labels': 'IN;SP1;SI0.2,0.3;PU;PA100,100;LBab\x03PA;LB\rX\x03PA300,100;LBc\nd\x03',
+    'label_sizes': 'IN;SP1;SR1.5,2;PU;PA100,100;LBHello\x03SI0.1,0.2;PA100,300;LBWorld\x03SS;SA;DI1,0;',
+}
+
+# HPGL that the original parser rejected, with equivalent HPGL it accepted
+hpgl_equivalent = {
+    'pu_pd_parameters': ('IN;SP1;PU100,100;PD200,100,200,200;PU;', 'comma'),
+    'pd_space_parameters': ('IN;SP1;PU100 100;PD200 100 200 200;PU;', 'comma'),
+}
+
+def _expected(name):
+    with open(os.path.join(data_dir, name), 'rb') as f:
+        return f.read()
+
+def _svg(gl):
+    return hpgl.generate_svg(hpgl.parse_hpgl(io.StringIO(gl))).encode('utf-8')
+
+@pytest.mark.parametrize('name', sorted(hpgl_cases))
+def test_svg(name):
+    assert _svg(hpgl_cases[name]) == _expected(name + '.svg')
+
+@pytest.mark.parametrize('name', sorted(hpgl_cases))
+def test_svg_bytes(name):
+    # bytes are decoded one character per byte
+    gl = hpgl_cases[name].encode('latin-1')
+    assert hpgl.generate_svg(hpgl.parse_hpgl(gl)).encode('utf-8') == _expected(name + '.svg')
+
+@pytest.mark.parametrize('name', sorted(hpgl_cases))
+def test_tokenize_blocks(name):
+    # tokens split across read blocks are put back together
+    gl = hpgl_cases[name]
+    assert list(_tokenize_hpgl(io.StringIO(gl), block_size=3)) == list(_tokenize_hpgl(io.StringIO(gl)))
+
+@pytest.mark.parametrize('name', sorted(hpgl_equivalent))
+def test_equivalent(name):
+    gl, ref = hpgl_equivalent[name]
+    assert _svg(gl) == _expected(ref + '.svg')
+
+@pytest.mark.parametrize('gl', ['IN;SP1;PD;PA1,2,3;PU;', 'IN;PU1;', 'IN;PD1,2,3;'])
+def test_odd_coordinates(gl):
+    with pytest.raises(Exception):
+        hpgl.parse_hpgl(io.StringIO(gl))
+
+def test_unknown_command():
+    with pytest.raises(Exception):
+        hpgl.parse_hpgl(io.StringIO('IN;SP1;ZZ1;'))
+
+    def zz(interp, params):
+        st = interp.state
+        return ((st.cur_pen, st.pen_width, [0, 0, 100, 100]),)
+
+    # mnemonics are matched regardless of case
+    for key in ['ZZ', 'zz', 'Zz']:
+        p, w, h = hpgl.parse_hpgl(io.StringIO('IN;SP1;ZZ1;'), handlers={key: zz})
+        assert (w, h) == (120, 120)
+        assert len(p) == 1
+
+    # None ignores a command
+    svg = hpgl.generate_svg(hpgl.parse_hpgl(io.StringIO('IN;SP1;PD;PA5,5;zz1;PU;'), handlers={'zz': None}))
+    assert svg == hpgl.generate_svg(hpgl.parse_hpgl(io.StringIO('IN;SP1;PD;PA5,5;PU;')))
+
+def test_interpreter_handlers():
+    calls = []
+
+    def sp(interp, params):
+        calls.append(params)
+
+    interp = HPGLInterpreter(handlers={'sp': sp})
+    interp.register('zz', None)
+    assert list(interp.run(io.StringIO('IN;SP2;ZZ;PD;PA10,10;'))) == [(1, interp.state.pen_width, [0, 0, 10, 10])]
+    assert calls == ['2']
+    # defaults are not changed by handlers of one interpreter
+    assert HPGLInterpreter.commands['SP'] is not sp
+    assert 'ZZ' not in HPGLInterpreter().handlers
+
+@pytest.mark.parametrize('cmd', ['IN', 'DF'])
+def test_interpreter_reset(cmd):
+    interp = HPGLInterpreter()
+    paths = list(interp.run(io.StringIO('IN;SP3;PA100,200;PD;%s;PA5,5;' % cmd)))
+    st = interp.state
+    assert (st.cur_pen, st.pen_down) == (1, False)
+    assert (st.cur_x, st.cur_y) == (5, 5)
+    assert paths == []
+
+@pytest.mark.parametrize('name', sorted(hpgl_cases))
+def test_iter_hpgl(name):
+    gl = hpgl_cases[name]
+    bounds = []
+    paths = list(hpgl.iter_hpgl(io.StringIO(gl), bounds))
+    ref, max_x, max_y = hpgl.parse_hpgl(io.StringIO(gl))
+    # same paths as parse_hpgl, before the y axis flip
+    def key(paths):
+        return sorted((pen, w, [(round(x, 6), round(y, 6)) for x, y in pts]) for pen, w, pts in paths)
+    assert key(paths) == key((pen, w, [(x-10, max_y-y-10) for x, y in pts]) for pen, w, pts in ref)
+    if paths:
+        pts = [p for path in paths for p in path[2]]
+        assert bounds == [min(p[0] for p in pts), min(p[1] for p in pts), max(p[0] for p in pts), max(p[1] for p in pts)]
+
+class _Unseekable(io.StringIO):
+    def seekable(self):
+        return False
+
+@pytest.mark.parametrize('name', sorted(hpgl_cases))
+def test_write_svg_stream(name):
+    gl = hpgl_cases[name]
+    out = io.StringIO()
+    hpgl.write_svg_stream(hpgl.iter_hpgl(io.StringIO(gl)), out)
+    out2 = _Unseekable()
+    hpgl.write_svg_stream(hpgl.iter_hpgl(io.StringIO(gl)), out2)
+    svg = out.getvalue()
+    svg2 = out2.getvalue()
+    paths, max_x, max_y = hpgl.parse_hpgl(io.StringIO(gl))
+    assert 'width="%d" height="%d" viewBox="0 %d %d %d"' % (max_x, max_y, -max_y, max_x, max_y) in svg
+    # header padding is the only difference when spooled
+    assert svg.replace(' ', '') == svg2.replace(' ', '')
+    assert svg.count('\n') == svg2.count('\n') == len(paths) + 5
+    assert svg.endswith('</svg>\n')
+
+@pytest.mark.parametrize('name', sorted(hpgl_cases))
+def test_svg_numpy(name, numpy_mode):
+    assert _svg(hpgl_cases[name]) == _expected(name + '.svg')
+
+@pytest.mark.parametrize('name', sorted(hpgl_cases))
+def test_write_svg(name):
+    paths = hpgl.parse_hpgl(io.StringIO(hpgl_cases[name]))
+    out = io.StringIO()
+    hpgl.write_svg(paths, out)
+    assert out.getvalue().encode('utf-8') == _expected(name + '.svg')
+    out = io.BytesIO()
+    hpgl.write_svg(paths, out)
+    assert out.getvalue() == _expected(name + '.svg')
+
+def test_write_svg_stream_binary():
+    gl = hpgl_cases['labels']
+    out = io.StringIO()
+    hpgl.write_svg_stream(hpgl.iter_hpgl(io.StringIO(gl)), out)
+    out2 = io.BytesIO()
+    hpgl.write_svg_stream(hpgl.iter_hpgl(io.StringIO(gl)), out2)
+    assert out2.getvalue() == out.getvalue().encode('utf-8')
+
+def test_hpgl2svg_cli(tmp_path):
+    from hpgl.cli import hpgl2svg
+    gl_name = str(tmp_path / 'labels.plt')
+    with open(gl_name, 'w', newline='') as f:
+        f.write(hpgl_cases['labels'])
+    hpgl2svg(['hpgl2svg', gl_name])
+    with open(gl_name + '.svg', 'rb') as f:
+        assert f.read() == _expected('labels.svg')
+
+def test_glyph_reuse():
+    gl = hpgl_cases['labels'] + 'SI0.4,0.6;PA500,500;LBaba\x03'
+    rendered, max_x, max_y = hpgl.parse_hpgl(io.StringIO(gl))
+    paths = hpgl.parse_hpgl(io.StringIO(gl), render_labels=False)
+    # label characters still count towards the page size
+    assert paths[1:] == (max_x, max_y)
+    svg = hpgl.generate_svg(paths)
+
+    # each glyph is defined once and placed once per character
+    defs = dict(re.findall(r'<path id="glyph-(\d+)" d="([^"]*)" />', svg))
+    uses = re.findall(r'<use xlink:href="#glyph-(\d+)" transform="translate\(([-\d.]+),([-\d.]+)\) scale\(([-\d.e]+),([-\d.e]+)\)"', svg)
+    labels = paths[0].labels
+    assert sorted(defs) == sorted(set(str(ord(lb[7])) for lb in labels))
+    assert [int(u[0]) for u in uses] == [ord(lb[7]) for lb in labels]
+    assert 'xmlns:xlink=' in svg
+    assert svg.count('<path ') + svg.count('<rect ') == len(defs) + len(paths[0])
+
+    # placing the glyph definitions reproduces the rendered label paths
+    strokes = []
+    for lb in labels:
+        for d in defs[str(ord(lb[7]))].split('M')[1:]:
+            pts = [tuple(float(v) for v in p.strip().split(',')) for p in d.split('L')]
+            strokes.append([(lb[0]+x*lb[2], lb[1]-y*lb[2]) for x, y in pts])
+    ref = [pts for pen, width, pts in rendered[len(paths[0]):]]
+    assert len(strokes) == len(ref)
+    for a, b in zip(strokes, ref):
+        assert [v for p in a for v in p] == pytest.approx([v for p in b for v in p])
+
+def test_glyph_cache():
+    from hpgl.hpgl import _glyph, _render_label
+    assert _glyph('a', 0.2) is _glyph('a', 0.2)
+    assert _glyph(' ', 0.2) == ()
+    # rendering translates the cached strokes
+    xs, ys = _glyph('X', 2)[0]
+    assert _render_label((10, 20, 2, 3, 1, 0.1, 48, 'X'))[0] == (1, 0.1, [v for p in zip(xs, ys) for v in (p[0]+10, p[1]+20)])
+
+def test_parse_merge():
+    gl = 'IN;SP1;PA0,0;PD;PA10,0;PA10,10;PA20,10;PU;PA0,50;PD;PU;'
+    paths, max_x, max_y = hpgl.parse_hpgl(io.StringIO(gl), merge=True)
+    assert list(paths) == [(1, 14.0, [(10, 60), (20, 60), (20, 50), (30, 50)]), (1, 14.0, [(10, 10)])]
+    assert (max_x, max_y) == hpgl.parse_hpgl(io.StringIO(gl))[1:]
+
+def test_simplify():
+    gl = 'IN;SP1;PA0,0;PD;PA10,1,20,0,30,1,40,0,40,40;PU;'
+    ref = hpgl.parse_hpgl(io.StringIO(gl))
+    paths = hpgl.parse_hpgl(io.StringIO(gl), simplify=2)
+    assert list(paths[0]) == [(1, 14.0, [(10, 50), (50, 50), (50, 10)])]
+    assert paths[1:] == ref[1:]
+    assert hpgl.generate_svg(ref, simplify=2) == hpgl.generate_svg(paths)
+    assert hpgl.generate_svg(ref, simplify=0.5) == hpgl.generate_svg(ref)
+
+def test_hpgl2svg_cli_simplify(tmp_path):
+    from hpgl.cli import hpgl2svg
+    gl = 'IN;SP1;PA0,0;PD;PA10,1,20,0,30,1,40,0,40,40;PU;'
+    gl_name = str(tmp_path / 'in.plt')
+    svg_name = str(tmp_path / 'out.svg')
+    with open(gl_name, 'w', newline='') as f:
+        f.write(gl)
+    hpgl2svg(['hpgl2svg', gl_name, svg_name, '--simplify', '2'])
+    with open(svg_name) as f:
+        assert f.read() == hpgl.generate_svg(hpgl.parse_hpgl(io.StringIO(gl), simplify=2))
@@ -0,0 +1,327 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import io
+import os
+import random
+import struct
+
+import pytest
+
+from hpgl import hprtl
+
+# expected output in data was generated with the original parser
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def _rtl_row(data, last=True):
+    return b'\x1b*b%d%s' % (len(data), b'W' if last else b'V') + data
+
+_rtl_header = b'\x1bE\x1b%0B\x1b%1A'
+_rtl_footer = b'\x1b*rC\x1b%0B\x1bE'
+
+rtl_cases = {
+    'k_raw': _rtl_header + b'\x1b*r1U\x1b*r16S\x1b*r1A\x1b*b0M' +
+        _rtl_row(b'\xf0\x0f') + _rtl_row(b'\xaa') + _rtl_row(b'\x00\xff') + _rtl_footer,
+    'k_rle': _rtl_header + b'\x1b*r1U\x1b*r24S\x1b*r1A\x1b*b1M' +
+        _rtl_row(b'\x02\xf0\x01\x0f') + _rtl_row(b'\x01\xaa') + _rtl_row(b'\x03\x81') + _rtl_footer,
+    'k_packbits': _rtl_header + b'\x1b*r1U\x1b*r24S\x1b*r1A\x1b*b2M' +
+        _rtl_row(b'\x01\xaa\x55\xff\x0f') + _rtl_row(b'\x80\xfe\x3c') + _rtl_row(b'\x00\x81') + _rtl_footer,
+    'k_no_width': _rtl_header + b'\x1b*r1U\x1b*r1A\x1b*b0M' +
+        _rtl_row(b'\xf0\x0f') + _rtl_row(b'\x3c\xc3') + _rtl_footer,
+    'null_params': _rtl_header + b'\x1b*r1\x00U\x1b*r1\x006S\x1b*r1A\x1b*b0\x00M' +
+        _rtl_row(b'\xf0\x0f') + b'\x1b*b2\x00W\x18\x81' + _rtl_footer,
+    'cmy_raw': _rtl_header + b'\x1b*r-3U\x1b*r16S\x1b*r1A\x1b*b0M' +
+        _rtl_row(b'\xf0\x00', False) + _rtl_row(b'\x0f\x00', False) + _rtl_row(b'\x3c\xff') +
+        _rtl_row(b'\x00\xff', False) + _rtl_row(b'\xff\x00', False) + _rtl_row(b'\x81\x81') + _rtl_footer,
+    'cmy_plane_reset': _rtl_header + b'\x1b*r-3U\x1b*r16S\x1b*r1A\x1b*b0M' +
+        _rtl_row(b'\xf0\x00', False) + _rtl_row(b'\x0f\x00', False) + _rtl_row(b'\x3c\xff') +
+        _rtl_row(b'\xff\xff') +
+        _rtl_row(b'\x00\xff', False) + _rtl_row(b'\xff\x00', False) + _rtl_row(b'\x81\x81') + _rtl_footer,
+    'kcmy_packbits': _rtl_header + b'\x1b*r-4U\x1b*r16S\x1b*r1A\x1b*b2M' +
+        _rtl_row(b'\xff\xf0', False) + _rtl_row(b'\x01\x0f\x00', False) + _rtl_row(b'\x80\xff\x3c', False) + _rtl_row(b'\xff\x81') +
+        _rtl_row(b'\x00\x55\x80\xff\x00', False) + _rtl_row(b'\xff\x00', False) + _rtl_row(b'\xff\xff', False) + _rtl_row(b'\x01\x0f\xf0') + _rtl_footer,
+}
+
+def _expected(name):
+    with open(os.path.join(data_dir, name), 'rb') as f:
+        return f.read()
+
+def _bmp_pixels(bmp):
+    """Decode a 1, 4, 8 or 24 bit BMP to rows of (r, g, b), top row first"""
+
+    offset, = struct.unpack('<L', bmp[10:14])
+    width, height, planes, bpp = struct.unpack('<llHH', bmp[18:30])
+    colors, = struct.unpack('<L', bmp[46:50])
+    palette = [(b[2], b[1], b[0]) for b in struct.iter_unpack('<BBBB', bmp[54:54+colors*4])]
+    row_size = (bpp*width + 31)//32*4
+    rows = []
+    for k in range(abs(height)):
+        r = bmp[offset+k*row_size:offset+(k+1)*row_size]
+        if bpp == 24:
+            rows.append([(r[x*3+2], r[x*3+1], r[x*3]) for x in range(width)])
+        else:
+            ppb = 8 // bpp
+            idx = [(r[x // ppb] >> (8 - bpp*(x % ppb + 1))) & ((1 << bpp) - 1) for x in range(width)]
+            rows.append([palette[i] for i in idx])
+    if height > 0:
+        # bottom up
+        rows.reverse()
+    return bpp, rows
+
+@pytest.mark.parametrize('name', sorted(rtl_cases))
+def test_bmp(name, numpy_mode):
+    rtl = rtl_cases[name]
+    assert hprtl.generate_bmp(hprtl.parse_hprtl(io.BytesIO(rtl))) == _expected(name + '.bmp')
+
+@pytest.mark.parametrize('name', sorted(rtl_cases))
+def test_input_types(name, tmp_path):
+    rtl = rtl_cases[name]
+    ref = hprtl.parse_hprtl(io.BytesIO(rtl))
+    assert hprtl.parse_hprtl(rtl) == ref
+    assert hprtl.parse_hprtl(bytearray(rtl)) == ref
+    # files are memory mapped
+    fn = str(tmp_path / 'in.rtl')
+    with open(fn, 'wb') as f:
+        f.write(rtl)
+    with open(fn, 'rb') as f:
+        assert hprtl.parse_hprtl(f) == ref
+
+def test_ignored_data():
+    # bytes between escapes and unknown escapes are skipped
+    rtl = rtl_cases['k_raw']
+    noisy = rtl.replace(b'\x1b*r1A', b'\x1b*r1A' + bytes(range(1, 27))*1000 + b'\x1b*p100Y')
+    assert hprtl.parse_hprtl(noisy) == hprtl.parse_hprtl(rtl)
+
+@pytest.mark.parametrize('tail', [b'\x1b*', b'\x1b*b2'])
+def test_truncated(tail):
+    with pytest.raises(Exception):
+        hprtl.parse_hprtl(rtl_cases['k_raw'][:-len(_rtl_footer)] + tail)
+
+def test_decode_rle(numpy_mode):
+    assert hprtl._decode_rle(b'\x02\xf0\x01\x0f\x00\xaa\x03\x81') == b'\xf0\xf0\x0f\x81\x81\x81'
+    # a trailing count without a value is ignored
+    assert hprtl._decode_rle(b'\x02\xf0\x05') == b'\xf0\xf0'
+    assert hprtl._decode_rle(b'') == b''
+
+def test_decode_packbits():
+    # literal run, replicate run, no-op
+    assert hprtl._decode_packbits(b'\x01\xaa\x55\xfe\x3c\x80\x00\x81') == b'\xaa\x55\x3c\x3c\x3c\x81'
+    # truncated runs
+    assert hprtl._decode_packbits(b'\x03\x01\x02') == b'\x01\x02'
+    assert hprtl._decode_packbits(b'\x00\x01\xfe') == b'\x01'
+
+@pytest.mark.parametrize('compression,data', [(0, b'\x01\x02\x03\x04\x05'), (1, b'\x05\x07'), (2, b'\xfc\x07')])
+def test_decode_row(compression, data, numpy_mode):
+    # rows are truncated or zero padded to the row width
+    full = hprtl._decode_row(compression, data, 5)
+    assert len(full) == 5
+    assert hprtl._decode_row(compression, data, 3) == full[:3]
+    assert hprtl._decode_row(compression, data, 8) == full + bytes(3)
+    assert isinstance(hprtl._decode_row(compression, memoryview(data), 5), bytes)
+
+def test_decode_row_invalid():
+    with pytest.raises(Exception):
+        hprtl._decode_row(3, b'\x00', 1)
+
+def _combine_reference(plane_data, width):
+    rows = []
+    for y in range(len(plane_data[0])):
+        row = bytearray(width)
+        for i, p in enumerate(plane_data):
+            if y >= len(p):
+                continue
+            for x in range(min(width, len(p[y])*8)):
+                if p[y][x >> 3] & (0x80 >> (x & 7)):
+                    row[x] |= 1 << i
+        rows.append(bytes(row))
+    return rows
+
+@pytest.mark.parametrize('planes', [1, 3, 4])
+@pytest.mark.parametrize('width', [13, 16, 20])
+def test_combine_planes(planes, width, numpy_mode, monkeypatch):
+    rnd = random.Random(planes*100+width)
+    # several blocks of rows
+    monkeypatch.setattr(hprtl, 'block_rows', 4)
+    plane_data = [[bytes(rnd.randrange(256) for k in range(2)) for y in range(10)] for i in range(planes)]
+    assert hprtl._combine_planes(plane_data, width) == _combine_reference(plane_data, width)
+    # rows of different lengths, and a plane with fewer rows
+    plane_data[0][3] = b'\xff'
+    del plane_data[-1][-2:]
+    assert hprtl._combine_planes(plane_data, width) == _combine_reference(plane_data, width)
+
+@pytest.mark.parametrize('name', sorted(rtl_cases))
+def test_indexed(name, numpy_mode):
+    # palette indices give the same pixels as RGB output
+    rtl = rtl_cases[name]
+    rows, palette = hprtl.parse_hprtl(io.BytesIO(rtl), indexed=True)
+    assert all(isinstance(row, bytes) for row in rows)
+    assert [[palette[i] for i in row] for row in rows] == hprtl.parse_hprtl(io.BytesIO(rtl))
+
+@pytest.mark.parametrize('name', sorted(rtl_cases))
+def test_palettized_bmp(name, numpy_mode):
+    rtl = rtl_cases[name]
+    bpp, pixels = _bmp_pixels(hprtl.hprtl2bmp(io.BytesIO(rtl)))
+    assert bpp == (1 if name.startswith('k_') or name == 'null_params' else 4)
+    assert pixels == _bmp_pixels(_expected(name + '.bmp'))[1]
+
+@pytest.mark.parametrize('colors,bpp', [(2, 1), (5, 4), (16, 4), (17, 8), (256, 8)])
+@pytest.mark.parametrize('width', [1, 7, 9, 33])
+def test_generate_bmp_palette(colors, bpp, width):
+    rnd = random.Random(colors*100+width)
+    palette = [(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)) for k in range(colors)]
+    rows = [bytes(rnd.randrange(colors) for x in range(width)) for y in range(3)]
+    got_bpp, pixels = _bmp_pixels(hprtl.generate_bmp(rows, palette))
+    assert got_bpp == bpp
+    assert pixels == [[palette[i] for i in row] for row in rows]
+    assert _bmp_pixels(hprtl.generate_bmp([[palette[i] for i in row] for row in rows]))[1] == pixels
+
+def test_generate_bmp_palette_too_large():
+    with pytest.raises(Exception):
+        hprtl.generate_bmp([bytes(1)], [(0, 0, 0)]*257)
+
+def test_write_bmp(numpy_mode):
+    rnd = random.Random(5)
+    palette = [(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)) for k in range(6)]
+    rows = [bytes(rnd.randrange(6) for x in range(11)) for y in range(4)]
+    rgb = [[palette[i] for i in row] for row in rows]
+
+    out = io.BytesIO()
+    hprtl.write_bmp(rows, out, palette)
+    assert out.getvalue() == hprtl.generate_bmp(rows, palette)
+    assert _bmp_pixels(out.getvalue()) == (4, rgb)
+
+    # rows of ints rather than bytes
+    out = io.BytesIO()
+    hprtl.write_bmp([list(row) for row in rows], out, palette)
+    assert _bmp_pixels(out.getvalue()) == (4, rgb)
+
+    # palette rows expanded to 24 bits, same as RGB input
+    out = io.BytesIO()
+    hprtl.write_bmp(rows, out, palette, bpp=24)
+    assert out.getvalue() == hprtl.generate_bmp(rgb)
+    assert _bmp_pixels(out.getvalue()) == (24, rgb)
+
+def test_write_bmp_array():
+    numpy = pytest.importorskip('numpy')
+    rnd = random.Random(6)
+    rgb = [[(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)) for x in range(5)] for y in range(3)]
+    out = io.BytesIO()
+    hprtl.write_bmp(numpy.array(rgb, dtype=numpy.uint8), out)
+    assert out.getvalue() == hprtl.generate_bmp(rgb)
+
+class _Unseekable(io.BytesIO):
+    def seekable(self):
+        return False
+
+@pytest.mark.parametrize('name', sorted(rtl_cases))
+def test_iter_hprtl(name, numpy_mode):
+    rtl = rtl_cases[name]
+    info = {}
+    rows = list(hprtl.iter_hprtl(io.BytesIO(rtl), info))
+    ref_rows, palette = hprtl.parse_hprtl(io.BytesIO(rtl), indexed=True)
+    assert rows == ref_rows
+    assert info['palette'] == palette
+
+@pytest.mark.parametrize('name', sorted(rtl_cases))
+@pytest.mark.parametrize('out_type', [io.BytesIO, _Unseekable])
+def test_stream_bmp(name, out_type, numpy_mode):
+    # streaming to a file gives the same image as converting in memory
+    rtl = rtl_cases[name]
+    out = out_type()
+    out.write(b'prefix')
+    hprtl.hprtl2bmp(io.BytesIO(rtl), out)
+    bmp = out.getvalue()
+    assert bmp[:6] == b'prefix'
+    bmp = bmp[6:]
+    ref = hprtl.hprtl2bmp(io.BytesIO(rtl))
+    assert _bmp_pixels(bmp) == _bmp_pixels(ref)
+    # top-down, otherwise the same header and palette
+    assert struct.unpack('<l', bmp[22:26])[0] == -struct.unpack('<l', ref[22:26])[0]
+    assert bmp[:22] + bmp[26:54] == ref[:22] + ref[26:54]
+    assert len(bmp) == len(ref)
+
+def test_bmp_writer():
+    palette = [(0, 0, 0), (255, 255, 255), (255, 0, 0)]
+    rows = [bytes([0, 1, 2, 1, 0]), bytes([2, 2, 2, 2, 2])]
+    out = io.BytesIO()
+    w = hprtl.BMPWriter(out, 5, palette, bpp=24)
+    for row in rows:
+        w.write_row(row)
+    w.close()
+    assert _bmp_pixels(out.getvalue()) == (24, [[palette[i] for i in row] for row in rows])
+
+def test_rtl_index(tmp_path, numpy_mode):
+    # each case is one section, decoded the same as the whole file
+    names = sorted(rtl_cases)
+    expected = [hprtl.parse_hprtl(rtl_cases[name], indexed=True) for name in names]
+    data = b''.join(rtl_cases[name] for name in names)
+    index = hprtl.RTLIndex(data)
+    assert len(index) == len(names)
+    for k, (rows, palette) in enumerate(expected):
+        sec = index[k]
+        assert (sec['width'], sec['height']) == (len(rows[0]), len(rows))
+        assert data[sec['offset']:sec['end']] in rtl_cases[names[k]]
+        assert index.decode(k, indexed=True) == (rows, palette)
+        assert list(index.iter_rows(k)) == rows
+    assert index.decode(len(names) - 1) == hprtl.parse_hprtl(rtl_cases[names[-1]])
+    assert index.decode_all(indexed=True) == expected
+    assert index.decode_all(indexed=True, jobs=2) == expected
+    # worker processes reopen the file by name
+    name = str(tmp_path / 'sections.rtl')
+    with open(name, 'wb') as f:
+        f.write(data)
+    assert hprtl.RTLIndex(name).decode_all(indexed=True, jobs=2) == expected
+
+def test_rtl_index_no_sections():
+    index = hprtl.RTLIndex(_rtl_header + _rtl_footer)
+    assert len(index) == 0
+    assert index.decode_all() == []
+
+# previews group planes by *b#W rather than by plane position, so files
+# ending a row before its last plane are left out
+preview_cases = sorted(set(rtl_cases) - {'cmy_plane_reset'})
+
+@pytest.mark.parametrize('name', preview_cases)
+@pytest.mark.parametrize('step', [1, 2, 3, 5])
+def test_preview_hprtl(name, step, numpy_mode):
+    # a preview keeps every step-th pixel of every step-th row
+    rtl = rtl_cases[name]
+    rows, palette = hprtl.parse_hprtl(rtl, indexed=True)
+    expected = [row[::step] for row in rows[::step]]
+    assert hprtl.preview_hprtl(rtl, scale=1.0/step, indexed=True) == (expected, palette)
+    assert hprtl.preview_hprtl(rtl, scale=1.0/step) == [[palette[i] for i in row] for row in expected]
+    assert list(hprtl.iter_hprtl(rtl, step=step)) == expected
+
+@pytest.mark.parametrize('max_size,size', [(256, (24, 3)), (12, (12, 2)), (10, (8, 1)), (1, (1, 1))])
+def test_preview_max_size(max_size, size):
+    rows, palette = hprtl.preview_hprtl(rtl_cases['k_rle'], max_size, indexed=True)
+    assert (len(rows[0]), len(rows)) == size
+
+def test_preview_section():
+    data = rtl_cases['k_raw'] + rtl_cases['cmy_raw']
+    assert hprtl.preview_hprtl(data, section=1) == hprtl.parse_hprtl(rtl_cases['cmy_raw'])
+
+def test_preview_no_raster_data():
+    with pytest.raises(Exception):
+        hprtl.preview_hprtl(_rtl_header + _rtl_footer)
@@ -0,0 +1,138 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import random
+import re
+
+import pytest
+
+import hpgl
+from hpgl.index import PathIndex, path_bounds, _segment_distance
+from hpgl.paths import PathList
+
+def _random_paths(n, seed=1):
+    rnd = random.Random(seed)
+    paths = []
+    for k in range(n):
+        x = rnd.uniform(0, 1000)
+        y = rnd.uniform(0, 1000)
+        pts = [(x, y)]
+        for j in range(rnd.randint(0, 4)):
+            pts.append((x+rnd.uniform(-30, 30), y+rnd.uniform(-30, 30)))
+        paths.append((rnd.randint(1, 3), 0.5, pts))
+    # a few paths spanning the whole drawing
+    paths.append((1, 0.5, [(0, 0), (1000, 1000)]))
+    paths.append((2, 0.5, [(0, 1000), (1000, 0), (500, 500)]))
+    return PathList(paths)
+
+def _brute_query(paths, x0, y0, x1, y1):
+    out = []
+    for i, (pen, width, pts) in enumerate(paths):
+        xs = [p[0] for p in pts]
+        ys = [p[1] for p in pts]
+        if min(xs) <= x1 and max(xs) >= x0 and min(ys) <= y1 and max(ys) >= y0:
+            out.append(i)
+    return out
+
+def test_path_bounds(numpy_mode):
+    paths = _random_paths(50)
+    bounds = path_bounds(paths)
+    for i, (pen, width, pts) in enumerate(paths):
+        xs = [p[0] for p in pts]
+        ys = [p[1] for p in pts]
+        assert (bounds[0][i], bounds[1][i], bounds[2][i], bounds[3][i]) == (min(xs), min(ys), max(xs), max(ys))
+
+@pytest.mark.parametrize('cells', [None, 5, 1000])
+def test_query(numpy_mode, monkeypatch, cells):
+    import hpgl.index
+    paths = _random_paths(500)
+    if cells is not None:
+        # force paths into the list of large paths
+        monkeypatch.setattr(hpgl.index, 'max_cells_per_path', cells)
+    index = PathIndex(paths)
+    rnd = random.Random(2)
+    for k in range(50):
+        x0 = rnd.uniform(-100, 1100)
+        y0 = rnd.uniform(-100, 1100)
+        x1 = x0 + rnd.uniform(-200, 200)
+        y1 = y0 + rnd.uniform(-200, 200)
+        assert index.query(x0, y0, x1, y1) == _brute_query(paths, min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+    assert index.query(-1e9, -1e9, 1e9, 1e9) == list(range(len(paths)))
+    assert index.query(2000, 2000, 3000, 3000) == []
+
+def test_nearest():
+    paths = _random_paths(300)
+    index = PathIndex(paths)
+    rnd = random.Random(3)
+    for k in range(50):
+        x = rnd.uniform(-200, 1200)
+        y = rnd.uniform(-200, 1200)
+        dist = [_segment_distance(x, y, paths.path_coords(i)) for i in range(len(paths))]
+        i, d = index.nearest(x, y)
+        assert d == min(dist)
+        assert dist[i] == d
+    assert index.nearest(-5000, -5000, max_dist=10) is None
+
+def test_segment_distance():
+    assert _segment_distance(3, 4, [0, 0]) == 5
+    assert _segment_distance(5, 3, [0, 0, 10, 0]) == 3
+    assert _segment_distance(13, 4, [0, 0, 10, 0]) == 5
+    assert _segment_distance(5, 5, [0, 0, 10, 0, 10, 10]) == 5
+
+def test_empty():
+    index = PathIndex([])
+    assert index.query(0, 0, 10, 10) == []
+    assert index.nearest(0, 0) is None
+
+def _svg_paths(svg):
+    return len(re.findall(r'<(?:path|rect) [^>]*(?:stroke|fill)=', svg))
+
+def test_window_svg():
+    paths = _random_paths(300)
+    window = (200, 300, 400, 600)
+    svg = hpgl.generate_svg((paths, 1000, 1000), window=window)
+    assert 'width="200" height="300" viewBox="200 300 200 300"' in svg
+    assert _svg_paths(svg) == len(_brute_query(paths, *window))
+    index = PathIndex(paths)
+    assert hpgl.generate_svg((paths, 1000, 1000), window=(400, 600, 200, 300), index=index) == svg
+
+def test_window_index_simplify():
+    # a prebuilt index of the unsimplified paths gives the same output as
+    # indexing the simplified paths
+    paths = PathList([(1, 0.5, [(k*40, 0), (k*40+20, 300), (k*40+40, 0)]) for k in range(50)])
+    # an arc, simplified to its chord
+    paths.add(2, 0.5, [0, 1000, 500, 1100, 1000, 1000])
+    parsed = (paths, 2000, 1100)
+    index = PathIndex(parsed[0])
+    for window in [(0, 0, 500, 200), (0, 900, 2000, 1000), (100, 50, 300, 150)]:
+        ref = hpgl.generate_svg(parsed, simplify=150, window=window)
+        assert hpgl.generate_svg(parsed, simplify=150, window=window, index=index) == ref
+    # the simplified arc lies outside this window
+    svg = hpgl.generate_svg(parsed, simplify=200, window=(0, 1040, 2000, 1100), index=index)
+    assert _svg_paths(svg) == 0
+
+def test_window_index_mismatch():
+    paths = _random_paths(10)
+    with pytest.raises(Exception):
+        hpgl.generate_svg((paths, 1000, 1000), window=(0, 0, 10, 10), index=PathIndex(paths[1:]))
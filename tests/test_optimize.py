@@ -0,0 +1,124 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import io
+import math
+import random
+
+import hpgl
+from hpgl.optimize import optimize_paths, travel_stats
+from hpgl.paths import PathList
+
+def _random_paths(n, pens=3, seed=1):
+    rnd = random.Random(seed)
+    paths = []
+    for k in range(n):
+        x = rnd.randint(0, 1000)
+        y = rnd.randint(0, 1000)
+        pts = [(x, y)]
+        for j in range(rnd.randint(0, 3)):
+            pts.append((x+rnd.randint(-50, 50), y+rnd.randint(-50, 50)))
+        paths.append((rnd.randint(1, pens), 0.5, pts))
+    return paths
+
+def _key(path):
+    pen, width, pts = path
+    return (pen, width, tuple(pts))
+
+def test_travel_stats():
+    paths = [
+        (1, 0.5, [(3, 4), (10, 4)]),
+        (1, 0.5, [(10, 0)]),
+        (2, 0.5, [(10, 0), (0, 0)]),
+        (1, 0.5, [(0, 0)]),
+    ]
+    assert travel_stats(paths) == {'travel': 9.0, 'pen_changes': 2}
+    assert travel_stats(paths, start=(3, 4)) == {'travel': 4.0, 'pen_changes': 2}
+    assert travel_stats([]) == {'travel': 0.0, 'pen_changes': 0}
+
+def test_optimize_paths():
+    paths = _random_paths(300)
+    out, report = optimize_paths(paths)
+    out = list(out)
+
+    # every path is drawn once, possibly reversed
+    assert len(out) == len(paths)
+    fwd = sorted(_key(p) for p in paths)
+    got = []
+    for p in out:
+        if _key(p) in fwd:
+            got.append(_key(p))
+        else:
+            got.append(_key((p[0], p[1], p[2][::-1])))
+    assert sorted(got) == fwd
+
+    # pens are grouped in order of first use
+    pen_order = []
+    for p in paths:
+        if p[0] not in pen_order:
+            pen_order.append(p[0])
+    assert [p[0] for p in out] == sorted([p[0] for p in paths], key=pen_order.index)
+
+    assert report['travel_before'] == travel_stats(paths)['travel']
+    assert report['travel_after'] == travel_stats(out)['travel']
+    assert report['travel_after'] < report['travel_before'] / 2
+    assert report['pen_changes_after'] == len(pen_order) - 1
+    assert report['pen_changes_before'] == travel_stats(paths)['pen_changes']
+
+def test_optimize_no_reverse():
+    paths = _random_paths(100, pens=1, seed=2)
+    out, report = optimize_paths(paths, reverse=False)
+    assert sorted(_key(p) for p in out) == sorted(_key(p) for p in paths)
+    assert report['travel_after'] <= report['travel_before']
+
+def test_optimize_line():
+    # segments along a line in shuffled order are drawn end to end
+    paths = [(1, 0.5, [(k*10, 0), (k*10+10, 0)]) for k in range(50)]
+    random.Random(3).shuffle(paths)
+    out, report = optimize_paths(paths)
+    assert report['travel_after'] == 0
+    assert list(out) == sorted(paths)
+
+def test_optimize_labels():
+    pl = PathList(_random_paths(10))
+    pl.labels = [(1, 2, 0.2, 0.3, 1, 0.03, 48, 'a')]
+    out, report = optimize_paths(pl)
+    assert out.labels == pl.labels
+
+def test_write_hpgl_round_trip():
+    paths = _random_paths(200)
+    # whole plotter units survive the round trip unchanged
+    gl = hpgl.generate_hpgl(paths)
+    parsed, max_x, max_y = hpgl.parse_hpgl(io.StringIO(gl), flip=False)
+    assert [(p[0], p[2]) for p in parsed] == [(p[0], p[2]) for p in paths]
+    # output of the optimizer reads back in its new order
+    out, report = optimize_paths(paths)
+    parsed, max_x, max_y = hpgl.parse_hpgl(io.StringIO(hpgl.generate_hpgl(out)), flip=False)
+    assert [(p[0], p[2]) for p in parsed] == [(p[0], p[2]) for p in out]
+    assert math.isclose(travel_stats(parsed)['travel'], report['travel_after'])
+
+def test_write_hpgl_rounding():
+    out = io.BytesIO()
+    hpgl.write_hpgl([(2, 0.5, [(0.4, 1.6), (10.5, 3.2)]), (2, 0.5, [(7, 8)])], out)
+    assert out.getvalue() == b'IN;\nSP2;\nPA0,2;PD;PA10,3;PU;\nPA7,8;PD;PU;\nSP0;\n'
@@ -0,0 +1,179 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import math
+import random
+
+import pytest
+
+from hpgl.paths import PathList, merge_paths, scale_coords, simplify_levels, simplify_paths
+
+paths = [
+    (1, 0.5, [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0)]),
+    (2, 1.0, [(5.0, 5.0)]),
+    (3, 0.25, [(-1.0, 2.0), (3.0, -4.0)]),
+]
+
+def test_list_interface():
+    pl = PathList(paths)
+    assert len(pl) == 3
+    assert list(pl) == paths
+    assert pl[0] == paths[0]
+    assert pl[-1] == paths[-1]
+    with pytest.raises(IndexError):
+        pl[3]
+    with pytest.raises(IndexError):
+        pl[-4]
+
+def test_slice():
+    pl = PathList(paths)
+    assert pl[0:1] == paths[0:1]
+    assert pl[1:] == paths[1:]
+    assert pl[::-1] == paths[::-1]
+    assert pl[5:] == []
+
+def test_add():
+    pl = PathList()
+    pl.add(4, 2.0, [1, 2, 3, 4])
+    pl.extend(paths)
+    assert list(pl) == [(4, 2.0, [(1.0, 2.0), (3.0, 4.0)])] + paths
+    assert list(pl.path_coords(0)) == [1, 2, 3, 4]
+
+def test_bounds():
+    assert PathList().bounds() == (0, 0, 0, 0)
+    assert PathList(paths).bounds() == (-1, -4, 10, 10)
+
+def test_flip_y():
+    pl = PathList(paths)
+    flipped = pl.flip_y(100, 10)
+    assert list(flipped) == [(pen, w, [(x+10, 100-y-10) for x, y in pts]) for pen, w, pts in paths]
+    # original is unchanged
+    assert list(pl) == paths
+
+def test_as_numpy():
+    pytest.importorskip('numpy')
+    pl = PathList(paths)
+    coords, offsets, pens, widths = pl.as_numpy()
+    assert list(coords) == [v for p in paths for pt in p[2] for v in pt]
+    assert list(offsets) == [0, 3, 4, 6]
+    assert list(pens) == [1, 2, 3]
+    assert list(widths) == [0.5, 1.0, 0.25]
+    # views share the array buffers
+    coords[0] = 7
+    assert pl[0][2][0] == (7, 0)
+
+def test_scale_coords(numpy_mode):
+    coords = list(range(-50, 50))
+    out = scale_coords(coords, (0.5, 2), (10, -3))
+    assert out == [(v+10)*0.5 if k % 2 == 0 else (v-3)*2 for k, v in enumerate(coords)]
+
+def test_bounds_flip_numpy(numpy_mode):
+    pl = PathList(paths)
+    assert pl.bounds() == (-1, -4, 10, 10)
+    assert list(pl.flip_y(100, 10)) == [(pen, w, [(x+10, 100-y-10) for x, y in pts]) for pen, w, pts in paths]
+
+def test_merge_paths():
+    fragments = [
+        (1, 0.5, [(0, 0), (1, 0)]),
+        (1, 0.5, [(1, 0), (1, 1)]),
+        (1, 0.5, [(1, 1), (2, 2), (3, 3)]),
+        # gap
+        (1, 0.5, [(4, 4), (5, 5)]),
+        # different pen
+        (2, 0.5, [(5, 5), (6, 6)]),
+        # different width
+        (2, 1.0, [(6, 6), (7, 7)]),
+        # single points are never merged
+        (2, 1.0, [(7, 7)]),
+        (2, 1.0, [(7, 7), (8, 8)]),
+        (2, 1.0, [(8, 8)]),
+    ]
+    merged = merge_paths(fragments)
+    assert isinstance(merged, PathList)
+    assert list(merged) == [
+        (1, 0.5, [(0, 0), (1, 0), (1, 1), (2, 2), (3, 3)]),
+        (1, 0.5, [(4, 4), (5, 5)]),
+        (2, 0.5, [(5, 5), (6, 6)]),
+        (2, 1.0, [(6, 6), (7, 7)]),
+        (2, 1.0, [(7, 7)]),
+        (2, 1.0, [(7, 7), (8, 8)]),
+        (2, 1.0, [(8, 8)]),
+    ]
+    assert list(merge_paths([])) == []
+
+def test_merge_paths_labels():
+    pl = PathList(paths)
+    pl.labels = [(1, 2, 0.2, 0.3, 1, 0.03, 48, 'a')]
+    merged = merge_paths(pl)
+    assert merged.labels == pl.labels
+    assert list(merged) == paths
+
+def _douglas_peucker(pts, tol):
+    """Reference recursive Douglas-Peucker"""
+
+    if len(pts) < 3:
+        return list(pts)
+    (ax, ay), (bx, by) = pts[0], pts[-1]
+    dx = bx - ax
+    dy = by - ay
+    l2 = dx*dx + dy*dy
+    best = -1
+    k = 1
+    for i in range(1, len(pts)-1):
+        px = pts[i][0] - ax
+        py = pts[i][1] - ay
+        if l2 > 0:
+            t = min(max((px*dx + py*dy) / l2, 0.0), 1.0)
+            px -= t*dx
+            py -= t*dy
+        d = math.sqrt(px*px + py*py)
+        if d > best:
+            best = d
+            k = i
+    if best <= tol:
+        return [pts[0], pts[-1]]
+    return _douglas_peucker(pts[:k+1], tol)[:-1] + _douglas_peucker(pts[k:], tol)
+
+def test_simplify_levels():
+    rnd = random.Random(1)
+    src = []
+    for n in [1, 2, 3, 5, 20, 200]:
+        pts = [(0.0, 0.0)]
+        for k in range(n-1):
+            pts.append((pts[-1][0]+rnd.uniform(-5, 10), pts[-1][1]+rnd.uniform(-5, 10)))
+        src.append((1, 0.5, pts))
+    # closed path, the end points coincide
+    src.append((2, 0.5, [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0), (0.0, 0.0)]))
+
+    tolerances = [0, 0.5, 2, 5, 50]
+    levels = simplify_levels(src, tolerances)
+    assert len(levels) == len(tolerances)
+    for tol, out in zip(tolerances, levels):
+        assert list(out) == [(pen, w, _douglas_peucker(pts, tol)) for pen, w, pts in src]
+        assert list(simplify_paths(src, tol)) == list(out)
+
+def test_simplify_collinear():
+    pts = [(float(k), 0.0) for k in range(10)] + [(9.0, 1.0)]
+    out = simplify_paths([(1, 0.5, pts)], 0.1)
+    assert list(out) == [(1, 0.5, [(0.0, 0.0), (9.0, 0.0), (9.0, 1.0)])]
@@ -0,0 +1,130 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import io
+import random
+import struct
+import zlib
+
+import pytest
+
+from hpgl import hprtl
+from hpgl import png
+
+def _read_png(data):
+    """Decode a PNG written by the png module to (rows of (r, g, b), depth, color type, IDAT count)"""
+
+    assert data[:8] == png.png_signature
+    pos = 8
+    chunks = []
+    while pos < len(data):
+        length, = struct.unpack('>L', data[pos:pos+4])
+        kind, d = data[pos+4:pos+8], data[pos+8:pos+8+length]
+        crc, = struct.unpack('>L', data[pos+8+length:pos+12+length])
+        assert crc == zlib.crc32(kind + d) & 0xffffffff
+        chunks.append((kind, d))
+        pos += length + 12
+    kinds = [c[0] for c in chunks]
+    assert kinds[0] == b'IHDR' and kinds[-1] == b'IEND'
+    width, height, depth, color_type, compression, filter, interlace = struct.unpack('>LLBBBBB', chunks[0][1])
+    palette = [tuple(d[k:k+3]) for kind, d in chunks if kind == b'PLTE' for k in range(0, len(d), 3)]
+    # checks the adler32 of the whole stream
+    raw = zlib.decompress(b''.join(d for kind, d in chunks if kind == b'IDAT'))
+    row_size = (width*depth*(3 if color_type == 2 else 1) + 7)//8
+    assert len(raw) == height*(row_size + 1)
+    rows = []
+    for y in range(height):
+        r = raw[y*(row_size+1):(y+1)*(row_size+1)]
+        assert r[0] == 0
+        r = r[1:]
+        if color_type == 2:
+            rows.append([tuple(r[x*3:x*3+3]) for x in range(width)])
+        else:
+            idx = [(r[x*depth // 8] >> (8 - depth - x*depth % 8)) & ((1 << depth) - 1) for x in range(width)]
+            rows.append([palette[i] for i in idx])
+    return rows, depth, color_type, kinds.count(b'IDAT')
+
+class _Unseekable(io.BytesIO):
+    def seekable(self):
+        return False
+
+def _image(colors, width=37, height=23):
+    rnd = random.Random(colors)
+    palette = [(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)) for k in range(colors)]
+    rows = [bytes(rnd.randrange(colors) for x in range(width)) for y in range(height)]
+    return rows, palette
+
+@pytest.mark.parametrize('colors,depth', [(2, 1), (4, 2), (11, 4), (200, 8)])
+@pytest.mark.parametrize('options', [{}, {'jobs': 3}, {'level': 0}, {'level': 9, 'jobs': 2}])
+def test_generate_png(colors, depth, options, numpy_mode, monkeypatch):
+    # small strips to split the image over many IDAT chunks
+    monkeypatch.setattr(png, 'strip_size', 100)
+    rows, palette = _image(colors)
+    ref = [[palette[i] for i in row] for row in rows]
+    got, got_depth, color_type, idat = _read_png(png.generate_png(rows, palette, **options))
+    assert got == ref
+    assert (got_depth, color_type) == (depth, 3)
+    assert idat > 1
+    assert _read_png(png.generate_png(rows, palette, bpp=24, **options))[:3] == (ref, 8, 2)
+
+def test_generate_png_rgb(numpy_mode):
+    rows, palette = _image(5)
+    ref = [[palette[i] for i in row] for row in rows]
+    assert _read_png(png.generate_png(ref))[0] == ref
+
+def test_generate_png_array():
+    numpy = pytest.importorskip('numpy')
+    a = numpy.random.RandomState(1).randint(0, 256, (20, 30, 3))
+    assert _read_png(png.generate_png(a))[0] == [[tuple(int(v) for v in px) for px in row] for row in a]
+
+def test_generate_png_palette_too_large():
+    with pytest.raises(Exception):
+        png.generate_png([bytes(2)], [(0, 0, 0)]*257)
+
+@pytest.mark.parametrize('out_type', [io.BytesIO, _Unseekable])
+def test_png_writer(out_type, numpy_mode, monkeypatch):
+    # the height is patched in or the output spooled when not given in advance
+    monkeypatch.setattr(png, 'strip_size', 100)
+    rows, palette = _image(7)
+    out = out_type()
+    out.write(b'prefix')
+    w = png.PNGWriter(out, len(rows[0]), palette, jobs=2)
+    for row in rows:
+        w.write_row(row)
+    w.close()
+    data = out.getvalue()
+    assert data[:6] == b'prefix'
+    assert data[6:] == png.generate_png(rows, palette, jobs=2)
+
+def test_hprtl2png(numpy_mode):
+    rtl = (b'\x1bE\x1b%0B\x1b%1A\x1b*r-3U\x1b*r16S\x1b*r1A\x1b*b0M' +
+        b'\x1b*b2V\xf0\x00\x1b*b2V\x0f\x00\x1b*b2W\x3c\xff' +
+        b'\x1b*b2V\x00\xff\x1b*b2V\xff\x00\x1b*b2W\x81\x81' +
+        b'\x1b*rC\x1b%0B\x1bE')
+    rows, palette = hprtl.parse_hprtl(rtl, indexed=True)
+    ref = [[palette[i] for i in row] for row in rows]
+    assert _read_png(png.hprtl2png(rtl))[0] == ref
+    out = io.BytesIO()
+    png.hprtl2png(io.BytesIO(rtl), out, jobs=2)
+    assert _read_png(out.getvalue())[0] == ref
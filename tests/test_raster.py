@@ -0,0 +1,108 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import io
+import random
+
+import pytest
+
+import hpgl
+from hpgl.paths import PathList
+from hpgl.raster import render_paths, pen_palette, units_per_inch
+
+def _reference(paths, width, height):
+    """Pixels within half the stroke width of a segment, drawn in order"""
+
+    rows = [bytearray(width) for y in range(height)]
+    for pen, w, pts in paths:
+        if not 0 < pen < len(pen_palette):
+            continue
+        if len(pts) == 1:
+            x, y = pts[0]
+            for j in range(height):
+                for i in range(width):
+                    if x <= i+0.5 < x+max(w, 1) and y <= j+0.5 < y+max(w, 1):
+                        rows[j][i] = pen
+            continue
+        r = max(w/2, 0.5)
+        for (ax, ay), (bx, by) in zip(pts, pts[1:]):
+            dx = bx - ax
+            dy = by - ay
+            l2 = dx*dx + dy*dy
+            for j in range(height):
+                for i in range(width):
+                    px = i + 0.5 - ax
+                    py = j + 0.5 - ay
+                    if l2 > 0:
+                        t = min(max((px*dx + py*dy) / l2, 0.0), 1.0)
+                        px -= t*dx
+                        py -= t*dy
+                    if px*px + py*py <= r*r:
+                        rows[j][i] = pen
+    return rows
+
+def _random_paths(n, size, seed=1):
+    rnd = random.Random(seed)
+    paths = []
+    for k in range(n):
+        pts = [(rnd.uniform(-5, size+5), rnd.uniform(-5, size+5)) for j in range(rnd.randint(1, 4))]
+        paths.append((rnd.randint(1, 9), rnd.choice([0.3, 1.0, 2.7, 6.2]), pts))
+    return paths
+
+@pytest.mark.parametrize('tile_size,jobs,threads', [(512, 1, False), (7, 1, False), (16, 3, True), (16, 2, False)])
+def test_render_paths(tile_size, jobs, threads):
+    size = 40
+    paths = _random_paths(25, size)
+    # one plotter unit per pixel
+    rows, palette = render_paths((paths, size, size), dpi=units_per_inch,
+        tile_size=tile_size, jobs=jobs, threads=threads)
+    assert palette == pen_palette
+    assert len(rows) == size
+    assert sum(map(any, rows)) > size // 2
+    assert rows == _reference(paths, size, size)
+
+def test_render_scale():
+    paths = [(2, 10, [(0, 50), (100, 50)])]
+    rows, palette = render_paths((paths, 100, 100), dpi=units_per_inch/10)
+    assert len(rows) == 10 and len(rows[0]) == 10
+    assert rows == _reference([(2, 1, [(0, 5), (10, 5)])], 10, 10)
+
+def test_render_empty():
+    rows, palette = render_paths((PathList(), 0, 0))
+    assert rows == [bytearray(1)]
+
+def test_render_labels():
+    gl = 'IN;SP1;SI1,1.5;PU;PA100,100;LBHello\x03SP2;PA100,1000;PD;PA2000,1000;PU;'
+    rendered = render_paths(hpgl.parse_hpgl(io.StringIO(gl)), dpi=200)
+    unrendered = render_paths(hpgl.parse_hpgl(io.StringIO(gl), render_labels=False), dpi=200)
+    assert rendered == unrendered
+    assert any(1 in row for row in rendered[0])
+    assert any(2 in row for row in rendered[0])
+
+def test_hpgl2bmp():
+    gl = 'IN;SP1;PU;PA0,0;PD;PA1016,1016;PU;'
+    bmp = hpgl.hpgl2bmp(io.StringIO(gl), dpi=50)
+    assert bmp[:2] == b'BM'
+    # palettized, 4 bits per pixel for the pen palette
+    assert bmp[28] == 4
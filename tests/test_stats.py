@@ -0,0 +1,93 @@
+"""
+
+Copyright (c) 2015 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import io
+
+import hpgl
+from hpgl import hprtl
+from hpgl.stats import ParseStats, timed
+
+gl = 'IN;SP1;PU0,0;PD100,0,100,100;PU;LBabc\x03;SP2;PA5,5;PD;PU;'
+
+rtl = (b'\x1bE\x1b%0B\x1b%1A\x1b*r-3U\x1b*r24S\x1b*r1A\x1b*b1M' +
+    b'\x1b*b2V\x02\xf0\x1b*b2V\x02\x0f\x1b*b2W\x02\x3c' +
+    b'\x1b*b2V\x02\x00\x1b*b2V\x02\xff\x1b*b2W\x02\x81' +
+    b'\x1b*b2V\x02\x55\x1b*b2V\x02\xaa\x1b*b2W\x02\x18' +
+    b'\x1b*rC\x1b%0B\x1bE')
+
+def _counts(stats):
+    return dict((k, c) for k, (c, t) in stats.commands.items())
+
+def test_parse_stats():
+    stats = ParseStats()
+    stats.add_command('PA', 0.5)
+    stats.add_command('PA', 0.25)
+    stats.add_rows(2)
+    stats.add_rows(2, 3)
+    stats.add_bytes(10)
+    with stats.phase('scan'):
+        pass
+    with timed(stats, 'scan'):
+        pass
+    with timed(None, 'scan'):
+        pass
+    d = stats.as_dict()
+    assert d['commands'] == {'PA': {'count': 2, 'seconds': 0.75}}
+    assert d['rows'] == {'2': 4}
+    assert d['bytes'] == 10
+    assert list(d['phases']) == ['scan'] and d['phases']['scan'] >= 0
+
+def test_hpgl_stats():
+    stats = ParseStats()
+    paths = hpgl.parse_hpgl(io.StringIO(gl), stats=stats)
+    # statistics don't change the output
+    assert hpgl.generate_svg(paths) == hpgl.generate_svg(hpgl.parse_hpgl(io.StringIO(gl)))
+    assert _counts(stats) == {'IN': 1, 'SP': 2, 'PU': 3, 'PD': 2, 'PA': 1, 'LB': 1}
+    assert stats.bytes == len(gl)
+    assert {'tokenize', 'interpret'} <= set(stats.phases)
+
+def test_hprtl_stats():
+    stats = ParseStats()
+    assert hprtl.parse_hprtl(rtl, stats=stats) == hprtl.parse_hprtl(rtl)
+    assert _counts(stats) == {'E': 2, '%': 3, '*r#U': 1, '*r#S': 1, '*r#A': 1, '*b#M': 1,
+        '*b#V': 6, '*b#W': 3, '*rC': 1}
+    assert stats.rows == {1: 9}
+    assert stats.bytes == len(rtl)
+    assert {'scan', 'combine', 'convert'} <= set(stats.phases)
+
+    # streaming records the same commands and rows
+    streamed = ParseStats()
+    out = io.BytesIO()
+    hprtl.hprtl2bmp(rtl, out, stats=streamed)
+    assert _counts(streamed) == _counts(stats)
+    assert streamed.rows == stats.rows
+    assert streamed.bytes == stats.bytes
+
+def test_preview_stats():
+    # only the rows kept in the preview are decoded
+    stats = ParseStats()
+    rows = hprtl.preview_hprtl(rtl, scale=0.5, stats=stats)
+    assert rows == hprtl.preview_hprtl(rtl, scale=0.5)
+    assert stats.rows == {1: 6}
+    assert 'index' in stats.phases